@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Benchmarks for the generators and monitors across data scales.
+
+Every benchmark runs in a fresh process so wall time, peak RSS and rows/s are
+measured in isolation. Results are written as JSON and compared against the
+committed benchmarks/baseline.json; any benchmark slower than it by more than the
+tolerance is reported as a regression (exit code 1), as is any benchmark whose
+process crashes or runs past the timeout. Runs offline.
+
+  $ python benchmarks/run.py --scales 3 4 5 6
+  $ python benchmarks/run.py --scales 3 4 5 6 --save-baseline
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "helpers"))
+from data.monitors import MONITORS
+from data.metrics import get_days_since_update, threshold_sweep
+from generate import EX2_FIELDS, draw_schedule, gauss_outage_length, generate_days, make_rng
+from sink import EXOPLANETS_SCHEMA, write_table
+
+SCALES = [3, 4, 5, 6]
+TOLERANCE = 0.25
+MIN_SLACK_SECONDS = 0.05
+POLL_SECONDS = 1.0
+TIMEOUT_SECONDS = 3600.0
+RESULTS = os.path.join(ROOT, "benchmarks", "results.json")
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+def _schedule(rows):
+  num_days = min(500, max(10, rows // 100))
+  per_day = max(1, rows // num_days)
+  rng = make_rng("benchmark")
+  schedule = draw_schedule(
+    rng, num_days, datetime(2020, 1, 1),
+    fields=EX2_FIELDS,
+    prob_duplication=0.05,
+    outage_length=gauss_outage_length,
+  )
+  kwargs = {"fields": EX2_FIELDS, "rows_per_day": (int(per_day * 0.8), int(per_day * 1.2))}
+  return rng, schedule, kwargs
+
+def bench_generate(path, rows):
+  rng, schedule, kwargs = _schedule(rows)
+  return sum(len(chunk) for chunk in generate_days(rng, schedule, **kwargs))
+
+def bench_generate_and_write(path, rows):
+  rng, schedule, kwargs = _schedule(rows)
+  conn = sqlite3.connect(path)
+  stats = write_table(conn, "EXOPLANETS", EXOPLANETS_SCHEMA, generate_days(rng, schedule, **kwargs), verbose=False)
+  conn.execute("""
+    CREATE TABLE EXOPLANETS_SCHEMA AS
+    SELECT DISTINCT DATE_ADDED AS DATE, CASE WHEN DATE_ADDED < '2020-07-19' THEN 'v1' ELSE 'v2' END AS SCHEMA
+    FROM EXOPLANETS
+  """)
+  conn.commit()
+  return stats["rows"]
+
+def bench_threshold_sweep(path, rows):
+  threshold_sweep(get_days_since_update(sqlite3.connect(path)), range(1000), betas=(0.5, 1, 2))
+  return rows
+
+def _monitor(name):
+  def bench(path, rows):
+    MONITORS[name](sqlite3.connect(path), "EXOPLANETS")
+    return rows
+  return bench
+
+BENCHMARKS = [
+  ("generate", bench_generate),
+  ("generate_and_write", bench_generate_and_write),
+  ("threshold_sweep", bench_threshold_sweep),
+  ("null_rate", "null_rate"),
+  ("schema_change", "schema_change"),
+  ("duplicates", "duplicates"),
+]
+
+def _child(name, path, rows, queue):
+  fn = dict(BENCHMARKS)[name]
+  if isinstance(fn, str): fn = _monitor(fn)
+  start_wall, start_cpu = time.perf_counter(), time.process_time()
+  n = fn(path, rows)
+  queue.put({
+    "seconds": time.perf_counter() - start_wall,
+    "cpu_seconds": time.process_time() - start_cpu,
+    "rows": n,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+  })
+
+def run_one(name, path, rows, timeout=TIMEOUT_SECONDS):
+  """Run one benchmark in a fresh process; a crash or timeout is returned as an "error"."""
+  ctx = multiprocessing.get_context("spawn")
+  results = ctx.Queue()
+  process = ctx.Process(target=_child, args=(name, path, rows, results))
+  start = time.perf_counter()
+  process.start()
+  result = None
+  while result is None:
+    try:
+      result = results.get(timeout=POLL_SECONDS)
+    except queue.Empty:
+      if process.exitcode is not None:
+        # the child may have exited right after putting its result
+        try:
+          result = results.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+          result = {"error": "exited with code {}".format(process.exitcode)}
+      elif time.perf_counter() - start > timeout:
+        process.terminate()
+        result = {"error": "timed out after {:.0f}s".format(timeout)}
+  process.join()
+  result["benchmark"] = name
+  result["scale"] = rows
+  if "error" not in result:
+    result["rows_per_s"] = result["rows"] / result["seconds"] if result["seconds"] else 0.0
+  return result
+
+def run(scales, names=None, timeout=TIMEOUT_SECONDS):
+  results = []
+  for scale in scales:
+    rows = 10 ** scale
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    path = os.path.join(workdir, "bench.db")
+    try:
+      for name, _ in BENCHMARKS:
+        if names and name not in names and name != "generate_and_write": continue
+        result = run_one(name, path, rows, timeout)
+        if "error" in result:
+          print("{:>20} 10^{} rows: FAILED ({})".format(name, scale, result["error"]))
+          results.append(result)
+          continue
+        print("{benchmark:>20} 10^{scale_exp} rows: {seconds:8.3f}s {peak_rss_mb:8.1f} MB {rows_per_s:14,.0f} rows/s".format(
+          scale_exp=scale, **result
+        ))
+        results.append(result)
+    finally:
+      shutil.rmtree(workdir)
+  return results
+
+def compare(results, baseline, tolerance=TOLERANCE, slack=MIN_SLACK_SECONDS):
+  """Benchmarks more than `tolerance` (plus `slack` seconds, to absorb timer noise
+  on tiny runs) slower than the baseline, as (name, scale, old, new).
+  """
+  old = dict(((r["benchmark"], r["scale"]), r["seconds"]) for r in baseline["results"] if "error" not in r)
+  return [
+    (r["benchmark"], r["scale"], old[(r["benchmark"], r["scale"])], r["seconds"])
+    for r in results
+    if "error" not in r and (r["benchmark"], r["scale"]) in old
+    and r["seconds"] > old[(r["benchmark"], r["scale"])] * (1 + tolerance) + slack
+  ]
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark generators and monitors across data scales.")
+  parser.add_argument("--scales", nargs="*", type=int, default=SCALES, help="powers of ten, e.g. 3 4 5 6 7 8")
+  parser.add_argument("--benchmarks", nargs="*", choices=[name for name, _ in BENCHMARKS])
+  parser.add_argument("--out", default=RESULTS)
+  parser.add_argument("--baseline", default=BASELINE)
+  parser.add_argument("--save-baseline", action="store_true")
+  parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+  parser.add_argument("--timeout", type=float, default=TIMEOUT_SECONDS, help="seconds per benchmark")
+  args = parser.parse_args()
+
+  results = run(args.scales, args.benchmarks, args.timeout)
+  failures = [result for result in results if "error" in result]
+  report = {
+    "created": datetime.now().isoformat(),
+    "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+    "results": results
+  }
+  with open(args.save_baseline and args.baseline or args.out, "w") as f:
+    json.dump(report, f, indent=2)
+
+  regressions = []
+  if not args.save_baseline:
+    with open(args.baseline) as f:
+      regressions = compare(results, json.load(f), args.tolerance)
+  for name, scale, old, new in regressions:
+    print("REGRESSION {} at {} rows: {:.3f}s -> {:.3f}s".format(name, scale, old, new))
+  for result in failures:
+    print("FAILED {} at {} rows: {}".format(result["benchmark"], result["scale"], result["error"]))
+  if regressions or failures: sys.exit(1)
+
+if __name__ == "__main__":
+  main()
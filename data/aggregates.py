@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Incrementally maintained per-day metrics for freshness and volume monitors.
+
+`refresh_daily_metrics` aggregates only the days at or after the table's
+high-watermark on DATE_ADDED (the watermark day itself is recomputed, since it
+may have received more rows), so monitors can read a few hundred aggregate
+rows instead of scanning the whole table. The first refresh indexes the
+table's DATE_ADDED, so both the refresh's range scan and the monitors'
+MAX(DATE_ADDED) check against the watermark stay proportional to the new
+days. `rebuild_daily_metrics` recomputes everything, e.g. after a backfill.
+
+  $ python data/aggregates.py data/dbs/Ex4.db EXOPLANETS [--rebuild]
+"""
+
+import argparse
+import os
+import pandas as pd
+import sqlite3
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.query import read_sql
+
+NUMERIC_TYPES = ("INT", "REAL", "FLOA", "DOUB", "NUMERIC", "DECIMAL")
+
+def table_columns(conn, table):
+  """Return [(column, declared type)] for `table` from PRAGMA table_info."""
+  return [(row[1], row[2]) for row in conn.execute("PRAGMA table_info({})".format(table))]
+
+def is_numeric(dtype):
+  return any(name in dtype.upper() for name in NUMERIC_TYPES)
+
+def create_metrics_tables(conn):
+  conn.execute("""
+    CREATE TABLE IF NOT EXISTS DAILY_ROW_COUNTS(
+      TABLE_NAME VARCHAR(16777216) NOT NULL,
+      DATE_ADDED TIMESTAMP_NTZ(6) NOT NULL,
+      ROW_COUNT INTEGER NOT NULL,
+      PRIMARY KEY (TABLE_NAME, DATE_ADDED)
+    )
+  """)
+  conn.execute("""
+    CREATE TABLE IF NOT EXISTS DAILY_COLUMN_METRICS(
+      TABLE_NAME VARCHAR(16777216) NOT NULL,
+      DATE_ADDED TIMESTAMP_NTZ(6) NOT NULL,
+      COLUMN_NAME VARCHAR(16777216) NOT NULL,
+      NULL_COUNT INTEGER NOT NULL,
+      MIN_VALUE FLOAT,
+      MAX_VALUE FLOAT,
+      SUM_VALUE FLOAT,
+      PRIMARY KEY (TABLE_NAME, DATE_ADDED, COLUMN_NAME)
+    )
+  """)
+  conn.execute("""
+    CREATE TABLE IF NOT EXISTS METRICS_WATERMARKS(
+      TABLE_NAME VARCHAR(16777216) PRIMARY KEY,
+      DATE_ADDED TIMESTAMP_NTZ(6) NOT NULL
+    )
+  """)
+
+def create_date_index(conn, table):
+  conn.execute("CREATE INDEX IF NOT EXISTS IDX_{0}_DATE_ADDED ON {0}(DATE_ADDED)".format(table))
+
+def get_watermark(conn, table):
+  create_metrics_tables(conn)
+  row = conn.execute("SELECT DATE_ADDED FROM METRICS_WATERMARKS WHERE TABLE_NAME = ?", (table,)).fetchone()
+  return row[0] if row else None
+
+def _aggregate_sql(columns, table):
+  selects = ["DATE_ADDED", "COUNT(*)"]
+  for column, dtype in columns:
+    selects.append("COUNT(*) - COUNT({})".format(column))
+    if is_numeric(dtype):
+      selects += ["MIN({0})".format(column), "MAX({0})".format(column), "SUM({0})".format(column)]
+  return "SELECT {} FROM {} WHERE DATE_ADDED >= ? GROUP BY DATE_ADDED".format(",\n  ".join(selects), table)
+
+def refresh_daily_metrics(conn, table, since=None):
+  """Aggregate days at or after `since` (default: the watermark) into the metrics tables.
+
+  Returns the number of days (re)aggregated.
+  """
+  create_metrics_tables(conn)
+  create_date_index(conn, table)
+  if since is None: since = get_watermark(conn, table)
+  if since is None: since = ""
+  columns = [(column, dtype) for column, dtype in table_columns(conn, table) if column.upper() != "DATE_ADDED"]
+
+  row_counts, column_metrics = [], []
+  for row in conn.execute(_aggregate_sql(columns, table), (since,)):
+    date, values = row[0], iter(row[2:])
+    row_counts.append((table, date, row[1]))
+    for column, dtype in columns:
+      null_count = next(values)
+      low, high, total = (next(values), next(values), next(values)) if is_numeric(dtype) else (None, None, None)
+      column_metrics.append((table, date, column, null_count, low, high, total))
+
+  with conn:
+    conn.execute("DELETE FROM DAILY_ROW_COUNTS WHERE TABLE_NAME = ? AND DATE_ADDED >= ?", (table, since))
+    conn.execute("DELETE FROM DAILY_COLUMN_METRICS WHERE TABLE_NAME = ? AND DATE_ADDED >= ?", (table, since))
+    conn.executemany("INSERT INTO DAILY_ROW_COUNTS VALUES (?, ?, ?)", row_counts)
+    conn.executemany("INSERT INTO DAILY_COLUMN_METRICS VALUES (?, ?, ?, ?, ?, ?, ?)", column_metrics)
+    if row_counts:
+      conn.execute(
+        "INSERT OR REPLACE INTO METRICS_WATERMARKS VALUES (?, ?)",
+        (table, max(date for _, date, _ in row_counts))
+      )
+  return len(row_counts)
+
+def rebuild_daily_metrics(conn, table):
+  """Drop every aggregate for `table` and recompute them from scratch."""
+  create_metrics_tables(conn)
+  with conn:
+    conn.execute("DELETE FROM METRICS_WATERMARKS WHERE TABLE_NAME = ?", (table,))
+  return refresh_daily_metrics(conn, table, since="")
+
+def get_daily_row_counts(conn, table):
+  df = read_sql(
+    conn, "SELECT DATE_ADDED, ROW_COUNT FROM DAILY_ROW_COUNTS WHERE TABLE_NAME = ? ORDER BY DATE_ADDED", (table,)
+  )
+  return df.rename(columns={clmn: clmn.lower() for clmn in df.columns})
+
+def get_daily_null_rates(conn, table):
+  """Null rate per day (rows) and column (columns) from the aggregates."""
+  df = read_sql(conn, """
+    SELECT
+      M.DATE_ADDED,
+      M.COLUMN_NAME,
+      CAST(M.NULL_COUNT AS FLOAT) / R.ROW_COUNT AS NULL_RATE
+    FROM
+      DAILY_COLUMN_METRICS M
+      JOIN DAILY_ROW_COUNTS R
+        ON M.TABLE_NAME = R.TABLE_NAME AND M.DATE_ADDED = R.DATE_ADDED
+    WHERE
+      M.TABLE_NAME = ?
+    """, (table,))
+  df = df.pivot(index="DATE_ADDED", columns="COLUMN_NAME", values="NULL_RATE")
+  return df.rename_axis(index="date_added", columns=None)
+
+def get_days_since_update(conn, table):
+  """Same frame as `data.metrics.get_days_since_update`, read from the aggregates."""
+  df = get_daily_row_counts(conn, table)
+  dates = pd.to_datetime(df["date_added"])
+  df["days_since_update"] = (dates - dates.shift(1)).dt.days
+  return df[["date_added", "days_since_update"]]
+
+def main():
+  parser = argparse.ArgumentParser(description="Maintain per-day metrics for a table.")
+  parser.add_argument("db")
+  parser.add_argument("table")
+  parser.add_argument("--rebuild", action="store_true", help="recompute all history, e.g. after a backfill")
+  args = parser.parse_args()
+  conn = sqlite3.connect(args.db)
+  if args.rebuild: days = rebuild_daily_metrics(conn, args.table)
+  else: days = refresh_daily_metrics(conn, args.table)
+  print("aggregated {} days of {} (watermark {})".format(days, args.table, get_watermark(conn, args.table)))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Day-by-day backtests of the monitors against the INCIDENTS ledger.
+
+Running a monitor over the finished table lets it see the future and hides
+how long detection took. `replay` instead walks a table's history one
+calendar day at a time: a single ordered scan feeds each day's rows to
+monitors that keep their own incremental state (last update, trailing
+windows of daily counts and null rates, the set of seen ids), so every day
+costs O(its rows + window) and a replay costs O(days) no matter how long
+the history is. Each alert is stamped with the simulated day it would have
+fired on, and `backtest` scores the run with `data.evaluate`.
+
+Volume, null-rate and uniqueness alerts match their batch monitors day for
+day. Freshness fires on the day a gap first exceeds the threshold rather than
+on the day data resumes, so backtests score it with no tolerance.
+
+The checked-in databases have no INCIDENTS table, so replays of them (like
+Ex4.db's 500 days below) are scored against the ledger
+`data.evaluate.derive_incidents` reconstructs from the rows.
+
+  $ python data/backtest.py data/dbs/Ex4.db EXOPLANETS
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+import sys
+from collections import deque
+from datetime import date, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.evaluate import evaluate, load_incidents
+from data.monitors import FRESHNESS_THRESHOLD_DAYS, VOLUME_WINDOW, VOLUME_Z_THRESHOLD
+from data.trace import span
+from data.uniqueness import EXACT_LIMIT, UniquenessState
+
+CHUNK_ROWS = 100000
+NULL_RATE_WINDOW = 14
+NULL_RATE_Z_THRESHOLD = 3.0
+NULL_RATE_MIN_INCREASE = 0.2
+
+class FreshnessState:
+  """Alerts once per gap, on the first day with no update for over `threshold_days`."""
+
+  def __init__(self, threshold_days=FRESHNESS_THRESHOLD_DAYS):
+    self.threshold_days = threshold_days
+    self.last_update = None
+
+  def observe(self, day, rows):
+    if len(rows):
+      self.last_update = day
+      return []
+    if self.last_update is None: return []
+    days_since_update = (day - self.last_update).days
+    if days_since_update != self.threshold_days + 1: return []
+    return [{"days_since_update": days_since_update}]
+
+class _Window:
+  """The last `size` observations and their sample mean and std."""
+
+  def __init__(self, size):
+    self.values = deque(maxlen=size)
+
+  def stats(self):
+    if len(self.values) < 2: return None, None
+    history = np.asarray(self.values, dtype=float)
+    return history.mean(axis=0), history.std(axis=0, ddof=1)
+
+class VolumeState:
+  """`volume_monitor`: daily row count against the previous `window` days with data."""
+
+  def __init__(self, window=VOLUME_WINDOW, z_threshold=VOLUME_Z_THRESHOLD):
+    self.z_threshold = z_threshold
+    self.history = _Window(window)
+
+  def observe(self, day, rows):
+    if not len(rows): return []
+    rows_added = len(rows)
+    mean, std = self.history.stats()
+    self.history.values.append(rows_added)
+    if mean is None: return []
+    with np.errstate(divide="ignore", invalid="ignore"):
+      z = (rows_added - mean) / std
+    if not abs(z) >= self.z_threshold: return []
+    return [{"rows_added": rows_added, "z_score": float(z)}]
+
+class NullRateState:
+  """`null_rate_anomalies` for every column, one day at a time."""
+
+  def __init__(
+    self, window=NULL_RATE_WINDOW, z_threshold=NULL_RATE_Z_THRESHOLD, min_increase=NULL_RATE_MIN_INCREASE
+  ):
+    self.window = window
+    self.z_threshold = z_threshold
+    self.min_increase = min_increase
+    self.columns = None
+    self.history = _Window(window)
+
+  def observe(self, day, rows):
+    if not len(rows): return []
+    if self.columns is None: self.columns = [column for column in rows.columns if column != "date_added"]
+    rates = rows[self.columns].isna().to_numpy().mean(axis=0)
+    baseline, spread = self.history.stats()
+    self.history.values.append(rates)
+    if baseline is None: return []
+    increase = rates - baseline
+    with np.errstate(divide="ignore", invalid="ignore"):
+      z = increase / np.nan_to_num(spread)
+    flagged = np.flatnonzero((increase >= self.min_increase) & (z >= self.z_threshold))
+    return [
+      {"column": self.columns[i], "null_rate": float(rates[i]), "baseline": float(baseline[i])}
+      for i in flagged
+    ]
+
+class UniquenessStateMonitor:
+  """`uniqueness_monitor` with its id set kept in memory for the replay."""
+
+  def __init__(self, exact_limit=EXACT_LIMIT):
+    self.state = UniquenessState(exact_limit)
+
+  def observe(self, day, rows):
+    if not len(rows) or "_id" not in rows.columns: return []
+    is_duplicate, first = self.state.check(rows["_id"].to_numpy(), rows["date_added"].to_numpy())
+    if not is_duplicate.any(): return []
+    first_seen = date.fromordinal(int(first[is_duplicate].min()) + date(1970, 1, 1).toordinal())
+    return [{"duplicates": int(is_duplicate.sum()), "first_seen": first_seen.isoformat()}]
+
+BACKTEST_MONITORS = {
+  "freshness": FreshnessState,
+  "volume": VolumeState,
+  "null_rate": NullRateState,
+  "uniqueness": UniquenessStateMonitor,
+}
+
+def read_days(conn, table, start=None, end=None, chunk_rows=CHUNK_ROWS):
+  """Yield (day, rows) for every day with rows, from one ordered scan of `table`."""
+  where = ["DATE_ADDED >= ?"] * (start is not None) + ["DATE_ADDED <= ?"] * (end is not None)
+  params = tuple(value for value in (start, end) if value is not None)
+  SQL = "SELECT * FROM {} {} ORDER BY DATE_ADDED".format(table, "WHERE " + " AND ".join(where) if where else "")
+  pending = None
+  for chunk in pd.read_sql_query(SQL, conn, params=params, chunksize=chunk_rows):
+    chunk = chunk.rename(columns={clmn: clmn.lower() for clmn in chunk.columns})
+    if pending is not None: chunk = pd.concat([pending, chunk], ignore_index=True)
+    if chunk.empty: continue
+    # the last day may continue into the next chunk
+    dates = chunk["date_added"].to_numpy()
+    bounds = np.flatnonzero(dates[1:] != dates[:-1]) + 1
+    starts = np.concatenate([[0], bounds])
+    for lo, hi in zip(starts[:-1], starts[1:]):
+      yield date.fromisoformat(dates[lo]), chunk.iloc[lo:hi]
+    pending = chunk.iloc[starts[-1]:]
+  if pending is not None and len(pending):
+    yield date.fromisoformat(pending["date_added"].iloc[0]), pending
+
+def replay(conn, table, monitors, start=None, end=None, chunk_rows=CHUNK_ROWS):
+  """Feed `table`'s history, one simulated calendar day at a time, to `monitors`.
+
+  `monitors` maps names to objects with `observe(day, rows)`, which get every
+  day from the first with data through `end` (days without rows get an empty
+  frame) and return a list of alert detail dicts. Returns a frame of table,
+  monitor, date_added plus the detail columns.
+  """
+  records = []
+  empty, day = None, None
+  with span("replay", "backtest", table=table) as traced:
+    for next_day, rows in read_days(conn, table, start, end, chunk_rows):
+      if empty is None: empty = rows.iloc[:0]
+      while day is not None and day < next_day - timedelta(days=1):
+        day += timedelta(days=1)
+        records += _observe(table, monitors, day, empty)
+      day = next_day
+      records += _observe(table, monitors, day, rows)
+    if day is not None and end is not None:
+      while day < date.fromisoformat(end):
+        day += timedelta(days=1)
+        records += _observe(table, monitors, day, empty)
+    traced.set(alerts=len(records))
+  return pd.DataFrame(records, columns=None if records else ["table", "monitor", "date_added"])
+
+def _observe(table, monitors, day, rows):
+  return [
+    dict(table=table, monitor=name, date_added=day.isoformat(), **alert)
+    for name, monitor in monitors.items()
+    for alert in monitor.observe(day, rows)
+  ]
+
+def backtest(conn, tables, monitors=tuple(BACKTEST_MONITORS), kinds=None, tolerance_days=0, per_table=False):
+  """Replay every table with fresh monitor state and score the alerts.
+
+  Returns (alerts, scores), where scores come from `data.evaluate.evaluate`
+  with one row per monitor (and table, with `per_table`).
+  """
+  alerts = pd.concat([
+    replay(conn, table, dict((name, BACKTEST_MONITORS[name]()) for name in monitors))
+    for table in tables
+  ], ignore_index=True)
+  incidents = load_incidents(conn, tables, kinds)
+  scores = evaluate(
+    alerts, incidents, "monitor", tolerance_days, betas=(1, 0.5, 2), per_table=per_table, groups=list(monitors)
+  )
+  return alerts, scores
+
+def main():
+  parser = argparse.ArgumentParser(description="Replay tables day by day through incremental monitors.")
+  parser.add_argument("db")
+  parser.add_argument("tables", nargs="*", help="tables to replay (default: every table in INCIDENTS)")
+  parser.add_argument("--monitors", nargs="*", default=list(BACKTEST_MONITORS), choices=list(BACKTEST_MONITORS))
+  parser.add_argument("--kinds", nargs="*", help="incident kinds to score against (default: all)")
+  parser.add_argument("--tolerance", type=int, default=0, help="days after an incident an alert still counts")
+  parser.add_argument("--per-table", action="store_true")
+  parser.add_argument("--alerts", help="write the alerts to this CSV")
+  args = parser.parse_args()
+  conn = sqlite3.connect(args.db)
+  tables = args.tables or list(pd.unique(load_incidents(conn)["table"]))
+  alerts, scores = backtest(conn, tables, args.monitors, args.kinds, args.tolerance, args.per_table)
+  if args.alerts: alerts.to_csv(args.alerts, index=False)
+  with pd.option_context("display.width", 200, "display.max_columns", 20):
+    print(scores)
+
+if __name__ == "__main__":
+  main()
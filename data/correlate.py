@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Cross-table alert correlation over time intervals.
+
+Alerts from any monitor are indexed per table as intervals sorted by start
+day. Conjunctive questions like "downstream anomaly within K days after an
+upstream schema change or outage" are answered with a sort-merge sweep
+(binary searches over the sorted starts) instead of a cross join, so the cost
+is O((n + m) log n + matches) per upstream/downstream table pair.
+"""
+
+import numpy as np
+import pandas as pd
+
+def make_alerts(table, monitor, starts, ends=None):
+  """Build an alert frame (table, monitor, start, end) from lists of dates."""
+  starts = pd.to_datetime(pd.Series(list(starts)))
+  ends = starts if ends is None else pd.to_datetime(pd.Series(list(ends)))
+  return pd.DataFrame({"table": table, "monitor": monitor, "start": starts.values, "end": ends.values})
+
+def _days(values):
+  return pd.to_datetime(pd.Series(values)).values.astype("datetime64[D]").astype(np.int64)
+
+class AlertIndex:
+  """Alerts grouped by table, each group sorted by start day."""
+
+  def __init__(self, alerts):
+    alerts = alerts.reset_index(drop=True)
+    if "end" not in alerts: alerts = alerts.assign(end=alerts["start"])
+    self.alerts = alerts
+    starts, ends = _days(alerts["start"]), _days(alerts["end"])
+    self.tables = {}
+    for table, rows in alerts.groupby("table").indices.items():
+      order = rows[np.argsort(starts[rows], kind="stable")]
+      self.tables[table] = {
+        "rows": order,
+        "start": starts[order],
+        "end": ends[order],
+        "max_length": int((ends[order] - starts[order]).max()) if len(order) else 0
+      }
+
+  def overlapping(self, table, start, end):
+    """Rows of `alerts` for `table` whose interval intersects [start, end]."""
+    group = self.tables.get(table)
+    if group is None: return self.alerts.iloc[[]]
+    lo_day, hi_day = _days([start, end])
+    lo = np.searchsorted(group["start"], lo_day - group["max_length"], side="left")
+    hi = np.searchsorted(group["start"], hi_day, side="right")
+    candidates = np.arange(lo, hi)
+    candidates = candidates[group["end"][candidates] >= lo_day]
+    return self.alerts.iloc[group["rows"][candidates]]
+
+  def preceding(self, table, days, within_days):
+    """Match each day in `days` to this table's alerts active within `within_days` before it.
+
+    Returns (position in `days`, row in `alerts`) index arrays for every match,
+    i.e. alerts with start <= day <= end + within_days.
+    """
+    group = self.tables.get(table)
+    days = np.asarray(days, dtype=np.int64)
+    if group is None or not len(days): return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    lo = np.searchsorted(group["start"], days - within_days - group["max_length"], side="left")
+    hi = np.searchsorted(group["start"], days, side="right")
+    counts = hi - lo
+    left = np.repeat(np.arange(len(days)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    candidates = np.repeat(lo, counts) + offsets
+    keep = group["end"][candidates] + within_days >= days[left]
+    return left[keep], group["rows"][candidates[keep]]
+
+def correlate(upstream, downstream, within_days, lineage=None):
+  """Downstream alerts that start within `within_days` after (or during) an upstream alert.
+
+  `upstream` and `downstream` are alert frames with table, monitor, start and
+  optionally end columns. `lineage` lists the (upstream table, downstream
+  table) pairs to check; by default every pair is checked. Returns one row
+  per matching pair of alerts with the lag in days.
+  """
+  index = upstream if isinstance(upstream, AlertIndex) else AlertIndex(upstream)
+  downstream = downstream.reset_index(drop=True)
+  starts = _days(downstream["start"])
+  if lineage is None:
+    lineage = [(up, down) for up in index.tables for down in downstream["table"].unique()]
+
+  by_table = downstream.groupby("table").indices
+  matches = []
+  for up_table, down_table in lineage:
+    rows = by_table.get(down_table)
+    if rows is None: continue
+    left, right = index.preceding(up_table, starts[rows], within_days)
+    if not len(left): continue
+    up, down = index.alerts.iloc[right], downstream.iloc[rows[left]]
+    matches.append(pd.DataFrame({
+      "upstream_table": up["table"].values,
+      "upstream_monitor": up["monitor"].values,
+      "upstream_start": up["start"].values,
+      "downstream_table": down["table"].values,
+      "downstream_monitor": down["monitor"].values,
+      "downstream_start": down["start"].values,
+      "lag_days": starts[rows[left]] - _days(up["start"])
+    }))
+  if not matches:
+    return pd.DataFrame(columns=[
+      "upstream_table", "upstream_monitor", "upstream_start",
+      "downstream_table", "downstream_monitor", "downstream_start", "lag_days"
+    ])
+  return pd.concat(matches, ignore_index=True)
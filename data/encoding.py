@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Optional compact encoding of the exercise tables, on disk and in memory.
+
+Columns are encoded only when every value round-trips:
+- "uuid": canonical lowercase UUID text stored as 16-byte BLOBs
+- "day": 'YYYY-MM-DD' dates stored as INTEGER days since 1970-01-01
+- "dictionary": low-cardinality text (like ATMOSPHERE) stored as INTEGER codes
+  into the ENCODING_DICTIONARY table
+
+ENCODED_COLUMNS records each encoded column's encoding and original declared
+type, so `decode_table` restores the original table exactly and
+`create_decoded_view` exposes it to unchanged SQL as <TABLE>_DECODED.
+`load_table` reads an encoded table into a compact frame (bytes ids, int32
+days, categoricals, and float32 wherever float64 values survive the
+round trip); `decode_frame` turns that back into the usual object columns.
+SQLite always stores REAL as 8 bytes, so float32 only applies in memory.
+Full-precision floats make up most of each row, which caps the savings: on
+the exercise databases files shrink about 1.5x (1.25x counting the DATE_ADDED
+index the encoded copy adds) and frames about 2x.
+
+  $ python data/encoding.py data/dbs/Ex4.db Ex4.encoded.db
+  $ python data/encoding.py Ex4.encoded.db Ex4.decoded.db --decode
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+import sqlite3
+import time
+
+CHUNK_ROWS = 100000
+BATCH_SIZE = 10000
+DICTIONARY_LIMIT = 256
+
+UUID_GLOB = "-".join("[0-9a-f]" * n for n in (8, 4, 4, 4, 12))
+DATE_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]"
+STORAGE_TYPES = {"uuid": "BLOB", "day": "INTEGER", "dictionary": "INTEGER"}
+
+def create_catalog(conn):
+  conn.execute("""
+    CREATE TABLE IF NOT EXISTS ENCODED_COLUMNS(
+      TABLE_NAME VARCHAR(16777216) NOT NULL,
+      COLUMN_NAME VARCHAR(16777216) NOT NULL,
+      DECLARED_TYPE VARCHAR(16777216) NOT NULL,
+      ENCODING VARCHAR(16777216) NOT NULL
+    )""")
+  conn.execute("""
+    CREATE TABLE IF NOT EXISTS ENCODING_DICTIONARY(
+      TABLE_NAME VARCHAR(16777216) NOT NULL,
+      COLUMN_NAME VARCHAR(16777216) NOT NULL,
+      CODE INTEGER NOT NULL,
+      VALUE VARCHAR(16777216) NOT NULL
+    )""")
+
+def _violations(conn, table, column, condition):
+  return conn.execute(
+    "SELECT COUNT(*) FROM {0} WHERE {1} IS NOT NULL AND NOT ({2})".format(table, column, condition.format(column))
+  ).fetchone()[0]
+
+def choose_encodings(conn, table):
+  """{column: encoding} for the columns of `table` that can be encoded losslessly."""
+  encodings = {}
+  for _, column, dtype, _, _, _ in conn.execute("PRAGMA table_info({})".format(table)).fetchall():
+    if conn.execute("SELECT COUNT(*) FROM {0} WHERE TYPEOF({1}) = 'text'".format(table, column)).fetchone()[0] == 0:
+      continue
+    if not _violations(conn, table, column, "TYPEOF({{0}}) = 'text' AND {{0}} GLOB '{}'".format(UUID_GLOB)):
+      encodings[column] = "uuid"
+    elif not _violations(conn, table, column, "TYPEOF({{0}}) = 'text' AND {{0}} GLOB '{}' AND DATE({{0}}) = {{0}}".format(DATE_GLOB)):
+      encodings[column] = "day"
+    elif not _violations(conn, table, column, "TYPEOF({0}) = 'text'") and conn.execute(
+      "SELECT COUNT(DISTINCT {0}) FROM {1}".format(column, table)
+    ).fetchone()[0] <= DICTIONARY_LIMIT:
+      encodings[column] = "dictionary"
+  return encodings
+
+def encode_uuids(ids):
+  return np.array([None if i is None else bytes.fromhex(i.replace("-", "")) for i in ids], dtype=object)
+
+def decode_uuids(blobs):
+  def fmt(h):
+    return "-".join((h[:8], h[8:12], h[12:16], h[16:20], h[20:]))
+  return np.array([None if b is None else fmt(bytes(b).hex()) for b in blobs], dtype=object)
+
+def encode_days(dates):
+  """'YYYY-MM-DD' strings to days since 1970-01-01 (nullable Int32)."""
+  days = np.asarray(pd.Series(dates).fillna("NaT"), dtype="datetime64[D]")
+  return pd.Series(days.astype(np.int64)).where(~np.isnat(days)).astype("Int32")
+
+def decode_days(days):
+  days = pd.Series(days).astype("float64")
+  text = np.datetime_as_string(np.where(days.notna(), days.fillna(0), 0).astype("int64").astype("datetime64[D]"))
+  return pd.Series(text, dtype=object).where(days.notna().to_numpy(), None).to_numpy()
+
+def encode_dictionary(values, dictionary):
+  """Codes of `values` in `dictionary` (nullable Int32)."""
+  values = pd.Series(values)
+  return pd.Series(dictionary.get_indexer(values)).where(values.notna().to_numpy()).astype("Int32")
+
+def compact_floats(df):
+  """Downcast float64 columns to float32 where every value survives the round trip."""
+  for column in df.columns:
+    if df[column].dtype == np.float64:
+      values = df[column].to_numpy()
+      narrow = values.astype(np.float32)
+      if np.array_equal(narrow.astype(np.float64), values, equal_nan=True): df[column] = narrow
+  return df
+
+def load_dictionaries(conn, table):
+  """{column: pd.Index of values, positioned by code}."""
+  dictionaries = {}
+  for column, code, value in conn.execute(
+    "SELECT COLUMN_NAME, CODE, VALUE FROM ENCODING_DICTIONARY WHERE TABLE_NAME = ? ORDER BY COLUMN_NAME, CODE", (table,)
+  ):
+    dictionaries.setdefault(column, []).append(value)
+  return dict((column, pd.Index(values)) for column, values in dictionaries.items())
+
+def load_encodings(conn, table):
+  """[(column, declared type, encoding or None)] in table order."""
+  encoded = dict(
+    (row[0], (row[1], row[2])) for row in conn.execute(
+      "SELECT COLUMN_NAME, DECLARED_TYPE, ENCODING FROM ENCODED_COLUMNS WHERE TABLE_NAME = ?", (table,)
+    )
+  )
+  return [
+    (row[1],) + encoded.get(row[1], (row[2] + (" NOT NULL" if row[3] else ""), None))
+    for row in conn.execute("PRAGMA table_info({})".format(table)).fetchall()
+  ]
+
+def _records(df, batch_size):
+  values = df.astype(object).where(df.notna(), None).to_numpy()
+  for i in range(0, len(values), batch_size):
+    yield [tuple(row) for row in values[i:i + batch_size]]
+
+def _convert(src, dst, table, columns, convert, chunk_rows, batch_size):
+  SQL = "SELECT * FROM {} ORDER BY ROWID".format(table)
+  insert = "INSERT INTO {} VALUES ({})".format(table, ", ".join("?" * len(columns)))
+  rows = 0
+  for chunk in pd.read_sql_query(SQL, src, chunksize=chunk_rows):
+    chunk = convert(chunk)
+    with dst:
+      for batch in _records(chunk, batch_size):
+        dst.executemany(insert, batch)
+        rows += len(batch)
+  return rows
+
+def _storage_type(dtype, encoding):
+  return STORAGE_TYPES[encoding] + (" NOT NULL" if dtype.upper().endswith("NOT NULL") else "")
+
+def _create(conn, table, columns, indexes):
+  conn.execute("DROP TABLE IF EXISTS {}".format(table))
+  conn.execute("CREATE TABLE {}(\n  {}\n)".format(table, ",\n  ".join("{} {}".format(*column) for column in columns)))
+  for column in indexes:
+    conn.execute("CREATE INDEX IF NOT EXISTS IDX_{0}_{1} ON {0}({1})".format(table, column))
+
+def encode_table(src, dst, table, chunk_rows=CHUNK_ROWS, batch_size=BATCH_SIZE):
+  """Copy `table` from `src` into `dst` with every losslessly encodable column encoded."""
+  encodings = choose_encodings(src, table)
+  declared = [
+    (row[1], row[2] + (" NOT NULL" if row[3] else "")) for row in src.execute("PRAGMA table_info({})".format(table))
+  ]
+  dictionaries = {}
+  for column, encoding in encodings.items():
+    if encoding == "dictionary":
+      dictionaries[column] = pd.Index([row[0] for row in src.execute(
+        "SELECT DISTINCT {0} FROM {1} WHERE {0} IS NOT NULL ORDER BY {0}".format(column, table)
+      )])
+
+  create_catalog(dst)
+  with dst:
+    dst.execute("DELETE FROM ENCODED_COLUMNS WHERE TABLE_NAME = ?", (table,))
+    dst.execute("DELETE FROM ENCODING_DICTIONARY WHERE TABLE_NAME = ?", (table,))
+    dst.executemany("INSERT INTO ENCODED_COLUMNS VALUES (?, ?, ?, ?)", [
+      (table, column, dtype, encodings[column]) for column, dtype in declared if column in encodings
+    ])
+    dst.executemany("INSERT INTO ENCODING_DICTIONARY VALUES (?, ?, ?, ?)", [
+      (table, column, code, value) for column, values in dictionaries.items() for code, value in enumerate(values)
+    ])
+    _create(dst, table, [
+      (column, _storage_type(dtype, encodings[column]) if column in encodings else dtype) for column, dtype in declared
+    ], [column for column, encoding in encodings.items() if encoding == "day"])
+
+  def convert(chunk):
+    for column, encoding in encodings.items():
+      if encoding == "uuid": chunk[column] = encode_uuids(chunk[column].to_numpy())
+      elif encoding == "day": chunk[column] = encode_days(chunk[column])
+      else: chunk[column] = encode_dictionary(chunk[column], dictionaries[column])
+    return chunk
+  return _convert(src, dst, table, declared, convert, chunk_rows, batch_size)
+
+def decode_frame(df, encodings, dictionaries=None):
+  """Turn a frame read from an encoded table (or from `load_table`) back into the original values."""
+  df = df.copy()
+  for column, encoding in encodings.items():
+    key = column.lower() if column.lower() in df.columns else column
+    if key not in df.columns: continue
+    if encoding == "uuid": df[key] = decode_uuids(df[key].to_numpy())
+    elif encoding == "day": df[key] = decode_days(df[key])
+    elif isinstance(df[key].dtype, pd.CategoricalDtype): df[key] = df[key].astype(object).where(df[key].notna(), None)
+    else:
+      codes = pd.Series(df[key]).astype("float64")
+      values = dictionaries[column].to_numpy(dtype=object)[codes.fillna(0).astype(np.int64).to_numpy()]
+      df[key] = np.where(codes.notna().to_numpy(), values, None)
+  return df
+
+def decode_table(src, dst, table, chunk_rows=CHUNK_ROWS, batch_size=BATCH_SIZE):
+  """Restore an encoded `table` from `src` into `dst` with its original types and values."""
+  columns = load_encodings(src, table)
+  encodings = dict((column, encoding) for column, _, encoding in columns if encoding)
+  dictionaries = load_dictionaries(src, table)
+  _create(dst, table, [(column, dtype) for column, dtype, _ in columns], [
+    column for column, encoding in encodings.items() if encoding == "day"
+  ])
+  return _convert(
+    src, dst, table, columns, lambda chunk: decode_frame(chunk, encodings, dictionaries), chunk_rows, batch_size
+  )
+
+def load_table(conn, table, columns=None):
+  """Read an encoded table into a compact frame with lowercase column names.
+
+  Ids stay 16-byte `bytes`, days are int32 (nullable Int32 if any are NULL),
+  dictionary columns are categoricals, and floats are float32 where lossless.
+  """
+  encodings = dict((column, encoding) for column, _, encoding in load_encodings(conn, table) if encoding)
+  dictionaries = load_dictionaries(conn, table)
+  df = pd.read_sql_query("SELECT {} FROM {}".format(", ".join(columns) if columns else "*", table), conn)
+  for column in df.columns:
+    encoding = encodings.get(column)
+    if encoding == "day":
+      days = df[column].astype("Int32")
+      df[column] = days.astype(np.int32) if days.notna().all() else days
+    elif encoding == "dictionary":
+      codes = df[column].fillna(-1).astype(np.int32).to_numpy()
+      df[column] = pd.Categorical.from_codes(codes, categories=dictionaries[column])
+  df = compact_floats(df)
+  return df.rename(columns={clmn: clmn.lower() for clmn in df.columns})
+
+def create_decoded_view(conn, table):
+  """<TABLE>_DECODED: `table` with its original values, for SQL written against the plain schema."""
+  selects = []
+  for column, _, encoding in load_encodings(conn, table):
+    if encoding == "uuid":
+      h = "LOWER(HEX({}))".format(column)
+      selects.append("{0} || '-' || {1} || '-' || {2} || '-' || {3} || '-' || {4} AS {5}".format(*[
+        "SUBSTR({}, {}, {})".format(h, start, length) for start, length in ((1, 8), (9, 4), (13, 4), (17, 4), (21, 12))
+      ] + [column]))
+    elif encoding == "day":
+      selects.append("DATE({0} + 2440587.5) AS {0}".format(column))
+    elif encoding == "dictionary":
+      selects.append(
+        "(SELECT VALUE FROM ENCODING_DICTIONARY WHERE TABLE_NAME = '{0}' AND COLUMN_NAME = '{1}' AND CODE = {1}) AS {1}"
+        .format(table, column)
+      )
+    else:
+      selects.append(column)
+  with conn:
+    conn.execute("DROP VIEW IF EXISTS {}_DECODED".format(table))
+    conn.execute("CREATE VIEW {}_DECODED AS SELECT\n  {}\nFROM {}".format(table, ",\n  ".join(selects), table))
+
+def tables_with(conn, column="DATE_ADDED"):
+  tables = [row[0] for row in conn.execute(
+    "SELECT NAME FROM SQLITE_MASTER WHERE TYPE = 'table' AND NAME NOT LIKE 'sqlite_%' ORDER BY NAME"
+  )]
+  return [
+    table for table in tables
+    if any(row[1].upper() == column for row in conn.execute("PRAGMA table_info({})".format(table)))
+  ]
+
+def used_bytes(conn):
+  """Bytes in the pages `conn`'s database uses, i.e. its size once VACUUMed."""
+  page_count, free_pages, page_size = (
+    conn.execute("PRAGMA {}".format(pragma)).fetchone()[0] for pragma in ("page_count", "freelist_count", "page_size")
+  )
+  return (page_count - free_pages) * page_size
+
+def main():
+  parser = argparse.ArgumentParser(description="Encode a database's tables compactly, or decode them back.")
+  parser.add_argument("src")
+  parser.add_argument("dst")
+  parser.add_argument("tables", nargs="*", help="tables to convert (default: every table with DATE_ADDED)")
+  parser.add_argument("--decode", action="store_true")
+  parser.add_argument("--views", action="store_true", help="also create <TABLE>_DECODED views")
+  args = parser.parse_args()
+  src, dst = sqlite3.connect(args.src), sqlite3.connect(args.dst)
+  if args.decode:
+    tables = args.tables or [row[0] for row in src.execute("SELECT DISTINCT TABLE_NAME FROM ENCODED_COLUMNS")]
+  else:
+    tables = args.tables or tables_with(src)
+  for table in tables:
+    start = time.perf_counter()
+    rows = (decode_table if args.decode else encode_table)(src, dst, table)
+    if args.views and not args.decode: create_decoded_view(dst, table)
+    print("{} {} rows of {} in {:.2f}s".format("decoded" if args.decode else "encoded", rows, table, time.perf_counter() - start))
+  dst.execute("VACUUM")
+  print("{}: {} bytes in use, {}: {} bytes after VACUUM".format(args.src, used_bytes(src), args.dst, used_bytes(dst)))
+
+if __name__ == "__main__":
+  main()
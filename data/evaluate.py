@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Score detector alerts against the generators' INCIDENTS ledger.
+
+Incidents are inclusive [start, end] day intervals per table. An alert is a
+true positive when it falls inside an incident of its table, extended by
+`tolerance_days` past the end (freshness alerts fire on the day data resumes,
+so they want `tolerance_days=1`). An incident is detected when at least one
+alert falls inside it, and its detection delay is the first such alert's
+distance from `start`. Databases written before the generators kept a ledger
+(the checked-in Ex1/Ex2/Ex4.db) are scored against incidents reconstructed
+from the data by `derive_incidents`.
+
+Every (group, table, day) is encoded as one integer key, with tables spaced
+far enough apart that intervals never cross, so any number of tables and
+detector configurations (thresholds, monitors, ...) are matched with a couple
+of binary searches instead of set operations per configuration.
+
+  $ python data/evaluate.py data/dbs/Ex4.db --kinds full_outage --tolerance 1
+"""
+
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+import sys
+import warnings
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.aggregates import table_columns
+from data.metrics import f_beta
+from data.monitors import MONITORS, has_table
+from data.profiler import profile_null_rates
+from data.query import read_sql
+
+INCIDENT_COLUMNS = ["table", "kind", "columns", "start", "end"]
+# generated null spikes NULL 95% of a column's rows; no column is that sparse otherwise
+NULL_SPIKE_RATE = 0.85
+
+def _runs(days):
+  """Inclusive [start, end] runs of consecutive integer days."""
+  days = np.sort(np.asarray(days, dtype=np.int64))
+  if not len(days): return []
+  breaks = np.flatnonzero(np.diff(days) > 1)
+  return list(zip(days[np.concatenate([[0], breaks + 1])], days[np.concatenate([breaks, [len(days) - 1]])]))
+
+def _incident_rows(table, kind, columns, days):
+  as_date = lambda day: str(np.datetime64(int(day), "D"))
+  return [(table, kind, json.dumps(columns), as_date(start), as_date(end)) for start, end in _runs(days)]
+
+def derive_incidents(conn, tables=None):
+  """Reconstruct an INCIDENTS ledger from the rows the generators left.
+
+  Calendar days between a table's first and last DATE_ADDED with no rows are
+  full outages, days where a column that is usually populated is NULL in at
+  least NULL_SPIKE_RATE of the rows are null spikes, and days with repeated
+  _ID values are duplications. Consecutive days of the same kind (and column)
+  form one incident. Outages before the first or after the last row can't be
+  seen.
+  """
+  if tables is None:
+    tables = [row[0] for row in conn.execute(
+      "SELECT NAME FROM SQLITE_MASTER WHERE TYPE = 'table' AND NAME NOT LIKE 'sqlite_%' ORDER BY NAME"
+    )]
+  rows = []
+  for table in tables:
+    columns = [column.lower() for column, _ in table_columns(conn, table)]
+    if "date_added" not in columns or "_id" not in columns: continue
+    rates = profile_null_rates(conn, table)
+    days = _days(rates.index)
+    outages = np.setdiff1d(np.arange(days.min(), days.max() + 1), days) if len(days) else days
+    rows += _incident_rows(table, "full_outage", [], outages)
+    rates = rates.drop(columns=["row_count", "_id"], errors="ignore")
+    for column in rates.columns:
+      if rates[column].median() >= NULL_SPIKE_RATE: continue
+      rows += _incident_rows(table, "null_spike", [column], days[(rates[column] >= NULL_SPIKE_RATE).to_numpy()])
+    duplicated = read_sql(conn, """
+      SELECT
+          DATE_ADDED
+      FROM
+          {}
+      GROUP BY
+          DATE_ADDED
+      HAVING
+          COUNT(*) > COUNT(DISTINCT _ID)
+      """.format(table))
+    rows += _incident_rows(table, "duplication", [], _days(duplicated.iloc[:, 0]))
+  df = pd.DataFrame(rows, columns=INCIDENT_COLUMNS)
+  return df.sort_values(["table", "start", "kind"], kind="stable").reset_index(drop=True)
+
+def load_incidents(conn, tables=None, kinds=None):
+  """The INCIDENTS ledger as a frame of table, kind, columns, start, end.
+
+  Without an INCIDENTS table the ledger is reconstructed with `derive_incidents`.
+  """
+  if has_table(conn, "INCIDENTS"):
+    df = read_sql(conn, "SELECT TABLE_NAME, KIND, COLUMNS, START_DATE, END_DATE FROM INCIDENTS")
+    df.columns = INCIDENT_COLUMNS
+  else:
+    warnings.warn("no INCIDENTS table, scoring against incidents derived from the data")
+    df = derive_incidents(conn, tables)
+  if tables is not None: df = df[df["table"].isin(list(tables))]
+  if kinds is not None: df = df[df["kind"].isin(list(kinds))]
+  return df.reset_index(drop=True)
+
+def _days(dates):
+  return pd.to_datetime(pd.Series(dates)).to_numpy(dtype="datetime64[D]").astype(np.int64)
+
+def _merge(starts, ends):
+  """Union of [start, end] intervals."""
+  order = np.argsort(starts, kind="stable")
+  starts, ends = starts[order], ends[order]
+  if not len(starts): return starts, ends
+  reach = np.maximum.accumulate(ends)
+  first = np.flatnonzero(np.concatenate([[True], starts[1:] > reach[:-1]]))
+  return starts[first], np.maximum.reduceat(ends, first)
+
+def evaluate(alerts, incidents, group=None, tolerance_days=0, betas=(1,), per_table=False, groups=None):
+  """Precision, recall, F-beta and detection delay of `alerts` against `incidents`.
+
+  `alerts` needs `table` and `date_added` columns; `group` names an optional
+  column (e.g. "threshold" or "monitor") whose values are scored as separate
+  detectors; pass `groups` to also report detectors that raised no alerts.
+  Returns one row per group (and table, with `per_table`) with
+  alerts, tp, fp, incidents, detected, precision, recall, f<beta>,
+  mean_delay_days and max_delay_days.
+  """
+  if groups is None: groups = pd.unique(alerts[group]) if group else [None]
+  groups = pd.Index(groups)
+  tables = pd.Index(pd.unique(np.concatenate([
+    alerts["table"].to_numpy(dtype=object), incidents["table"].to_numpy(dtype=object)
+  ])))
+  alert_days, starts, ends = _days(alerts["date_added"]), _days(incidents["start"]), _days(incidents["end"])
+  ends = ends + tolerance_days
+  all_days = np.concatenate([alert_days, starts, ends])
+  origin = all_days.min() if len(all_days) else 0
+  span = (all_days.max() - origin + 2) if len(all_days) else 1
+
+  # one key per (group, table, day); incidents repeat for every group
+  alert_group = groups.get_indexer(alerts[group]) if group else np.zeros(len(alerts), dtype=np.int64)
+  alert_cell = alert_group * len(tables) + tables.get_indexer(alerts["table"])
+  alert_keys = alert_cell * span + (alert_days - origin)
+  incident_cell = (
+    np.repeat(np.arange(len(groups)), len(incidents)) * len(tables)
+    + np.tile(tables.get_indexer(incidents["table"]), len(groups))
+  )
+  start_keys = incident_cell * span + np.tile(starts - origin, len(groups))
+  end_keys = incident_cell * span + np.tile(ends - origin, len(groups))
+
+  merged_starts, merged_ends = _merge(start_keys, end_keys)
+  idx = np.searchsorted(merged_starts, alert_keys, side="right") - 1
+  if len(merged_starts): tp = (idx >= 0) & (alert_keys <= merged_ends[np.maximum(idx, 0)])
+  else: tp = np.zeros(len(alert_keys), dtype=bool)
+
+  sorted_alerts = np.sort(alert_keys)
+  pos = np.searchsorted(sorted_alerts, start_keys, side="left")
+  first = sorted_alerts[np.minimum(pos, len(sorted_alerts) - 1)] if len(sorted_alerts) else np.zeros(len(start_keys))
+  detected = (pos < len(sorted_alerts)) & (first <= end_keys)
+  delay = np.where(detected, first - start_keys, 0)
+
+  if per_table:
+    bins, alert_bin, incident_bin = len(groups) * len(tables), alert_cell, incident_cell
+  else:
+    bins, alert_bin, incident_bin = len(groups), alert_group, incident_cell // len(tables)
+  n_alerts = np.bincount(alert_bin, minlength=bins)
+  n_tp = np.bincount(alert_bin, weights=tp, minlength=bins).astype(np.int64)
+  n_incidents = np.bincount(incident_bin, minlength=bins)
+  n_detected = np.bincount(incident_bin, weights=detected, minlength=bins).astype(np.int64)
+  total_delay = np.bincount(incident_bin, weights=delay, minlength=bins)
+  max_delay = np.full(bins, np.nan)
+  np.fmax.at(max_delay, incident_bin[detected], delay[detected].astype(float))
+
+  with np.errstate(divide="ignore", invalid="ignore"):
+    precision = np.where(n_alerts == n_tp, 1.0, n_tp / n_alerts)
+    recall = np.where(n_incidents == 0, 1.0, n_detected / n_incidents)
+    mean_delay = np.where(n_detected > 0, total_delay / n_detected, np.nan)
+  scores = pd.DataFrame({
+    "alerts": n_alerts,
+    "tp": n_tp,
+    "fp": n_alerts - n_tp,
+    "incidents": n_incidents,
+    "detected": n_detected,
+    "precision": precision,
+    "recall": recall
+  })
+  for beta in betas:
+    scores["f{:g}".format(beta)] = f_beta(precision, recall, beta)
+  scores["mean_delay_days"] = mean_delay
+  scores["max_delay_days"] = max_delay
+
+  cells = np.arange(bins)
+  if per_table: scores.insert(0, "table", tables[cells % len(tables)])
+  if group: scores.insert(0, group, groups[cells // len(tables) if per_table else cells])
+  return scores
+
+def monitor_alerts(conn, tables, monitors):
+  """Run `monitors` on `tables` into one alert frame with table and monitor columns."""
+  frames = []
+  for monitor in monitors:
+    for table in tables:
+      alerts = MONITORS[monitor](conn, table)
+      frames.append(pd.DataFrame({"table": table, "monitor": monitor, "date_added": alerts["date_added"].to_numpy()}))
+  return pd.concat(frames, ignore_index=True)
+
+def main():
+  parser = argparse.ArgumentParser(description="Score monitors against a database's INCIDENTS ledger.")
+  parser.add_argument("db")
+  parser.add_argument("--monitors", nargs="*", default=["freshness", "volume", "null_rate"], choices=list(MONITORS))
+  parser.add_argument("--kinds", nargs="*", help="incident kinds to score against (default: all)")
+  parser.add_argument("--tolerance", type=int, default=1, help="days after an incident an alert still counts")
+  parser.add_argument("--per-table", action="store_true")
+  args = parser.parse_args()
+  conn = sqlite3.connect(args.db)
+  incidents = load_incidents(conn, kinds=args.kinds)
+  tables = list(pd.unique(incidents["table"]))
+  alerts = monitor_alerts(conn, tables, args.monitors)
+  with pd.option_context("display.width", 200, "display.max_columns", 20):
+    print(evaluate(
+      alerts, incidents, "monitor", args.tolerance, betas=(1, 0.5, 2), per_table=args.per_table, groups=args.monitors
+    ))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Headless freshness metrics for the notebooks, monitors and batch jobs.
+
+Only needs numpy and pandas, so it imports in milliseconds and never loads a
+plotting backend. Rendering lives in `data/utils.py`.
+"""
+
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from data.query import read_sql
+
+def get_days_index(n: int):
+  all_days = []
+  date = datetime(2020, 1, 1)
+  for _ in range(n):
+    all_days.append(date.strftime("%Y-%m-%d"))
+    date += timedelta(days=1)
+  return pd.Index(all_days)
+
+VALID_OUTAGE_DATES = set([
+  "2020-01-26",
+  "2020-04-01",
+  "2020-04-20",
+  "2020-05-16",
+  "2020-07-12",
+  "2020-08-29",
+  "2020-10-19",
+  "2021-01-05",
+  "2021-04-13"
+])
+
+FRESHNESS_SQL = """
+  WITH RC_UPDATES AS(
+      SELECT
+          DATE_ADDED,
+          COUNT(*) AS ROWS_ADDED
+      FROM
+          {table}
+      GROUP BY
+          DATE_ADDED
+  ),
+  NUM_DAYS_UPDATES AS(
+      SELECT
+          DATE_ADDED,
+          JULIANDAY(DATE_ADDED) - JULIANDAY(LAG(DATE_ADDED) OVER(ORDER BY DATE_ADDED)) AS DAYS_SINCE_UPDATE
+      FROM
+          RC_UPDATES
+  )
+  SELECT
+      *
+  FROM
+      NUM_DAYS_UPDATES
+  """
+
+def get_days_since_update(conn, table="EXOPLANETS"):
+  """Run the freshness query once, returning `date_added` and `days_since_update`."""
+  freshness = read_sql(conn, FRESHNESS_SQL.format(table=table))
+  return freshness.rename(columns={clmn: clmn.lower() for clmn in freshness.columns})
+
+def f_beta(precision, recall, beta):
+  precision, recall = np.asarray(precision, dtype=float), np.asarray(recall, dtype=float)
+  with np.errstate(divide="ignore", invalid="ignore"):
+    f = ((1 + beta**2) * precision * recall) / (beta**2 * precision + recall)
+  return np.nan_to_num(f)
+
+def threshold_sweep(freshness, thresholds, labels=VALID_OUTAGE_DATES, betas=(1,)):
+  """Score "DAYS_SINCE_UPDATE > threshold" alerts against `labels` for every threshold.
+
+  Takes the output of `get_days_since_update`. Each threshold costs a binary
+  search instead of a query, so sweeping 1,000 thresholds costs about as much
+  as sweeping one. Returns one row per threshold with tp, fp, fn, precision,
+  recall, and an "f<beta>" column per beta.
+  """
+  thresholds = np.asarray(list(thresholds), dtype=float)
+  dates = freshness["date_added"].to_numpy()
+  days = freshness["days_since_update"].to_numpy(dtype=float)
+  days = np.where(np.isnan(days), -np.inf, days)
+  is_label = np.isin(dates, list(labels))
+
+  labelled, unlabelled = np.sort(days[is_label]), np.sort(days[~is_label])
+  tp = len(labelled) - np.searchsorted(labelled, thresholds, side="right")
+  fp = len(unlabelled) - np.searchsorted(unlabelled, thresholds, side="right")
+  fn = len(labels) - tp
+  with np.errstate(divide="ignore", invalid="ignore"):
+    precision = np.where(fp == 0, 1.0, tp / (tp + fp))
+    recall = np.nan_to_num(tp / (tp + fn))
+
+  sweep = pd.DataFrame({
+    "threshold": thresholds,
+    "tp": tp,
+    "fp": fp,
+    "fn": fn,
+    "precision": precision,
+    "recall": recall
+  })
+  for beta in betas:
+    sweep["f{:g}".format(beta)] = f_beta(precision, recall, beta)
+  return sweep
+
+def freshness_scores(conn, thresholds=range(15), betas=(1, 0.5, 2), table="EXOPLANETS", labels=VALID_OUTAGE_DATES):
+  """The numbers behind `show_threshold_plot` and `show_f_plots`, without plotting."""
+  return threshold_sweep(get_days_since_update(conn, table), thresholds, labels, betas)
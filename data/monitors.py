@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Registry of the monitors from the exercises, parameterized by table.
+
+Every monitor takes (conn, table) and returns a frame of alerts with a
+`date_added` column plus monitor-specific detail columns. Monitors only read,
+so they can run on read-only connections. Freshness and volume read the
+per-day aggregates kept by `data.aggregates` when they are up to date, and
+scan the table otherwise.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+from data import aggregates
+from data.profiler import null_rate_anomalies, profile_null_rates
+from data.query import fetch_all, read_sql
+from data.uniqueness import uniqueness_monitor
+from data.metrics import get_days_since_update
+
+FRESHNESS_THRESHOLD_DAYS = 5
+VOLUME_WINDOW = 14
+VOLUME_Z_THRESHOLD = 3.0
+
+def _lower(df):
+  return df.rename(columns={clmn: clmn.lower() for clmn in df.columns})
+
+def has_table(conn, table):
+  return conn.execute(
+    "SELECT 1 FROM SQLITE_MASTER WHERE TYPE = 'table' AND NAME = ?", (table,)
+  ).fetchone() is not None
+
+def has_daily_metrics(conn, table):
+  """Whether `data.aggregates` has per-day metrics for `table` up to its latest DATE_ADDED."""
+  if not has_table(conn, "METRICS_WATERMARKS"): return False
+  watermark = fetch_all(conn, "SELECT DATE_ADDED FROM METRICS_WATERMARKS WHERE TABLE_NAME = ?", (table,))
+  if not watermark: return False
+  latest = fetch_all(conn, "SELECT MAX(DATE_ADDED) FROM {}".format(table))[0][0]
+  return latest is not None and watermark[0][0] >= latest
+
+def freshness_monitor(conn, table, threshold_days=FRESHNESS_THRESHOLD_DAYS):
+  if has_daily_metrics(conn, table): freshness = aggregates.get_days_since_update(conn, table)
+  else: freshness = get_days_since_update(conn, table)
+  return freshness[freshness["days_since_update"] > threshold_days].reset_index(drop=True)
+
+def volume_monitor(conn, table, window=VOLUME_WINDOW, z_threshold=VOLUME_Z_THRESHOLD):
+  if has_daily_metrics(conn, table):
+    rows_added = aggregates.get_daily_row_counts(conn, table).rename(columns={"row_count": "rows_added"})
+  else:
+    rows_added = _lower(read_sql(conn, """
+      SELECT
+          DATE_ADDED,
+          COUNT(*) AS ROWS_ADDED
+      FROM
+          {}
+      GROUP BY
+          DATE_ADDED
+      """.format(table)))
+  history = rows_added["rows_added"].shift(1).rolling(window, min_periods=2)
+  with np.errstate(divide="ignore", invalid="ignore"):
+    z = (rows_added["rows_added"] - history.mean()) / history.std()
+  rows_added["z_score"] = z
+  return rows_added[z.abs() >= z_threshold].reset_index(drop=True)
+
+def null_rate_monitor(conn, table, **kwargs):
+  return null_rate_anomalies(profile_null_rates(conn, table), **kwargs)
+
+def schema_change_monitor(conn, table):
+  """Schema changes from the change-only history, or from a <table>_SCHEMA snapshot table."""
+  if has_table(conn, "SCHEMA_CHANGES") and fetch_all(
+    conn, "SELECT 1 FROM SCHEMA_CHANGES WHERE TABLE_NAME = ? LIMIT 1", (table,)
+  ):
+    changes = _lower(read_sql(conn, """
+      SELECT
+          VALID_FROM AS DATE_ADDED,
+          DIFF
+      FROM
+          SCHEMA_CHANGES
+      WHERE
+          TABLE_NAME = ? AND
+          VALID_FROM > (SELECT MIN(VALID_FROM) FROM SCHEMA_CHANGES WHERE TABLE_NAME = ?)
+      """, (table, table)))
+    changes["diff"] = changes["diff"].map(json.loads)
+    return changes
+  if has_table(conn, "{}_SCHEMA".format(table)):
+    return _lower(read_sql(conn, """
+      WITH CHANGES AS(
+          SELECT
+              DATE,
+              SCHEMA,
+              LAG(SCHEMA) OVER(ORDER BY DATE) AS PAST_SCHEMA
+          FROM
+              {}_SCHEMA
+      )
+      SELECT
+          DATE AS DATE_ADDED,
+          SCHEMA
+      FROM
+          CHANGES
+      WHERE
+          SCHEMA != PAST_SCHEMA
+      """.format(table)))
+  return pd.DataFrame(columns=["date_added"])
+
+def duplicate_monitor(conn, table):
+  """Days on which an already-seen _id shows up again."""
+  duplicates = _lower(read_sql(conn, """
+    WITH COPIES AS(
+        SELECT
+            _ID,
+            DATE_ADDED,
+            ROW_NUMBER() OVER(PARTITION BY _ID ORDER BY DATE_ADDED) AS COPY
+        FROM
+            {}
+    )
+    SELECT
+        DATE_ADDED,
+        COUNT(*) AS DUPLICATES
+    FROM
+        COPIES
+    WHERE
+        COPY > 1
+    GROUP BY
+        DATE_ADDED
+    """.format(table)))
+  return duplicates
+
+def uniqueness_check(conn, table):
+  """`uniqueness_monitor` that reads its saved state (which must exist) but never writes it."""
+  return uniqueness_monitor(conn, table, persist=False)
+
+MONITORS = {
+  "freshness": freshness_monitor,
+  "volume": volume_monitor,
+  "null_rate": null_rate_monitor,
+  "schema_change": schema_change_monitor,
+  "duplicates": duplicate_monitor,
+  "uniqueness": uniqueness_check,
+}
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Date-partitioned storage for the exercise tables.
+
+A table is split into one SQLite file per month (or week) under
+<root>/<TABLE>/<period start>.db, each holding the rows of that period with an
+index on DATE_ADDED. <root>/catalog.db lists every partition with its path,
+min/max DATE_ADDED and row count. `PartitionRouter` answers a query over a
+date window by pruning the partitions the catalog says fall outside it,
+ATTACHing the rest to an in-memory connection and running the query against a
+temporary UNION ALL view, so a 30-day query reads one or two partitions no
+matter how many years of history exist. Retention deletes whole partition
+files and their catalog rows.
+
+SQLite attaches at most MAX_ATTACHED databases at once. Windows spanning more
+partitions are run one group of partitions at a time and concatenated, which
+is exact for per-day queries (GROUP BY DATE_ADDED) since partitions never
+share a day; other queries over such windows are refused.
+
+  $ python data/partition.py split data/dbs/Ex4.db EXOPLANETS partitions/
+  $ python data/partition.py split data/dbs/Ex4.db EXOPLANETS partitions/ --replace
+  $ python data/partition.py null_rate partitions/ EXOPLANETS --days 30
+  $ python data/partition.py retain partitions/ EXOPLANETS --keep-days 365
+"""
+
+import argparse
+import os
+import pandas as pd
+import sqlite3
+import sys
+from datetime import date, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.profiler import null_rate_sql
+from data.trace import span
+
+CHUNK_ROWS = 100000
+MAX_ATTACHED = 10
+GRANULARITIES = ("month", "week")
+
+def connect_catalog(root):
+  os.makedirs(root, exist_ok=True)
+  conn = sqlite3.connect(os.path.join(root, "catalog.db"))
+  conn.execute("""
+    CREATE TABLE IF NOT EXISTS PARTITIONS(
+      TABLE_NAME VARCHAR(16777216) NOT NULL,
+      PARTITION_KEY VARCHAR(16777216) NOT NULL,
+      PATH VARCHAR(16777216) NOT NULL,
+      MIN_DATE VARCHAR(16777216) NOT NULL,
+      MAX_DATE VARCHAR(16777216) NOT NULL,
+      ROW_COUNT INTEGER NOT NULL,
+      PRIMARY KEY (TABLE_NAME, PARTITION_KEY)
+    )""")
+  return conn
+
+def partition_keys(dates, granularity="month"):
+  """Start date of the month (or Monday-starting week) holding each 'YYYY-MM-DD' date."""
+  dates = pd.to_datetime(pd.Series(dates))
+  if granularity == "month": starts = dates.dt.to_period("M").dt.start_time
+  elif granularity == "week": starts = dates - pd.to_timedelta(dates.dt.weekday, unit="D")
+  else: raise ValueError("granularity must be one of {}".format(GRANULARITIES))
+  return starts.dt.strftime("%Y-%m-%d").to_numpy()
+
+def load_catalog(catalog, table, start=None, end=None):
+  """Partitions of `table` overlapping [start, end] (inclusive, either may be None), oldest first."""
+  df = pd.read_sql_query("""
+    SELECT
+        PARTITION_KEY,
+        PATH,
+        MIN_DATE,
+        MAX_DATE,
+        ROW_COUNT
+    FROM
+        PARTITIONS
+    WHERE
+        TABLE_NAME = ? AND
+        MAX_DATE >= ? AND
+        MIN_DATE <= ?
+    ORDER BY
+        MIN_DATE
+    """, catalog, params=(table, start or "", end or "9999-12-31"))
+  return df.rename(columns={clmn: clmn.lower() for clmn in df.columns})
+
+def _insert(conn, table, df):
+  values = df.astype(object).where(df.notna(), None).to_numpy().tolist()
+  conn.executemany(
+    "INSERT INTO {} ({}) VALUES ({})".format(table, ", ".join(df.columns), ", ".join("?" * len(df.columns))), values
+  )
+
+def append_partitions(catalog, root, table, create_sql, df, granularity="month"):
+  """Route the rows of `df` to their partitions, creating partitions as needed."""
+  date_column = next(column for column in df.columns if column.upper() == "DATE_ADDED")
+  keys = partition_keys(df[date_column], granularity)
+  for key, rows in df.groupby(keys, sort=True):
+    path = os.path.join(table, key + ".db")
+    conn = sqlite3.connect(os.path.join(root, path))
+    with span("append_partition", "write", conn, table=table, partition=key, rows=len(rows)), conn:
+      conn.execute(create_sql.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+      conn.execute("CREATE INDEX IF NOT EXISTS IDX_{0}_DATE_ADDED ON {0}(DATE_ADDED)".format(table))
+      _insert(conn, table, rows)
+    conn.close()
+    dates = rows[date_column]
+    with catalog:
+      catalog.execute("""
+        INSERT INTO PARTITIONS VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (TABLE_NAME, PARTITION_KEY) DO UPDATE SET
+          MIN_DATE = MIN(MIN_DATE, EXCLUDED.MIN_DATE),
+          MAX_DATE = MAX(MAX_DATE, EXCLUDED.MAX_DATE),
+          ROW_COUNT = ROW_COUNT + EXCLUDED.ROW_COUNT
+        """, (table, key, path, dates.min(), dates.max(), len(rows)))
+
+def partition_table(src, table, root, granularity="month", since=None, chunk_rows=CHUNK_ROWS, replace=False):
+  """Copy the rows of `table` in `src` added after `since` into partitions under `root`.
+
+  `since` defaults to the newest DATE_ADDED already partitioned, so splitting
+  again only appends new days. An earlier `since` would copy rows twice and is
+  refused unless `replace` is set, which drops the table's partitions first.
+  """
+  create_sql = src.execute("SELECT SQL FROM SQLITE_MASTER WHERE TYPE = 'table' AND NAME = ?", (table,)).fetchone()[0]
+  if replace: drop_partitions(root, table)
+  catalog = connect_catalog(root)
+  last = catalog.execute("SELECT MAX(MAX_DATE) FROM PARTITIONS WHERE TABLE_NAME = ?", (table,)).fetchone()[0]
+  if since is None: since = last
+  elif last is not None and since < last:
+    catalog.close()
+    raise ValueError(
+      "{} is already partitioned up to {}; pass a later --since, or --replace to re-split".format(table, last)
+    )
+  os.makedirs(os.path.join(root, table), exist_ok=True)
+  SQL = "SELECT * FROM {} WHERE DATE_ADDED > ? ORDER BY DATE_ADDED".format(table)
+  rows = 0
+  for chunk in pd.read_sql_query(SQL, src, params=(since or "",), chunksize=chunk_rows):
+    append_partitions(catalog, root, table, create_sql, chunk, granularity)
+    rows += len(chunk)
+  catalog.close()
+  return rows
+
+def drop_partitions(root, table, before=None):
+  """Drop every partition of `table` whose rows are all older than `before` (every one if None).
+
+  Returns the keys dropped.
+  """
+  catalog = connect_catalog(root)
+  old = catalog.execute(
+    "SELECT PARTITION_KEY, PATH FROM PARTITIONS WHERE TABLE_NAME = ? AND MAX_DATE < ?", (table, before or "9999-12-32")
+  ).fetchall()
+  for key, path in old:
+    with catalog:
+      catalog.execute("DELETE FROM PARTITIONS WHERE TABLE_NAME = ? AND PARTITION_KEY = ?", (table, key))
+    if os.path.exists(os.path.join(root, path)): os.remove(os.path.join(root, path))
+  catalog.close()
+  return [key for key, _ in old]
+
+def _literal(day):
+  return "'{}'".format(date.fromisoformat(day).isoformat())
+
+class PartitionRouter:
+  """Runs queries over the partitions of a table that overlap a date window."""
+
+  def __init__(self, root, max_attached=MAX_ATTACHED):
+    self.root = root
+    self.max_attached = max_attached
+    self.catalog = connect_catalog(root)
+    self.conn = sqlite3.connect(":memory:")
+
+  def partitions(self, table, start=None, end=None):
+    return load_catalog(self.catalog, table, start, end)
+
+  def columns(self, table):
+    """Column names of `table`, from its newest partition."""
+    partitions = self.partitions(table)
+    if partitions.empty: raise ValueError("no partitions of {} under {}".format(table, self.root))
+    conn = sqlite3.connect(os.path.join(self.root, partitions["path"].iloc[-1]))
+    columns = [row[1] for row in conn.execute("PRAGMA table_info({})".format(table))]
+    conn.close()
+    return columns
+
+  def _run(self, table, partitions, sql, params, start, end):
+    names = ["P{}".format(i) for i in range(len(partitions))]
+    for name, path in zip(names, partitions["path"]):
+      self.conn.execute("ATTACH DATABASE ? AS {}".format(name), (os.path.join(self.root, path),))
+    try:
+      bounds = []
+      if start is not None: bounds.append("DATE_ADDED >= {}".format(_literal(start)))
+      if end is not None: bounds.append("DATE_ADDED <= {}".format(_literal(end)))
+      where = " WHERE " + " AND ".join(bounds) if bounds else ""
+      view = "{}_WINDOW".format(table)
+      self.conn.execute("DROP VIEW IF EXISTS TEMP.{}".format(view))
+      self.conn.execute("CREATE TEMP VIEW {} AS {}".format(view, " UNION ALL ".join(
+        "SELECT * FROM {}.{}{}".format(name, table, where) for name in names
+      )))
+      with span("routed_query", "query", self.conn, sql.format(table=view), params, table=table, partitions=len(names)):
+        return pd.read_sql_query(sql.format(table=view), self.conn, params=params)
+    finally:
+      self.conn.execute("DROP VIEW IF EXISTS TEMP.{}_WINDOW".format(table))
+      for name in names: self.conn.execute("DETACH DATABASE {}".format(name))
+
+  def query(self, table, sql, start=None, end=None, params=(), per_day=False):
+    """Run `sql`, with `{table}` standing for `table` restricted to [start, end].
+
+    Windows over more than `max_attached` partitions need `per_day=True`: the
+    query then runs per group of partitions and the results are concatenated.
+    """
+    partitions = self.partitions(table, start, end)
+    if partitions.empty: return pd.DataFrame()
+    if len(partitions) > self.max_attached and not per_day:
+      raise ValueError(
+        "{} partitions of {} overlap the window; pass per_day=True for per-day queries".format(len(partitions), table)
+      )
+    frames = [
+      self._run(table, partitions.iloc[i:i + self.max_attached], sql, tuple(params), start, end)
+      for i in range(0, len(partitions), self.max_attached)
+    ]
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    return df.rename(columns={clmn: clmn.lower() for clmn in df.columns})
+
+  def last_date(self, table):
+    return self.catalog.execute("SELECT MAX(MAX_DATE) FROM PARTITIONS WHERE TABLE_NAME = ?", (table,)).fetchone()[0]
+
+  def close(self):
+    self.conn.close()
+    self.catalog.close()
+
+def window_start(end, days):
+  return (date.fromisoformat(end) - timedelta(days=days - 1)).isoformat()
+
+def rows_added(router, table, start=None, end=None):
+  """Daily row counts of `table` in [start, end]."""
+  return router.query(table, """
+    SELECT
+        DATE_ADDED,
+        COUNT(*) AS ROWS_ADDED
+    FROM
+        {table}
+    GROUP BY
+        DATE_ADDED
+    ORDER BY
+        DATE_ADDED
+    """, start, end, per_day=True)
+
+def null_rates(router, table, start=None, end=None):
+  """`profile_null_rates` over the partitions of `table` in [start, end]."""
+  columns = [column for column in router.columns(table) if column.upper() != "DATE_ADDED"]
+  rates = router.query(table, null_rate_sql(None, "{table}", columns), start, end, per_day=True)
+  return rates.set_index("date_added") if not rates.empty else rates
+
+def main():
+  parser = argparse.ArgumentParser(description="Partition a table by date, query recent windows, or apply retention.")
+  commands = parser.add_subparsers(dest="command")
+  split = commands.add_parser("split", help="copy a table into date partitions")
+  split.add_argument("db")
+  split.add_argument("table")
+  split.add_argument("root")
+  split.add_argument("--granularity", choices=GRANULARITIES, default="month")
+  split.add_argument("--since", help="only rows added after this date (default: the last date already partitioned)")
+  split.add_argument("--replace", action="store_true", help="drop the table's existing partitions first")
+  for name in ("rows_added", "null_rate"):
+    metric = commands.add_parser(name, help="daily {} over the last days".format(name))
+    metric.add_argument("root")
+    metric.add_argument("table")
+    metric.add_argument("--days", type=int, default=30)
+  retain = commands.add_parser("retain", help="drop partitions older than the retention window")
+  retain.add_argument("root")
+  retain.add_argument("table")
+  retain.add_argument("--keep-days", type=int, required=True)
+  args = parser.parse_args()
+
+  if args.command == "split":
+    rows = partition_table(
+      sqlite3.connect(args.db), args.table, args.root, args.granularity, args.since, replace=args.replace
+    )
+    print(load_catalog(connect_catalog(args.root), args.table).to_string())
+    print("partitioned {} rows of {}".format(rows, args.table))
+  elif args.command == "retain":
+    router = PartitionRouter(args.root)
+    cutoff = window_start(router.last_date(args.table), args.keep_days)
+    router.close()
+    print("dropped partitions: {}".format(drop_partitions(args.root, args.table, cutoff)))
+  elif args.command in ("rows_added", "null_rate"):
+    router = PartitionRouter(args.root)
+    end = router.last_date(args.table)
+    start = window_start(end, args.days)
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+      print((rows_added if args.command == "rows_added" else null_rates)(router, args.table, start, end))
+    router.close()
+  else:
+    parser.print_help()
+
+if __name__ == "__main__":
+  main()
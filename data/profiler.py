@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""One-pass null-rate profiler for every column of a table.
+
+The column list comes from PRAGMA table_info, and a single generated statement
+computes every column's daily null rate in one scan. New columns (like
+ECCENTRICITY and ATMOSPHERE on 2020-07-19) are picked up without adding scans.
+"""
+
+import numpy as np
+import pandas as pd
+from data.aggregates import table_columns
+from data.query import read_sql
+
+def null_rate_sql(conn, table, columns=None, since=None):
+  """Build one GROUP BY DATE_ADDED statement covering every column's null rate."""
+  if columns is None:
+    columns = [column for column, _ in table_columns(conn, table) if column.upper() != "DATE_ADDED"]
+  selects = ["DATE_ADDED", "COUNT(*) AS ROW_COUNT"] + [
+    "AVG(CASE WHEN {0} IS NULL THEN 1.0 ELSE 0.0 END) AS {0}".format(column)
+    for column in columns
+  ]
+  return """
+    SELECT
+      {}
+    FROM
+      {}
+    {}
+    GROUP BY
+      DATE_ADDED
+    ORDER BY
+      DATE_ADDED
+    """.format(",\n      ".join(selects), table, "WHERE DATE_ADDED >= ?" if since else "")
+
+def profile_null_rates(conn, table, columns=None, since=None):
+  """Daily null rate per column, indexed by `date_added`, from a single table scan."""
+  SQL = null_rate_sql(conn, table, columns, since)
+  rates = read_sql(conn, SQL, (since,) if since else ())
+  rates = rates.rename(columns={clmn: clmn.lower() for clmn in rates.columns})
+  return rates.set_index("date_added")
+
+def null_rate_anomalies(rates, window=14, z_threshold=3.0, min_increase=0.2):
+  """Flag (day, column) null rates far above their trailing baseline.
+
+  For every column at once, each day is compared with the mean and standard
+  deviation of the previous `window` days. A day is anomalous when it is at
+  least `z_threshold` deviations and `min_increase` above that mean. Returns a
+  long frame of date_added, column, null_rate and baseline.
+  """
+  rates = rates.drop(columns=["row_count"], errors="ignore")
+  history = rates.shift(1).rolling(window, min_periods=2)
+  baseline, spread = history.mean(), history.std().fillna(0)
+  increase = rates - baseline
+  with np.errstate(divide="ignore", invalid="ignore"):
+    z = increase / spread
+  flagged = (increase >= min_increase) & (z >= z_threshold)
+
+  days, columns = np.nonzero(flagged.to_numpy())
+  return pd.DataFrame({
+    "date_added": rates.index.to_numpy()[days],
+    "column": rates.columns.to_numpy()[columns],
+    "null_rate": rates.to_numpy()[days, columns],
+    "baseline": baseline.to_numpy()[days, columns]
+  })
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Query layer for the monitors: bound parameters, prepared-statement reuse
+and memoized results.
+
+Statement text never embeds values, so sqlite3's per-connection statement
+cache (sized by `cached_statements`) reuses the prepared statement. Results
+are kept in a per-connection LRU keyed on (statement, params, data version),
+where the data version combines `PRAGMA data_version` (commits by other
+connections), `PRAGMA schema_version` and the connection's own
+`total_changes`, so any write to the database invalidates old entries.
+
+`set_statement_timeout` bounds each statement rather than a whole batch of
+them: every query issued through this module restarts the deadline.
+"""
+
+import pandas as pd
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from data.trace import get_progress_handler, set_progress_handler, span
+
+STATEMENT_CACHE_SIZE = 256
+MAX_ENTRIES = 128
+MAX_BYTES = 256 * 1024 * 1024
+MAX_CONNECTIONS = 16
+PROGRESS_STEPS = 10000
+
+class ResultCache:
+  """LRU of query results bounded by entry count and approximate bytes."""
+
+  def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.entries = OrderedDict()
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key):
+    if key not in self.entries:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.entries.move_to_end(key)
+    return self.entries[key][0]
+
+  def put(self, key, value, size):
+    if size > self.max_bytes: return
+    if key in self.entries: self.bytes -= self.entries.pop(key)[1]
+    self.entries[key] = (value, size)
+    self.bytes += size
+    while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+      self.bytes -= self.entries.popitem(last=False)[1][1]
+
+# sqlite3 connections can't be weakly referenced, so caches hold their
+# connection (which also keeps its id from being reused) and are themselves
+# evicted least-recently-used first. Worker threads share the registry, so
+# every access holds the lock; size it with `set_max_connections` to cover
+# every pooled connection, or caches get evicted while still in use.
+_caches = OrderedDict()
+_caches_lock = threading.Lock()
+_max_connections = MAX_CONNECTIONS
+
+def connect(path, read_only=False, **kwargs):
+  """sqlite3.connect with a larger prepared-statement cache."""
+  kwargs.setdefault("cached_statements", STATEMENT_CACHE_SIZE)
+  if read_only: return sqlite3.connect("file:{}?mode=ro".format(path), uri=True, **kwargs)
+  return sqlite3.connect(path, **kwargs)
+
+def set_max_connections(n):
+  """Keep result caches for up to `n` connections, e.g. workers x databases."""
+  global _max_connections
+  with _caches_lock:
+    _max_connections = n
+    while len(_caches) > _max_connections: _caches.popitem(last=False)
+
+def get_cache(conn):
+  key = id(conn)
+  with _caches_lock:
+    entry = _caches.get(key)
+    if entry is None:
+      entry = _caches[key] = (conn, ResultCache())
+      while len(_caches) > _max_connections: _caches.popitem(last=False)
+    else:
+      _caches.move_to_end(key)
+    return entry[1]
+
+def clear_cache(conn=None):
+  with _caches_lock:
+    if conn is None: _caches.clear()
+    else: _caches.pop(id(conn), None)
+
+class StatementTimeout:
+  """Progress handler that interrupts a statement once `seconds` pass since the last restart.
+
+  The deadline lives on the handler installed on the connection, so it goes
+  away with it instead of outliving the connection in a module-level map.
+  """
+
+  def __init__(self, seconds):
+    self.seconds = seconds
+    self.restart()
+
+  def restart(self):
+    self.deadline = time.perf_counter() + self.seconds
+
+  def __call__(self):
+    return 1 if time.perf_counter() > self.deadline else 0
+
+def set_statement_timeout(conn, seconds, n=PROGRESS_STEPS):
+  """Interrupt any statement on `conn` that runs longer than `seconds` (None: never)."""
+  set_progress_handler(conn, None if seconds is None else StatementTimeout(seconds), n)
+
+def restart_timeout(conn):
+  """Give the next statement on `conn` its full timeout."""
+  handler = get_progress_handler(conn)
+  if isinstance(handler, StatementTimeout): handler.restart()
+
+def data_version(conn):
+  return (
+    conn.execute("PRAGMA data_version").fetchone()[0],
+    conn.execute("PRAGMA schema_version").fetchone()[0],
+    conn.total_changes
+  )
+
+def _read_sql(conn, sql, params):
+  restart_timeout(conn)
+  with span("read_sql", "query", conn, sql, params) as traced:
+    df = pd.read_sql_query(sql, conn, params=params)
+    traced.set(rows=len(df))
+  return df
+
+def read_sql(conn, sql, params=(), cache=True):
+  """`pd.read_sql_query` with bound `params`, memoized until the database changes.
+
+  Returns a copy, so callers may modify it.
+  """
+  params = tuple(params or ())
+  if not cache: return _read_sql(conn, sql, params)
+  results = get_cache(conn)
+  key = (sql, params, data_version(conn))
+  df = results.get(key)
+  if df is None:
+    df = _read_sql(conn, sql, params)
+    results.put(key, df, int(df.memory_usage(index=True, deep=True).sum()))
+  else:
+    with span("read_sql", "cache", rows=len(df)): pass
+  return df.copy()
+
+def _fetch_all(conn, sql, params):
+  restart_timeout(conn)
+  with span("fetch_all", "query", conn, sql, params) as traced:
+    rows = conn.execute(sql, params).fetchall()
+    traced.set(rows=len(rows))
+  return rows
+
+def fetch_all(conn, sql, params=(), cache=True):
+  """`conn.execute(sql, params).fetchall()`, memoized like `read_sql`."""
+  params = tuple(params or ())
+  if not cache: return _fetch_all(conn, sql, params)
+  results = get_cache(conn)
+  key = ("fetchall", sql, params, data_version(conn))
+  rows = results.get(key)
+  if rows is None:
+    rows = _fetch_all(conn, sql, params)
+    results.put(key, rows, 64 * sum(len(row) for row in rows))
+  return list(rows)
+
+def cache_info(conn):
+  results = get_cache(conn)
+  return {"hits": results.hits, "misses": results.misses, "entries": len(results.entries), "bytes": results.bytes}
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Rendering for long monitoring time series.
+
+Series are downsampled before they reach plotly: LTTB (largest triangle three
+buckets) keeps the visual shape, min/max buckets keep every extreme, and
+anomaly points are always kept on top of either. Traces switch to WebGL
+(`Scattergl`) above `webgl_threshold` points, and figures can be shown or
+saved as static images instead of embedding the full JSON in a notebook.
+Plotly is only imported when a figure is built.
+"""
+
+import numpy as np
+import warnings
+
+MAX_POINTS = 2000
+WEBGL_THRESHOLD = 10000
+
+def _positions(x, n):
+  if x is None: return np.arange(n, dtype=float)
+  x = np.asarray(x)
+  if np.issubdtype(x.dtype, np.number): return x.astype(float)
+  if np.issubdtype(x.dtype, np.datetime64): return x.astype("datetime64[ns]").astype(np.int64).astype(float)
+  return np.arange(n, dtype=float)
+
+def lttb_indices(y, n_out, x=None):
+  """Indices of the `n_out` points Largest-Triangle-Three-Buckets keeps."""
+  y = np.asarray(y, dtype=float)
+  n = len(y)
+  if n_out >= n or n_out < 3: return np.arange(n)
+  x = _positions(x, n)
+  y = np.where(np.isnan(y), np.nanmean(y) if np.isfinite(y).any() else 0.0, y)
+  edges = np.append(np.linspace(1, n - 1, n_out - 1).astype(int), n)
+  out = np.empty(n_out, dtype=np.int64)
+  out[0], out[-1] = 0, n - 1
+  a = 0
+  for i in range(n_out - 2):
+    lo, hi = edges[i], edges[i + 1]
+    next_lo, next_hi = edges[i + 1], edges[i + 2]
+    avg_x, avg_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+    area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+    a = lo + int(np.argmax(area))
+    out[i + 1] = a
+  return out
+
+def minmax_indices(y, n_out):
+  """Indices of the minimum and maximum of each of `n_out // 2` equal buckets."""
+  y = np.asarray(y, dtype=float)
+  n = len(y)
+  buckets = max(n_out // 2, 1)
+  if n <= n_out: return np.arange(n)
+  bucket = np.arange(n) * buckets // n
+  order = np.lexsort((np.where(np.isnan(y), np.inf, y), bucket))
+  starts = np.searchsorted(bucket[order], np.arange(buckets))
+  ends = np.append(starts[1:], n) - 1
+  return np.unique(np.concatenate([order[starts], order[ends], [0, n - 1]]))
+
+def downsample(y, max_points=MAX_POINTS, x=None, method="lttb", keep=None):
+  """Indices to plot: a `method` ("lttb" or "minmax") sample of at most
+  `max_points`, plus every index in `keep` (a boolean mask or index array).
+  """
+  if method == "lttb": idx = lttb_indices(y, max_points, x)
+  elif method == "minmax": idx = minmax_indices(y, max_points)
+  else: raise ValueError("unknown downsampling method {!r}".format(method))
+  if keep is not None:
+    keep = np.asarray(keep)
+    if keep.dtype == bool: keep = np.flatnonzero(keep)
+    idx = np.union1d(idx, keep)
+  return idx
+
+def series_figure(
+  x,
+  series,
+  anomalies=None,
+  max_points=MAX_POINTS,
+  method="lttb",
+  webgl_threshold=WEBGL_THRESHOLD,
+  title=None,
+):
+  """A line figure of `series` ({name: y values}) against `x`.
+
+  `anomalies` is a boolean mask (or index array) shared by every series, or a
+  {name: mask} dict; anomaly points survive downsampling and are drawn as
+  markers.
+  """
+  import plotly.graph_objects as go
+  x = np.asarray(x)
+  fig = go.Figure()
+  for name, y in series.items():
+    y = np.asarray(y, dtype=float)
+    keep = anomalies.get(name) if isinstance(anomalies, dict) else anomalies
+    idx = downsample(y, max_points, x, method, keep)
+    trace = go.Scattergl if len(y) > webgl_threshold else go.Scatter
+    fig.add_trace(trace(x=x[idx], y=y[idx], name=name, mode="lines"))
+    if keep is not None:
+      keep = np.asarray(keep)
+      if keep.dtype == bool: keep = np.flatnonzero(keep)
+      fig.add_trace(trace(
+        x=x[keep], y=y[keep], name="{} anomalies".format(name), mode="markers", marker={"color": "red", "size": 7}
+      ))
+  if title: fig.update_layout(title=title)
+  return fig
+
+def has_image_engine():
+  """Whether kaleido, which plotly needs for static images, is installed."""
+  try:
+    import kaleido
+  except ImportError:
+    return False
+  return True
+
+def show(fig, static=False, width=None, height=None):
+  """Show `fig` interactively, or as a PNG (`static=True`) so notebooks store
+  an image rather than the figure JSON. Static output needs kaleido; without
+  it the figure is shown interactively, with a warning.
+  """
+  if static and not has_image_engine():
+    warnings.warn("kaleido is not installed, showing the figure interactively instead of as a PNG")
+    static = False
+  if static: fig.show(renderer="png", width=width, height=height)
+  else: fig.show()
+
+def save(fig, path, width=None, height=None):
+  """Write `fig` to `path`: .html loads plotly.js from the CDN, anything else
+  (.png, .svg, .pdf, ...) is a static image.
+  """
+  if path.endswith(".html"): fig.write_html(path, include_plotlyjs="cdn")
+  else: fig.write_image(path, width=width, height=height)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Headless, concurrent monitor runner.
+
+Every (database, table, monitor) combination is a task on a bounded thread or
+process pool. Each worker keeps its own read-only (`mode=ro`) connection per
+database file, and a progress handler interrupts any query that runs past its
+timeout. Each statement gets the full timeout, however many a monitor issues.
+Monitors that keep saved state (uniqueness) run in the calling thread instead,
+which is then the single writer of that state: it is built on the first run
+and advanced by each run after that. Reports total wall time and per-monitor
+latency.
+
+  $ python data/runner.py data/dbs/Ex1.db data/dbs/Ex2.db data/dbs/Ex4.db --workers 8
+"""
+
+import argparse
+import os
+import pandas as pd
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.monitors import MONITORS
+from data.query import MAX_CONNECTIONS, STATEMENT_CACHE_SIZE, set_max_connections, set_statement_timeout
+from data.trace import span
+from data.uniqueness import uniqueness_monitor
+
+QUERY_TIMEOUT = 60.0
+# bookkeeping tables that happen to have a DATE_ADDED column
+INTERNAL_TABLES = ("METRICS_WATERMARKS", "SNAPSHOT_WATERMARKS")
+PROGRESS_STEPS = 10000
+# monitors that save state between runs, in the form that persists it
+STATEFUL_MONITORS = {"uniqueness": uniqueness_monitor}
+
+_local = threading.local()
+
+def connect_read_only(path):
+  """Open `path` read-only; writes fail instead of taking locks."""
+  uri = "file:{}?mode=ro".format(os.path.abspath(path))
+  return sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+
+def get_connection(path):
+  """The calling worker's pooled read-only connection to `path`."""
+  if not hasattr(_local, "connections"): _local.connections = {}
+  if path not in _local.connections: _local.connections[path] = connect_read_only(path)
+  return _local.connections[path]
+
+def set_timeout(conn, seconds):
+  """Interrupt any statement on `conn` that runs for more than `seconds`."""
+  set_statement_timeout(conn, seconds, PROGRESS_STEPS)
+
+def discover_tables(path):
+  """User tables in `path` that have a DATE_ADDED column."""
+  conn = get_connection(path)
+  tables = [row[0] for row in conn.execute(
+    "SELECT NAME FROM SQLITE_MASTER WHERE TYPE = 'table' AND NAME NOT LIKE 'sqlite_%' ORDER BY NAME"
+  )]
+  return [
+    table for table in tables
+    if any(row[1].upper() == "DATE_ADDED" for row in conn.execute("PRAGMA table_info({})".format(table)))
+    and not table.startswith("DAILY_") and table not in INTERNAL_TABLES
+  ]
+
+def run_task(path, table, monitor, timeout=QUERY_TIMEOUT, registry=MONITORS):
+  """Run one monitor (from `registry`) on one table. Errors and timeouts are reported, not raised."""
+  conn = get_connection(path)
+  start = time.perf_counter()
+  alerts, error = None, None
+  set_timeout(conn, timeout)
+  try:
+    with span(monitor, "monitor", db=path, table=table):
+      alerts = registry[monitor](conn, table)
+  except Exception as e:
+    error = "{}: {}".format(type(e).__name__, e)
+  finally:
+    set_timeout(conn, None)
+  return {
+    "db": path,
+    "table": table,
+    "monitor": monitor,
+    "seconds": time.perf_counter() - start,
+    "alerts": alerts,
+    "error": error
+  }
+
+def run_monitors(targets, monitors=None, workers=None, timeout=QUERY_TIMEOUT, processes=False):
+  """Run `monitors` (default: all of MONITORS) over `targets`, a list of (db path, table).
+
+  Returns (results, wall seconds), with one result dict per task.
+  """
+  if monitors is None: monitors = list(MONITORS)
+  if workers is None: workers = os.cpu_count()
+  tasks = [(path, table, monitor) for path, table in targets for monitor in monitors]
+  # room for one pooled connection per worker and database, plus the caller's own
+  max_connections = max(MAX_CONNECTIONS, (workers + 1) * len(set(path for path, _ in targets)))
+  executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+  start = time.perf_counter()
+  with executor(max_workers=workers, initializer=set_max_connections, initargs=(max_connections,)) as pool:
+    futures = [
+      None if monitor in STATEFUL_MONITORS else pool.submit(run_task, path, table, monitor, timeout)
+      for path, table, monitor in tasks
+    ]
+    # the pool only reads; saved state is written here, one table at a time
+    stateful = dict(
+      (i, run_task(path, table, monitor, timeout, STATEFUL_MONITORS))
+      for i, (path, table, monitor) in enumerate(tasks) if monitor in STATEFUL_MONITORS
+    )
+    results = [stateful[i] if future is None else future.result() for i, future in enumerate(futures)]
+  return results, time.perf_counter() - start
+
+def latency_report(results, wall_seconds):
+  """Per-monitor task count, alert count, errors and latency, plus total wall time."""
+  df = pd.DataFrame([{
+    "monitor": result["monitor"],
+    "seconds": result["seconds"],
+    "alerts": 0 if result["alerts"] is None else len(result["alerts"]),
+    "errors": int(result["error"] is not None)
+  } for result in results])
+  report = df.groupby("monitor").agg(
+    tasks=("seconds", "size"),
+    alerts=("alerts", "sum"),
+    errors=("errors", "sum"),
+    mean_seconds=("seconds", "mean"),
+    max_seconds=("seconds", "max"),
+    total_seconds=("seconds", "sum")
+  )
+  report.attrs["wall_seconds"] = wall_seconds
+  return report
+
+def main():
+  parser = argparse.ArgumentParser(description="Run every monitor over many tables and databases.")
+  parser.add_argument("dbs", nargs="+")
+  parser.add_argument("--tables", nargs="*", help="default: every table with a DATE_ADDED column")
+  parser.add_argument("--monitors", nargs="*", choices=list(MONITORS))
+  parser.add_argument("--workers", type=int, default=os.cpu_count())
+  parser.add_argument("--timeout", type=float, default=QUERY_TIMEOUT)
+  parser.add_argument("--processes", action="store_true", help="use a process pool instead of threads")
+  args = parser.parse_args()
+
+  targets = []
+  for path in args.dbs:
+    tables = discover_tables(path)
+    if args.tables: tables = [table for table in tables if table in args.tables]
+    targets += [(path, table) for table in tables]
+
+  results, wall_seconds = run_monitors(targets, args.monitors, args.workers, args.timeout, args.processes)
+  for result in results:
+    if result["error"]: print("{db} {table} {monitor}: {error}".format(**result))
+  print(latency_report(results, wall_seconds))
+  print("ran {} tasks over {} tables in {:.2f}s".format(len(results), len(targets), wall_seconds))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Change-only schema history.
+
+Each distinct schema is stored once in SCHEMA_VERSIONS, keyed by its hash.
+SCHEMA_CHANGES holds one validity interval per change event, along with a
+column-level diff against the previous version. Capturing a schema that
+hasn't changed writes nothing, so storage and change detection grow with the
+number of changes rather than with days x schema size.
+"""
+
+import hashlib
+import json
+from bisect import bisect_right
+from data.aggregates import table_columns
+
+def create_history_tables(conn):
+  conn.execute("""
+    CREATE TABLE IF NOT EXISTS SCHEMA_VERSIONS(
+      SCHEMA_HASH VARCHAR(40) PRIMARY KEY,
+      SCHEMA VARCHAR(16777216) NOT NULL
+    )
+  """)
+  conn.execute("""
+    CREATE TABLE IF NOT EXISTS SCHEMA_CHANGES(
+      TABLE_NAME VARCHAR(16777216) NOT NULL,
+      VALID_FROM TIMESTAMP_NTZ(6) NOT NULL,
+      VALID_TO TIMESTAMP_NTZ(6),
+      SCHEMA_HASH VARCHAR(40) NOT NULL,
+      DIFF VARCHAR(16777216) NOT NULL,
+      PRIMARY KEY (TABLE_NAME, VALID_FROM)
+    )
+  """)
+
+def schema_hash(schema):
+  return hashlib.sha1(json.dumps(schema).encode("utf-8")).hexdigest()
+
+def diff_schemas(old, new):
+  """Column-level diff between two schemas: added, removed and retyped columns."""
+  old, new = dict(old or []), dict(new)
+  return {
+    "added": [column for column in new if column not in old],
+    "removed": [column for column in old if column not in new],
+    "retyped": [[column, old[column], new[column]] for column in new if column in old and old[column] != new[column]]
+  }
+
+def record_schema(conn, table, date, schema):
+  """Record `table`'s schema as observed at `date`.
+
+  Returns the diff if this is a change (or the first observation), else None.
+  """
+  create_history_tables(conn)
+  schema = [list(column) for column in schema]
+  digest = schema_hash(schema)
+  current = conn.execute("""
+    SELECT C.SCHEMA_HASH, V.SCHEMA
+    FROM SCHEMA_CHANGES C JOIN SCHEMA_VERSIONS V ON C.SCHEMA_HASH = V.SCHEMA_HASH
+    WHERE C.TABLE_NAME = ? AND C.VALID_TO IS NULL
+    """, (table,)).fetchone()
+  if current and current[0] == digest: return None
+
+  diff = diff_schemas(json.loads(current[1]) if current else None, schema)
+  with conn:
+    conn.execute("INSERT OR IGNORE INTO SCHEMA_VERSIONS VALUES (?, ?)", (digest, json.dumps(schema)))
+    conn.execute("UPDATE SCHEMA_CHANGES SET VALID_TO = ? WHERE TABLE_NAME = ? AND VALID_TO IS NULL", (date, table))
+    conn.execute("INSERT INTO SCHEMA_CHANGES VALUES (?, ?, NULL, ?, ?)", (table, date, digest, json.dumps(diff)))
+  return diff
+
+def clear_history(conn, table):
+  """Forget every recorded change for `table`, e.g. before replaying its history."""
+  create_history_tables(conn)
+  with conn:
+    conn.execute("DELETE FROM SCHEMA_CHANGES WHERE TABLE_NAME = ?", (table,))
+
+def capture_schema(conn, table, date, source=None):
+  """Read `table`'s schema from `source` (default `conn`) and record it at `date`."""
+  return record_schema(conn, table, date, table_columns(source or conn, table))
+
+class SchemaHistory:
+  """In-memory view of SCHEMA_CHANGES for one table, answering lookups by bisection."""
+
+  def __init__(self, conn, table):
+    create_history_tables(conn)
+    rows = conn.execute("""
+      SELECT C.VALID_FROM, C.VALID_TO, C.DIFF, V.SCHEMA
+      FROM SCHEMA_CHANGES C JOIN SCHEMA_VERSIONS V ON C.SCHEMA_HASH = V.SCHEMA_HASH
+      WHERE C.TABLE_NAME = ?
+      ORDER BY C.VALID_FROM
+      """, (table,)).fetchall()
+    self.table = table
+    self.valid_from = [row[0] for row in rows]
+    self.valid_to = [row[1] for row in rows]
+    self.diffs = [json.loads(row[2]) for row in rows]
+    self.schemas = [[tuple(column) for column in json.loads(row[3])] for row in rows]
+
+  def schema_at(self, date):
+    """The schema in effect at `date`, or None before the first observation."""
+    i = bisect_right(self.valid_from, date) - 1
+    if i < 0: return None
+    return self.schemas[i]
+
+  def changes_between(self, start, end):
+    """Change events with start < VALID_FROM <= end, as (date, diff) pairs.
+
+    The first observation of a table is not counted as a change.
+    """
+    lo = max(bisect_right(self.valid_from, start), 1)
+    hi = bisect_right(self.valid_from, end)
+    return [(self.valid_from[i], self.diffs[i]) for i in range(lo, hi)]
+
+  def change_dates(self):
+    return self.valid_from[1:]
+
+  def __len__(self):
+    return len(self.valid_from)
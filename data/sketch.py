@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Mergeable quantile sketches for per-day distribution drift.
+
+One streaming pass over a table builds a KLL sketch per column per day and
+stores it in DAILY_SKETCHES. Drift between a day and its trailing window is
+then a KS distance (and median shift) between the day's sketch and the merge
+of the window's sketches, so years of history cost kilobytes of sketches
+instead of a rescan.
+
+  $ python data/sketch.py data/dbs/Ex4.db EXOPLANETS distance g orbital_period avg_temp eccentricity
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+import sqlite3
+
+K = 200
+CHUNK_ROWS = 100000
+DRIFT_WINDOW = 14
+
+class KLLSketch:
+  """KLL quantile sketch over floats.
+
+  Level h holds items of weight 2**h. When the sketch outgrows its capacity,
+  the lowest full level is sorted and every other item (alternating offsets)
+  is promoted one level up. Rank error is about 1.7 / k.
+  """
+
+  def __init__(self, k=K):
+    self.k = k
+    self.n = 0
+    self.levels = [np.empty(0)]
+    self._flip = 0
+
+  def _capacity(self, level):
+    depth = len(self.levels) - level - 1
+    return max(int(np.ceil(self.k * (2.0 / 3.0) ** depth)), 8)
+
+  def _compress(self):
+    while True:
+      for h, items in enumerate(self.levels):
+        if len(items) >= self._capacity(h): break
+      else:
+        return
+      if h + 1 == len(self.levels): self.levels.append(np.empty(0))
+      items = np.sort(self.levels[h])
+      if len(items) % 2:
+        self.levels[h], items = items[-1:], items[:-1]
+      else:
+        self.levels[h] = np.empty(0)
+      self._flip ^= 1
+      self.levels[h + 1] = np.concatenate([self.levels[h + 1], items[self._flip::2]])
+
+  def update(self, values):
+    """Add an array of values; NaNs are ignored."""
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if not len(values): return self
+    self.n += len(values)
+    self.levels[0] = np.concatenate([self.levels[0], values])
+    self._compress()
+    return self
+
+  def merge(self, other):
+    """Fold `other` into this sketch in place."""
+    while len(self.levels) < len(other.levels): self.levels.append(np.empty(0))
+    for h, items in enumerate(other.levels):
+      self.levels[h] = np.concatenate([self.levels[h], items])
+    self.n += other.n
+    self._compress()
+    return self
+
+  def weighted_items(self):
+    """Sorted items with their weights."""
+    items = np.concatenate(self.levels)
+    weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+    order = np.argsort(items, kind="stable")
+    return items[order], weights[order]
+
+  def cdf(self, points):
+    """Estimated fraction of values <= each of `points`."""
+    items, weights = self.weighted_items()
+    if not len(items): return np.full(len(np.atleast_1d(points)), np.nan)
+    cumulative = np.concatenate([[0.0], np.cumsum(weights)]) / weights.sum()
+    return cumulative[np.searchsorted(items, points, side="right")]
+
+  def quantile(self, q):
+    items, weights = self.weighted_items()
+    if not len(items): return np.nan
+    cumulative = np.cumsum(weights) / weights.sum()
+    return items[min(np.searchsorted(cumulative, q, side="left"), len(items) - 1)]
+
+  def to_bytes(self):
+    header = np.array([self.k, self.n, len(self.levels)] + [len(level) for level in self.levels], dtype=np.float64)
+    return np.concatenate([header] + self.levels).tobytes()
+
+  @classmethod
+  def from_bytes(cls, blob):
+    data = np.frombuffer(blob, dtype=np.float64)
+    sketch = cls(int(data[0]))
+    sketch.n, num_levels = int(data[1]), int(data[2])
+    sizes = data[3:3 + num_levels].astype(int)
+    offsets = 3 + num_levels + np.concatenate([[0], np.cumsum(sizes)])
+    sketch.levels = [data[offsets[i]:offsets[i + 1]].copy() for i in range(num_levels)]
+    return sketch
+
+def ks_distance(a, b):
+  """Largest gap between two sketches' CDFs."""
+  points = np.union1d(a.weighted_items()[0], b.weighted_items()[0])
+  if not len(points): return np.nan
+  return float(np.max(np.abs(a.cdf(points) - b.cdf(points))))
+
+def create_sketch_table(conn):
+  conn.execute("""
+    CREATE TABLE IF NOT EXISTS DAILY_SKETCHES(
+      TABLE_NAME VARCHAR(16777216) NOT NULL,
+      DATE_ADDED TIMESTAMP_NTZ(6) NOT NULL,
+      COLUMN_NAME VARCHAR(16777216) NOT NULL,
+      SKETCH BLOB NOT NULL,
+      PRIMARY KEY (TABLE_NAME, DATE_ADDED, COLUMN_NAME)
+    )
+  """)
+
+def build_daily_sketches(conn, table, columns, since="", k=K, chunk_rows=CHUNK_ROWS):
+  """Sketch every column per day in one pass over the days at or after `since`."""
+  create_sketch_table(conn)
+  SQL = "SELECT DATE_ADDED, {} FROM {} WHERE DATE_ADDED >= ? ORDER BY DATE_ADDED".format(", ".join(columns), table)
+  sketches = {}
+  for chunk in pd.read_sql_query(SQL, conn, params=(since,), chunksize=chunk_rows):
+    chunk = chunk.rename(columns={clmn: clmn.lower() for clmn in chunk.columns})
+    for date, day in chunk.groupby("date_added", sort=False):
+      for column in columns:
+        key = (date, column)
+        if key not in sketches: sketches[key] = KLLSketch(k)
+        sketches[key].update(pd.to_numeric(day[column.lower()], errors="coerce").to_numpy(dtype=float))
+  with conn:
+    conn.execute("DELETE FROM DAILY_SKETCHES WHERE TABLE_NAME = ? AND DATE_ADDED >= ?", (table, since))
+    conn.executemany(
+      "INSERT INTO DAILY_SKETCHES VALUES (?, ?, ?, ?)",
+      [(table, date, column, sketch.to_bytes()) for (date, column), sketch in sketches.items()]
+    )
+  return len(sketches)
+
+def load_sketches(conn, table, column):
+  rows = conn.execute(
+    "SELECT DATE_ADDED, SKETCH FROM DAILY_SKETCHES WHERE TABLE_NAME = ? AND COLUMN_NAME = ? ORDER BY DATE_ADDED",
+    (table, column)
+  ).fetchall()
+  return [date for date, _ in rows], [KLLSketch.from_bytes(blob) for _, blob in rows]
+
+def drift_scores(conn, table, column, window=DRIFT_WINDOW):
+  """KS distance and median shift of each day against the merge of its trailing `window` days."""
+  dates, sketches = load_sketches(conn, table, column)
+  rows = []
+  for i in range(1, len(sketches)):
+    baseline = KLLSketch(sketches[i].k)
+    for sketch in sketches[max(0, i - window):i]: baseline.merge(sketch)
+    if not baseline.n or not sketches[i].n: continue
+    rows.append({
+      "date_added": dates[i],
+      "ks_distance": ks_distance(sketches[i], baseline),
+      "median": sketches[i].quantile(0.5),
+      "baseline_median": baseline.quantile(0.5)
+    })
+  df = pd.DataFrame(rows, columns=["date_added", "ks_distance", "median", "baseline_median"])
+  df["median_shift"] = df["median"] - df["baseline_median"]
+  return df
+
+def main():
+  parser = argparse.ArgumentParser(description="Build daily quantile sketches and report drift.")
+  parser.add_argument("db")
+  parser.add_argument("table")
+  parser.add_argument("columns", nargs="+")
+  parser.add_argument("--window", type=int, default=DRIFT_WINDOW)
+  parser.add_argument("--threshold", type=float, default=0.3, help="KS distance to report")
+  args = parser.parse_args()
+  conn = sqlite3.connect(args.db)
+  build_daily_sketches(conn, args.table, args.columns)
+  for column in args.columns:
+    scores = drift_scores(conn, args.table, column, args.window)
+    for _, row in scores[scores["ks_distance"] >= args.threshold].iterrows():
+      print("{} {} KS={:.2f} median {:.2f} -> {:.2f}".format(
+        row["date_added"], column, row["ks_distance"], row["baseline_median"], row["median"]
+      ))
+
+if __name__ == "__main__":
+  main()
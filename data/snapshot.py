@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Memory-mapped columnar snapshots of SQLite tables.
+
+Each table is stored as one typed `.npy` file per column and opened with
+`mmap_mode="r"`, so repeated loads skip the SQLite decode and processes share
+the same pages. Integer columns (declared INT and holding only integers) are
+int64 plus a boolean null mask, other numeric columns are float64 (NULL ->
+NaN), and text columns are dictionary-encoded as int32 codes (-1 for NULL)
+plus a fixed-width unicode dictionary. A snapshot is rebuilt automatically
+when the database file's mtime or size (or its WAL's) no longer match the
+ones it was built from.
+
+  $ python data/snapshot.py data/dbs/Ex4.db EXOPLANETS
+"""
+
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.aggregates import is_numeric
+
+CHUNK_ROWS = 100000
+
+def snapshot_dir(db_path, table, root=None):
+  db_path = os.path.abspath(db_path)
+  if root is None: root = os.path.join(os.path.dirname(db_path), ".snapshots")
+  return os.path.join(root, os.path.basename(db_path), table)
+
+def fingerprint(db_path):
+  """mtime and size of the database file and its WAL, if any."""
+  parts = []
+  for path in (db_path, db_path + "-wal"):
+    if os.path.exists(path):
+      stat = os.stat(path)
+      parts.append([os.path.basename(path), stat.st_mtime_ns, stat.st_size])
+  return parts
+
+def column_kinds(conn, table, columns):
+  """"int64", "float64" or "text" for each of `columns`, a list of (column, declared type).
+
+  A column declared INT but holding any non-integer value is stored as float64.
+  """
+  kinds = dict((column, "float64" if is_numeric(dtype) else "text") for column, dtype in columns)
+  ints = [column for column, dtype in columns if "INT" in dtype.upper()]
+  if ints:
+    counts = conn.execute("SELECT {} FROM {}".format(
+      ", ".join("SUM(TYPEOF({}) NOT IN ('integer', 'null'))".format(column) for column in ints), table
+    )).fetchone()
+    kinds.update((column, "int64") for column, count in zip(ints, counts) if not count)
+  return kinds
+
+def build_snapshot(db_path, table, root=None, chunk_rows=CHUNK_ROWS):
+  """Write the columnar snapshot of `table`, replacing any existing one."""
+  target = snapshot_dir(db_path, table, root)
+  before = fingerprint(db_path)
+  conn = sqlite3.connect("file:{}?mode=ro".format(os.path.abspath(db_path)), uri=True)
+  columns = [(row[1], row[2]) for row in conn.execute("PRAGMA table_info({})".format(table))]
+  n = conn.execute("SELECT COUNT(*) FROM {}".format(table)).fetchone()[0]
+
+  kinds = column_kinds(conn, table, columns)
+
+  os.makedirs(os.path.dirname(target), exist_ok=True)
+  tmp = tempfile.mkdtemp(dir=os.path.dirname(target))
+  def memmap(name, dtype):
+    return np.lib.format.open_memmap(os.path.join(tmp, name + ".npy"), mode="w+", dtype=dtype, shape=(n,))
+  floats = dict((column, memmap(column, np.float64)) for column, _ in columns if kinds[column] == "float64")
+  ints = dict(
+    (column, (memmap(column, np.int64), memmap(column + ".mask", np.bool_)))
+    for column, _ in columns if kinds[column] == "int64"
+  )
+  text = dict((column, []) for column, _ in columns if kinds[column] == "text")
+
+  # read through the cursor rather than pandas, which turns integers with NULLs into floats
+  offset = 0
+  cursor = conn.execute("SELECT {} FROM {}".format(", ".join(column for column, _ in columns), table))
+  rows = cursor.fetchmany(chunk_rows)
+  while rows:
+    chunk = dict(zip((column for column, _ in columns), (np.array(values, dtype=object) for values in zip(*rows))))
+    end = offset + len(rows)
+    for column, out in floats.items():
+      out[offset:end] = pd.to_numeric(pd.Series(chunk[column]), errors="coerce").to_numpy(dtype=float)
+    for column, (out, mask) in ints.items():
+      is_null = np.equal(chunk[column], None)
+      out[offset:end] = np.where(is_null, 0, chunk[column]).astype(np.int64)
+      mask[offset:end] = is_null
+    for column, parts in text.items():
+      parts.append(chunk[column])
+    offset = end
+    rows = cursor.fetchmany(chunk_rows)
+  conn.close()
+
+  for out in floats.values(): out.flush()
+  for out, mask in ints.values():
+    out.flush()
+    mask.flush()
+  del floats, ints
+  for column, parts in text.items():
+    values = pd.Series(np.concatenate(parts) if parts else np.array([], dtype=object))
+    codes, uniques = pd.factorize(values.where(values.isna(), values.astype(str)))
+    np.save(os.path.join(tmp, column + ".codes.npy"), codes.astype(np.int32))
+    np.save(os.path.join(tmp, column + ".dict.npy"), np.asarray(uniques, dtype=str))
+
+  with open(os.path.join(tmp, "meta.json"), "w") as f:
+    json.dump({
+      "db": os.path.abspath(db_path),
+      "table": table,
+      "rows": n,
+      "columns": [[column, kinds[column], dtype] for column, dtype in columns],
+      "fingerprint": before
+    }, f)
+  if os.path.exists(target): shutil.rmtree(target)
+  os.replace(tmp, target)
+  return target
+
+def is_fresh(db_path, table, root=None):
+  path = os.path.join(snapshot_dir(db_path, table, root), "meta.json")
+  if not os.path.exists(path): return False
+  with open(path) as f:
+    return json.load(f)["fingerprint"] == fingerprint(db_path)
+
+def load_columns(db_path, table, columns=None, root=None):
+  """Memory-mapped arrays for `table`, rebuilding the snapshot first if it is stale.
+
+  Returns {column: array} for float columns, {column: masked array} for integer
+  columns (masked where NULL) and {column: (codes, dictionary)} for text columns.
+  """
+  if not is_fresh(db_path, table, root): build_snapshot(db_path, table, root)
+  target = snapshot_dir(db_path, table, root)
+  with open(os.path.join(target, "meta.json")) as f:
+    meta = json.load(f)
+  arrays = {}
+  for column, kind, _ in meta["columns"]:
+    if columns is not None and column not in columns: continue
+    if kind == "float64":
+      arrays[column] = np.load(os.path.join(target, column + ".npy"), mmap_mode="r")
+    elif kind == "int64":
+      arrays[column] = np.ma.MaskedArray(
+        np.load(os.path.join(target, column + ".npy"), mmap_mode="r"),
+        mask=np.load(os.path.join(target, column + ".mask.npy"), mmap_mode="r")
+      )
+    else:
+      arrays[column] = (
+        np.load(os.path.join(target, column + ".codes.npy"), mmap_mode="r"),
+        np.load(os.path.join(target, column + ".dict.npy"))
+      )
+  return arrays
+
+def read_table(db_path, table, columns=None, root=None, categorical=False):
+  """Drop-in for `pd.read_sql("SELECT * FROM <table>")`, served from the snapshot.
+
+  As with `pd.read_sql`, integer columns are int64 (float64 with NaN if they
+  have NULLs) and text columns are object strings with None for NULL. With
+  `categorical=True` text columns come back as pandas Categoricals instead.
+  """
+  data = {}
+  for column, values in load_columns(db_path, table, columns, root).items():
+    if isinstance(values, tuple):
+      codes, dictionary = values
+      codes = np.asarray(codes)
+      if categorical:
+        values = pd.Categorical.from_codes(codes, categories=dictionary)
+      else:
+        # code -1 picks the trailing None
+        values = np.asarray(list(dictionary) + [None], dtype=object)[codes]
+    elif isinstance(values, np.ma.MaskedArray):
+      values = values.astype(float).filled(np.nan) if values.mask.any() else np.asarray(values.data)
+    data[column] = values
+  return pd.DataFrame(data)
+
+def main():
+  parser = argparse.ArgumentParser(description="Build (or refresh) columnar snapshots of tables.")
+  parser.add_argument("db")
+  parser.add_argument("tables", nargs="+")
+  parser.add_argument("--force", action="store_true")
+  args = parser.parse_args()
+  for table in args.tables:
+    if args.force or not is_fresh(args.db, table):
+      print("built {}".format(build_snapshot(args.db, table)))
+    else:
+      print("{} is up to date".format(snapshot_dir(args.db, table)))
+
+if __name__ == "__main__":
+  main()
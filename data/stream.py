@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Online detector for metric streams in the `helpers/make_data.py` format.
+
+Points are (table_id, metric, field, timestamp, value). Each (table_id,
+metric, field) series keeps O(1) state: an EWMA level, a slower (and
+bias-corrected) EWMA variance of the residuals, and a seasonal offset per slot
+(hour of day by default). Offsets only count once they are larger than
+fitting noise would make them. Every point is scored against level + seasonal
+offset as it arrives, so alerts come out immediately and nothing is
+re-queried.
+
+  $ python data/stream.py data/ex_1.csv
+  $ python data/stream.py data/ex_1.csv --follow
+"""
+
+import argparse
+import csv
+import math
+import time
+from datetime import datetime
+
+ALPHA = 0.1
+VAR_ALPHA = 0.02
+SEASONAL_ALPHA = 0.05
+SEASONAL_Z = 2.0
+SEASON = 24
+SEASON_PERIOD = 3600
+WARMUP = 24
+Z_THRESHOLD = 3.5
+DROP_RATIO = 0.3
+DROP_Z = 3.0
+SUSTAINED_DROP_Z = 2.5
+RELEARN_AFTER = 12
+
+class SeriesState:
+  __slots__ = ("count", "level", "var", "weight", "offsets", "run", "last_z")
+
+  def __init__(self, season):
+    self.count = 0
+    self.level = 0.0
+    self.var = 0.0
+    self.weight = 0.0
+    self.offsets = [0.0] * season
+    self.run = 0
+    self.last_z = 0.0
+
+def _epoch(timestamp):
+  if isinstance(timestamp, (int, float)): return float(timestamp)
+  if isinstance(timestamp, str): timestamp = datetime.fromisoformat(timestamp)
+  return timestamp.timestamp()
+
+class StreamDetector:
+  """Scores metric points one at a time, keeping constant state per series.
+
+  A point is anomalous when it is 0 while the series' level is positive
+  ("zero"), when its residual is more than `z_threshold` standard deviations
+  from expected ("spike"/"drop"), or when it falls more than `drop_ratio`
+  below the expected value ("drop") and is also unlikely under the tracked
+  variance: at least `drop_z` standard deviations low on its own, or
+  `sustained_drop_z` low averaged with the point before it. Anomalous points
+  don't update the baseline, unless `relearn_after` of them arrive in a row,
+  in which case the series re-baselines on the new level.
+  """
+
+  def __init__(
+    self,
+    alpha=ALPHA,
+    var_alpha=VAR_ALPHA,
+    seasonal_alpha=SEASONAL_ALPHA,
+    seasonal_z=SEASONAL_Z,
+    season=SEASON,
+    season_period=SEASON_PERIOD,
+    warmup=WARMUP,
+    z_threshold=Z_THRESHOLD,
+    drop_ratio=DROP_RATIO,
+    drop_z=DROP_Z,
+    sustained_drop_z=SUSTAINED_DROP_Z,
+    relearn_after=RELEARN_AFTER,
+  ):
+    self.alpha = alpha
+    self.var_alpha = var_alpha
+    self.seasonal_alpha = seasonal_alpha
+    # std of an offset fitted to pure noise, per unit of residual std
+    self.offset_noise = seasonal_z * math.sqrt(seasonal_alpha / (2 - seasonal_alpha))
+    self.season = season
+    self.season_period = season_period
+    self.warmup = warmup
+    self.z_threshold = z_threshold
+    self.drop_ratio = drop_ratio
+    self.drop_z = drop_z
+    self.sustained_drop_z = sustained_drop_z
+    self.relearn_after = relearn_after
+    self.series = {}
+
+  def _learn(self, state, value, slot):
+    if state.count == 0:
+      state.level = value
+    else:
+      residual = value - state.level - state.offsets[slot]
+      state.var = (1 - self.var_alpha) * (state.var + self.var_alpha * residual * residual)
+      state.weight = (1 - self.var_alpha) * state.weight + self.var_alpha
+      state.level += self.alpha * (value - state.offsets[slot] - state.level)
+      state.offsets[slot] += self.seasonal_alpha * (value - state.level - state.offsets[slot])
+    state.count += 1
+
+  def _expected(self, state, slot, std):
+    offset = state.offsets[slot]
+    if abs(offset) <= self.offset_noise * std: offset = 0.0
+    return state.level + offset
+
+  def update(self, table_id, metric, field, timestamp, value):
+    """Score one point and fold it into its series. Returns an alert dict or None."""
+    key = (table_id, metric, field)
+    state = self.series.get(key)
+    if state is None:
+      state = self.series[key] = SeriesState(self.season)
+    slot = int(_epoch(timestamp) // self.season_period) % self.season
+    value = float(value)
+
+    kind, z, expected = None, 0.0, state.level
+    if state.count >= self.warmup:
+      std = math.sqrt(state.var / state.weight) if state.weight > 0 else 0.0
+      expected = self._expected(state, slot, std)
+      z = (value - expected) / std if std > 0 else 0.0
+      sustained_z = (z + state.last_z) / math.sqrt(2)
+      if value == 0 and state.level > 0: kind = "zero"
+      elif abs(z) > self.z_threshold: kind = "spike" if z > 0 else "drop"
+      elif expected > 0 and value < (1 - self.drop_ratio) * expected and (
+        z < -self.drop_z or sustained_z < -self.sustained_drop_z
+      ): kind = "drop"
+    state.last_z = z
+
+    if kind is None:
+      state.run = 0
+      self._learn(state, value, slot)
+      return None
+
+    state.run += 1
+    alert = {
+      "table_id": table_id,
+      "metric": metric,
+      "field": field,
+      "timestamp": timestamp,
+      "value": value,
+      "expected": expected,
+      "z_score": z,
+      "kind": kind
+    }
+    if state.run >= self.relearn_after:
+      state.level, state.run = value - state.offsets[slot], 0
+    return alert
+
+  def process(self, points):
+    """Yield alerts for an iterable of (table_id, metric, field, timestamp, value) points."""
+    for point in points:
+      alert = self.update(*point)
+      if alert is not None: yield alert
+
+def _parse(row):
+  return (row["table_id"], row["metric"], row["field"] or None, row["timestamp"], float(row["value"]))
+
+def read_points(path):
+  """Points from a metric CSV written by `helpers/make_data.py`."""
+  with open(path, newline="") as f:
+    for row in csv.DictReader(f):
+      yield _parse(row)
+
+def tail_points(path, poll_seconds=1.0):
+  """Follow a metric CSV like `tail -f`, yielding points as lines are appended."""
+  with open(path, newline="") as f:
+    header = next(csv.reader([f.readline()]))
+    pending = ""
+    while True:
+      line = f.readline()
+      if not line:
+        time.sleep(poll_seconds)
+        continue
+      pending += line
+      if not pending.endswith("\n"): continue
+      yield _parse(dict(zip(header, next(csv.reader([pending])))))
+      pending = ""
+
+def main():
+  parser = argparse.ArgumentParser(description="Stream metric points through the online detector.")
+  parser.add_argument("path")
+  parser.add_argument("--follow", action="store_true", help="keep reading as the file grows")
+  parser.add_argument("--z-threshold", type=float, default=Z_THRESHOLD)
+  args = parser.parse_args()
+  detector = StreamDetector(z_threshold=args.z_threshold)
+  points = tail_points(args.path) if args.follow else read_points(args.path)
+  for alert in detector.process(points):
+    print("{timestamp} {table_id} {metric} {kind}: {value:.0f} (expected {expected:.0f})".format(**alert))
+
+if __name__ == "__main__":
+  main()
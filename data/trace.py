@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Instrumentation for queries, writes and generator stages.
+
+Disabled by default: `span` then returns a shared no-op context manager, so
+instrumented code pays one global lookup. Once enabled (with `enable()`, or
+by setting TRACE_OUT to a file path before running any script), each span
+records wall and CPU time, rows, and for SQL spans the SQLite VM steps
+(counted through the connection's progress handler) and the
+`EXPLAIN QUERY PLAN`, flagging full table scans. Spans export as structured
+JSON or as a Chrome trace (open in chrome://tracing or ui.perfetto.dev).
+
+  $ TRACE_OUT=trace.json python data/runner.py data/dbs/Ex4.db
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+
+STEP_INTERVAL = 1000
+
+_tracer = None
+# conn -> stack of (progress handler, interval): the base handler installed
+# with set_progress_handler, then one entry per open span on that connection.
+# Keyed by the connection itself rather than its id, so an entry keeps its
+# connection alive and a later connection can never inherit it; an entry is
+# dropped once its connection has no base handler and no open spans. Pool
+# threads trace their own connections concurrently, so the map is locked.
+_handlers = {}
+_handlers_lock = threading.Lock()
+
+class _NullSpan:
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+  def set(self, **fields):
+    pass
+
+_NULL_SPAN = _NullSpan()
+
+def _handler_stack(conn):
+  with _handlers_lock:
+    return _handlers.setdefault(conn, [(None, STEP_INTERVAL)])
+
+def _release(conn, stack):
+  with _handlers_lock:
+    if len(stack) == 1 and stack[0][0] is None and _handlers.get(conn) is stack: del _handlers[conn]
+
+def get_progress_handler(conn):
+  """The handler installed on `conn` with set_progress_handler, or None."""
+  with _handlers_lock:
+    stack = _handlers.get(conn)
+  return None if stack is None else stack[0][0]
+
+def set_progress_handler(conn, handler, n):
+  """Install a progress handler on `conn` that spans will chain to instead of replacing."""
+  stack = _handler_stack(conn)
+  stack[0] = (handler, n)
+  if len(stack) > 1: return
+  conn.set_progress_handler(handler, n)
+  _release(conn, stack)
+
+def query_plan(conn, sql, params=()):
+  """EXPLAIN QUERY PLAN details for `sql`, and those that scan a whole table."""
+  try:
+    details = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, tuple(params or ()))]
+  except Exception as e:
+    return ["{}: {}".format(type(e).__name__, e)], []
+  return details, [detail for detail in details if detail.startswith("SCAN") and "CONSTANT ROW" not in detail]
+
+class Span:
+  def __init__(self, tracer, name, category, conn, sql, params, fields):
+    self.tracer = tracer
+    self.record = {"name": name, "cat": category, "tid": threading.get_ident()}
+    self.record.update(fields)
+    self.conn = conn
+    self.sql = sql
+    self.params = params
+    self.steps = 0
+
+  def set(self, **fields):
+    self.record.update(fields)
+
+  def _step(self):
+    self.steps += 1
+    # whatever is below this span now, in case the base handler was replaced
+    chained = self.stack[self.depth - 1][0]
+    if chained is not None: return chained()
+    return 0
+
+  def __enter__(self):
+    if self.conn is not None:
+      if self.sql is not None:
+        self.record["sql"] = " ".join(self.sql.split())
+        if self.tracer.explain:
+          self.record["plan"], self.record["full_scans"] = self.tracer.plan(self.conn, self.sql, self.params)
+      self.stack = _handler_stack(self.conn)
+      self.depth = len(self.stack)
+      chained, interval = self.stack[-1]
+      self.interval = min(interval, STEP_INTERVAL) if chained is None else interval
+      self.stack.append((self._step, self.interval))
+      self.conn.set_progress_handler(self._step, self.interval)
+    self.start, self.cpu = time.perf_counter(), time.thread_time()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    self.record["cpu_seconds"] = time.thread_time() - self.cpu
+    self.record["seconds"] = time.perf_counter() - self.start
+    self.record["start"] = self.start - self.tracer.origin
+    if self.conn is not None:
+      del self.stack[self.depth:]
+      handler, n = self.stack[-1]
+      self.conn.set_progress_handler(handler, n)
+      _release(self.conn, self.stack)
+      self.record["vm_steps"] = self.steps * self.interval
+    if exc_type is not None: self.record["error"] = "{}: {}".format(exc_type.__name__, exc)
+    self.tracer.add(self.record)
+    return False
+
+class Tracer:
+  def __init__(self, explain=True):
+    self.explain = explain
+    self.origin = time.perf_counter()
+    self.spans = []
+    self.plans = {}
+    self.lock = threading.Lock()
+
+  def plan(self, conn, sql, params):
+    if sql not in self.plans: self.plans[sql] = query_plan(conn, sql, params)
+    return self.plans[sql]
+
+  def add(self, record):
+    with self.lock:
+      self.spans.append(record)
+
+  def to_json(self, path):
+    with open(path, "w") as f:
+      json.dump({"spans": self.spans}, f, indent=2, default=str)
+
+  def to_chrome_trace(self, path):
+    pid = os.getpid()
+    events = [{
+      "name": span["name"],
+      "cat": span["cat"],
+      "ph": "X",
+      "ts": span["start"] * 1e6,
+      "dur": span["seconds"] * 1e6,
+      "pid": pid,
+      "tid": span["tid"],
+      "args": dict((k, v) for k, v in span.items() if k not in ("name", "cat", "start", "seconds", "tid"))
+    } for span in self.spans]
+    with open(path, "w") as f:
+      json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+  def export(self, path):
+    """Chrome trace for paths ending in .trace.json or .trace, structured JSON otherwise."""
+    if path.endswith(".trace.json") or path.endswith(".trace"): self.to_chrome_trace(path)
+    else: self.to_json(path)
+
+def enable(explain=True):
+  global _tracer
+  _tracer = Tracer(explain)
+  return _tracer
+
+def disable():
+  global _tracer
+  tracer, _tracer = _tracer, None
+  return tracer
+
+def get_tracer():
+  return _tracer
+
+def span(name, category="stage", conn=None, sql=None, params=(), **fields):
+  """Context manager timing a block. Pass `conn` (and `sql`) to count VM steps
+  and capture the query plan; call `.set(rows=...)` on it to record results.
+  """
+  if _tracer is None: return _NULL_SPAN
+  return Span(_tracer, name, category, conn, sql, params, fields)
+
+def _export_at_exit():
+  # Worker processes inherit TRACE_OUT; each writes its own <name>.<pid> file.
+  path = os.environ["TRACE_OUT"]
+  if os.environ.get("TRACE_PID") != str(os.getpid()):
+    root, ext = os.path.splitext(path)
+    if root.endswith(".trace"): root, ext = root[:-len(".trace")], ".trace" + ext
+    path = "{}.{}{}".format(root, os.getpid(), ext)
+  if _tracer is not None: _tracer.export(path)
+
+if os.environ.get("TRACE_OUT"):
+  os.environ.setdefault("TRACE_PID", str(os.getpid()))
+  enable(explain=os.environ.get("TRACE_EXPLAIN", "1") != "0")
+  atexit.register(_export_at_exit)
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Parallel tuning of monitor parameters against the INCIDENTS ledger.
+
+`show_f_plots` sweeps one freshness threshold on one table. Here every
+monitor has a search space (null-rate cutoffs and windows per column, volume
+z-score bands, zero-rate thresholds for columns like HABITABILITY, ...) that is
+searched on a grid or at random. The per-day metrics each detector needs are
+computed with SQL once per table and saved as .npy files, which the workers
+of a process pool memory-map, so a trial is a few vectorized array
+operations and never touches the database. Trials for the same monitor,
+table and column are scored together by `data.evaluate.evaluate`.
+
+Search runs in rungs over growing prefixes of the history (successive
+halving): after each rung, only the configurations in the best Pareto fronts
+of precision vs. recall go on, so dominated ones are dropped before they are
+scored on the full history. The result is the Pareto front per monitor (and
+table and column).
+
+  $ python data/tune.py data/dbs/Ex4.db --monitors null_rate volume --workers 4 --out pareto.csv
+"""
+
+import argparse
+import itertools
+import json
+import math
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import sqlite3
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.aggregates import is_numeric, table_columns
+from data.evaluate import evaluate, load_incidents
+from data.metrics import get_days_since_update
+from data.profiler import profile_null_rates
+from data.query import read_sql
+
+RUNGS = (0.25, 0.5, 1.0)
+ETA = 3
+BATCH_SIZE = 256
+BETAS = (1, 0.5, 2)
+
+# grids; random search samples lists uniformly and (low, high) tuples continuously
+SPACES = {
+  "freshness": {"threshold_days": list(range(15))},
+  "volume": {"window": [7, 14, 28], "z_threshold": [1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 5.0]},
+  "null_rate": {
+    "column": None,
+    "window": [7, 14, 28],
+    "z_threshold": [1.0, 2.0, 3.0, 4.0],
+    "min_increase": [0.05, 0.1, 0.2, 0.3, 0.5]
+  },
+  "zero_rate": {
+    "column": None,
+    "window": [7, 14, 28],
+    "z_threshold": [1.0, 2.0, 3.0, 4.0],
+    "min_increase": [0.02, 0.05, 0.1, 0.2]
+  },
+}
+# which incidents each monitor is scored against (None: all), and how late an alert may be
+MONITOR_KINDS = {"freshness": ("full_outage",), "volume": ("full_outage",), "null_rate": ("null_spike",), "zero_rate": None}
+MONITOR_TOLERANCE = {"freshness": 1, "volume": 1, "null_rate": 0, "zero_rate": 0}
+
+def _key(table, metric, column=None):
+  return ".".join(part for part in (table, metric, column) if part)
+
+def zero_rate_sql(columns, table):
+  selects = ["DATE_ADDED"] + ["AVG(CASE WHEN {0} = 0 THEN 1.0 ELSE 0.0 END) AS {0}".format(column) for column in columns]
+  return """
+    SELECT
+      {}
+    FROM
+      {}
+    GROUP BY
+      DATE_ADDED
+    ORDER BY
+      DATE_ADDED
+    """.format(",\n      ".join(selects), table)
+
+def precompute(conn, table, directory):
+  """Save `table`'s per-day metric arrays (one entry per day with data) under `directory`.
+
+  Returns {"null_rate": columns, "zero_rate": numeric columns}.
+  """
+  null_rates = profile_null_rates(conn, table)
+  freshness = get_days_since_update(conn, table).set_index("date_added").reindex(null_rates.index)
+  numeric = [
+    column for column, dtype in table_columns(conn, table)
+    if is_numeric(dtype) and column.upper() not in ("_ID", "DATE_ADDED")
+  ]
+  zero_rates = read_sql(conn, zero_rate_sql(numeric, table)) if numeric else pd.DataFrame()
+  zero_rates = zero_rates.rename(columns={clmn: clmn.lower() for clmn in zero_rates.columns})
+
+  arrays = {
+    _key(table, "days"): pd.to_datetime(null_rates.index.to_series()).to_numpy(dtype="datetime64[D]"),
+    _key(table, "rows_added"): null_rates["row_count"].to_numpy(dtype=float),
+    _key(table, "days_since_update"): freshness["days_since_update"].to_numpy(dtype=float),
+  }
+  columns = {"null_rate": [column for column in null_rates.columns if column not in ("row_count", "_id")], "zero_rate": []}
+  for column in columns["null_rate"]:
+    arrays[_key(table, "null_rate", column)] = null_rates[column].to_numpy(dtype=float)
+  for column in zero_rates.columns.drop("date_added", errors="ignore"):
+    columns["zero_rate"].append(column)
+    arrays[_key(table, "zero_rate", column)] = zero_rates[column].to_numpy(dtype=float)
+  for key, values in arrays.items(): np.save(os.path.join(directory, key + ".npy"), values)
+  return columns
+
+# worker state: memory-mapped arrays, trailing baselines and incidents
+_directory = None
+_arrays = {}
+_baselines = {}
+_incidents = None
+
+def _init_worker(directory, incidents):
+  global _directory, _incidents
+  _directory, _incidents = directory, incidents
+  _arrays.clear()
+  _baselines.clear()
+
+def _array(key):
+  if key not in _arrays: _arrays[key] = np.load(os.path.join(_directory, key + ".npy"), mmap_mode="r")
+  return _arrays[key]
+
+def _baseline(key, window):
+  """Mean and std of the previous `window` days, like the batch monitors' rolling baselines."""
+  if (key, window) not in _baselines:
+    history = pd.Series(np.asarray(_array(key))).shift(1).rolling(window, min_periods=2)
+    _baselines[(key, window)] = (history.mean().to_numpy(), history.std().to_numpy())
+  return _baselines[(key, window)]
+
+def detect_freshness(table, n, threshold_days):
+  return _array(_key(table, "days_since_update"))[:n] > threshold_days
+
+def detect_volume(table, n, window, z_threshold):
+  key = _key(table, "rows_added")
+  mean, std = _baseline(key, window)
+  with np.errstate(divide="ignore", invalid="ignore"):
+    z = (_array(key)[:n] - mean[:n]) / std[:n]
+  return np.abs(z) >= z_threshold
+
+def _detect_rate(key, n, window, z_threshold, min_increase):
+  baseline, spread = _baseline(key, window)
+  increase = _array(key)[:n] - baseline[:n]
+  with np.errstate(divide="ignore", invalid="ignore"):
+    z = increase / np.nan_to_num(spread[:n])
+  return (increase >= min_increase) & (z >= z_threshold)
+
+def detect_null_rate(table, n, column, window, z_threshold, min_increase):
+  return _detect_rate(_key(table, "null_rate", column), n, window, z_threshold, min_increase)
+
+def detect_zero_rate(table, n, column, window, z_threshold, min_increase):
+  return _detect_rate(_key(table, "zero_rate", column), n, window, z_threshold, min_increase)
+
+DETECTORS = {
+  "freshness": detect_freshness,
+  "volume": detect_volume,
+  "null_rate": detect_null_rate,
+  "zero_rate": detect_zero_rate,
+}
+
+def monitor_incidents(incidents, monitor, table, column=None):
+  incidents = incidents[incidents["table"] == table]
+  kinds = MONITOR_KINDS[monitor]
+  if kinds is not None: incidents = incidents[incidents["kind"].isin(kinds)]
+  if column is not None and monitor == "null_rate":
+    incidents = incidents[incidents["columns"].map(lambda columns: column in json.loads(columns))]
+  return incidents
+
+def score_batch(monitor, table, column, configs, fraction):
+  """Score `configs` of one monitor on the first `fraction` of `table`'s days."""
+  days = _array(_key(table, "days"))
+  n = max(1, int(math.ceil(fraction * len(days))))
+  tolerance = MONITOR_TOLERANCE[monitor]
+  incidents = monitor_incidents(_incidents, monitor, table, column)
+  # only incidents that could already have been caught by the end of the prefix;
+  # alerts on the others' days are neither hits nor false positives yet
+  cutoff = pd.Timestamp(str(days[n - 1]))
+  window_end = pd.to_datetime(incidents["end"]) + pd.Timedelta(days=tolerance)
+  pending = incidents[window_end > cutoff]
+  incidents = incidents[window_end <= cutoff]
+  day_dates = pd.to_datetime(pd.Series(days[:n])).to_numpy()
+  def within(starts, ends):
+    inside = np.zeros(n, dtype=bool)
+    for start, end in zip(pd.to_datetime(starts), ends):
+      inside |= (day_dates >= start.to_datetime64()) & (day_dates <= end.to_datetime64())
+    return inside
+  undecided = within(pending["start"], window_end[window_end > cutoff])
+  undecided &= ~within(incidents["start"], window_end[window_end <= cutoff])
+
+  trials, dates = [], []
+  for trial, config in enumerate(configs):
+    flagged = np.flatnonzero(DETECTORS[monitor](table, n, **config) & ~undecided)
+    trials.append(np.full(len(flagged), trial))
+    dates.append(days[flagged])
+  alerts = pd.DataFrame({"trial": np.concatenate(trials), "date_added": np.concatenate(dates)})
+  alerts["table"] = table
+  return evaluate(alerts, incidents, "trial", tolerance, BETAS, groups=range(len(configs)))
+
+def grid(space):
+  names = list(space)
+  return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+def sample(space, n, rng):
+  """`n` random configurations; lists are sampled uniformly, (low, high) ranges continuously."""
+  configs = []
+  for _ in range(n):
+    config = {}
+    for name, values in space.items():
+      if isinstance(values, tuple):
+        low, high = values
+        config[name] = int(rng.integers(low, high + 1)) if isinstance(low, int) else float(rng.uniform(low, high))
+      else:
+        config[name] = values[int(rng.integers(len(values)))]
+    configs.append(config)
+  return configs
+
+def pareto_ranks(precision, recall):
+  """Non-dominated sorting: 0 for the Pareto front, 1 for the front without it, ..."""
+  precision, recall = np.asarray(precision, dtype=float), np.asarray(recall, dtype=float)
+  dominates = (
+    (precision[:, None] >= precision[None, :]) & (recall[:, None] >= recall[None, :])
+    & ((precision[:, None] > precision[None, :]) | (recall[:, None] > recall[None, :]))
+  )
+  ranks = np.full(len(precision), -1)
+  rank, remaining = 0, np.ones(len(precision), dtype=bool)
+  while remaining.any():
+    front = remaining & ~dominates[remaining].any(axis=0)
+    ranks[front] = rank
+    remaining &= ~front
+    rank += 1
+  return ranks
+
+def prune(scores, eta=ETA):
+  """Indices of the best Pareto fronts holding at least 1/`eta` of the configurations."""
+  ranks = pareto_ranks(scores["precision"], scores["recall"])
+  keep = int(math.ceil(len(ranks) / eta))
+  counts = np.cumsum(np.bincount(ranks))
+  last = int(np.searchsorted(counts, keep))
+  return np.flatnonzero(ranks <= last)
+
+def search_groups(columns, tables, monitors, search="grid", trials=100, seed=0, spaces=SPACES):
+  """(monitor, table, column) -> configurations to try."""
+  rng = np.random.default_rng(seed)
+  groups = {}
+  for monitor in monitors:
+    space = dict((name, values) for name, values in spaces[monitor].items() if name != "column")
+    for table in tables:
+      targets = (spaces[monitor]["column"] or columns[table][monitor]) if "column" in spaces[monitor] else [None]
+      for column in targets:
+        configs = grid(space) if search == "grid" else sample(space, trials, rng)
+        if column is not None: configs = [dict(config, column=column) for config in configs]
+        groups[(monitor, table, column)] = configs
+  return groups
+
+def tune(
+  conn, tables, monitors=tuple(SPACES), search="grid", trials=100, rungs=RUNGS, eta=ETA,
+  workers=None, seed=0, spaces=SPACES, batch_size=BATCH_SIZE
+):
+  """Search every monitor's space and score survivors rung by rung.
+
+  Returns (scores, front): every configuration's score at the last rung it
+  reached, and the Pareto front per (monitor, table, column).
+  """
+  directory = tempfile.mkdtemp(prefix="tune-")
+  try:
+    columns = dict((table, precompute(conn, table, directory)) for table in tables)
+    incidents = load_incidents(conn, tables)
+    groups = search_groups(columns, tables, monitors, search, trials, seed, spaces)
+    alive = dict((group, np.arange(len(configs))) for group, configs in groups.items())
+    results = []
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(directory, incidents)) as pool:
+      for rung, fraction in enumerate(rungs):
+        futures = []
+        for group, configs in groups.items():
+          for i in range(0, len(alive[group]), batch_size):
+            batch = alive[group][i:i + batch_size]
+            futures.append((group, batch, pool.submit(score_batch, *group, [configs[j] for j in batch], fraction)))
+        scored = {}
+        for group, batch, future in futures:
+          scores = future.result()
+          scores["trial"] = batch
+          scored.setdefault(group, []).append(scores)
+        for group, frames in scored.items():
+          scores = pd.concat(frames, ignore_index=True)
+          last = rung == len(rungs) - 1
+          survivors = np.arange(len(scores)) if last else prune(scores, eta)
+          scores["rung"] = rung
+          scores["pruned"] = ~np.isin(np.arange(len(scores)), survivors)
+          monitor, table, column = group
+          scores.insert(0, "config", [groups[group][j] for j in scores["trial"]])
+          scores.insert(0, "column", column)
+          scores.insert(0, "table", table)
+          scores.insert(0, "monitor", monitor)
+          results.append(scores[scores["pruned"] | last])
+          alive[group] = scores["trial"].to_numpy()[survivors]
+  finally:
+    shutil.rmtree(directory, ignore_errors=True)
+
+  scores = pd.concat(results, ignore_index=True).drop(columns=["pruned"])
+  final = scores[scores["rung"] == len(rungs) - 1]
+  # of configurations tied on (precision, recall), keep the quickest to alert
+  front = pd.concat([
+    group[pareto_ranks(group["precision"], group["recall"]) == 0]
+    .sort_values(["mean_delay_days", "alerts"]).drop_duplicates(["precision", "recall"])
+    for _, group in final.groupby(["monitor", "table", final["column"].fillna("")], sort=False)
+  ]) if len(final) else final
+  front = front.sort_values(["monitor", "table", "column", "recall", "precision"]).reset_index(drop=True)
+  return scores, front
+
+def main():
+  parser = argparse.ArgumentParser(description="Tune monitor parameters against a database's INCIDENTS ledger.")
+  parser.add_argument("db")
+  parser.add_argument("tables", nargs="*", help="tables to tune on (default: every table in INCIDENTS)")
+  parser.add_argument("--monitors", nargs="*", default=list(SPACES), choices=list(SPACES))
+  parser.add_argument("--search", choices=["grid", "random"], default="grid")
+  parser.add_argument("--trials", type=int, default=100, help="configurations per monitor and column (random search)")
+  parser.add_argument("--eta", type=float, default=ETA, help="keep about 1/eta of the configurations per rung")
+  parser.add_argument("--workers", type=int)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--out", help="write the Pareto fronts to this CSV")
+  args = parser.parse_args()
+  conn = sqlite3.connect(args.db)
+  tables = args.tables or list(pd.unique(load_incidents(conn)["table"]))
+  scores, front = tune(
+    conn, tables, args.monitors, args.search, args.trials, eta=args.eta, workers=args.workers, seed=args.seed
+  )
+  params = pd.DataFrame(list(front["config"])).drop(columns=["column"], errors="ignore")
+  front = pd.concat([front.drop(columns=["config", "trial", "rung"]), params], axis=1)
+  if args.out: front.to_csv(args.out, index=False)
+  print("{} configurations, {} scored on the full history".format(len(scores), (scores["rung"] == len(RUNGS) - 1).sum()))
+  with pd.option_context("display.width", 200, "display.max_columns", 30, "display.max_rows", 200):
+    print(front)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Incremental uniqueness monitor for `_id`.
+
+Each table keeps a saved set of the ids it has seen, with the day each was
+first seen, and a watermark on DATE_ADDED. A refresh reads only the days after
+the watermark, checks their ids against the set (and against each other), and
+adds the new ones, so a daily check costs O(new rows) instead of a
+`GROUP BY _ID` over the whole table.
+
+Small tables keep the exact ids in a dict. Past `exact_limit` ids the state
+switches to 64-bit id hashes held in sorted runs that are merged as they grow
+(like an LSM tree), which is ~16 bytes per id; a false duplicate needs a
+64-bit hash collision.
+
+  $ python data/uniqueness.py data/dbs/Ex3.db HABITABLES
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+
+EXACT_LIMIT = 1000000
+CHUNK_ROWS = 100000
+
+def state_path(db_path, table, root=None):
+  db_path = os.path.abspath(db_path)
+  if root is None: root = os.path.join(os.path.dirname(db_path), ".uniqueness")
+  return os.path.join(root, os.path.basename(db_path), table + ".npz")
+
+def hash_ids(ids):
+  return pd.util.hash_array(np.asarray(ids, dtype=object))
+
+def _days(dates):
+  return pd.to_datetime(pd.Series(dates)).to_numpy(dtype="datetime64[D]").astype(np.int64)
+
+def _dates(days):
+  return pd.Series(np.asarray(days, dtype="datetime64[D]")).dt.strftime("%Y-%m-%d")
+
+class UniquenessState:
+  """Ids seen so far for one table, with their first-seen day."""
+
+  def __init__(self, exact_limit=EXACT_LIMIT):
+    self.exact_limit = exact_limit
+    self.watermark = ""
+    self.seen = {}
+    self.runs = []
+
+  @property
+  def mode(self):
+    return "exact" if self.seen is not None else "hashed"
+
+  def __len__(self):
+    if self.seen is not None: return len(self.seen)
+    return sum(len(hashes) for hashes, _ in self.runs)
+
+  def _lookup(self, keys):
+    if self.seen is not None:
+      # dict lookups per key; Series.map(dict) would copy the whole set on every call
+      return np.fromiter((self.seen.get(key, -1) for key in keys), dtype=np.int64, count=len(keys))
+    first = np.full(len(keys), -1, dtype=np.int64)
+    for hashes, days in self.runs:
+      pos = np.minimum(np.searchsorted(hashes, keys), len(hashes) - 1)
+      hit = hashes[pos] == keys
+      first[hit] = days[pos[hit]]
+    return first
+
+  def _insert(self, keys, days):
+    if self.seen is not None:
+      self.seen.update(zip(keys, days.tolist()))
+      if len(self.seen) <= self.exact_limit: return
+      keys, days = hash_ids(list(self.seen)), np.fromiter(self.seen.values(), dtype=np.int64)
+      self.seen = None
+    if not len(keys): return
+    order = np.argsort(keys, kind="stable")
+    self.runs.append((keys[order], days[order]))
+    while len(self.runs) > 1 and len(self.runs[-1][0]) * 2 >= len(self.runs[-2][0]):
+      (h1, d1), (h2, d2) = self.runs.pop(), self.runs.pop()
+      hashes, days = np.concatenate([h2, h1]), np.concatenate([d2, d1])
+      order = np.argsort(hashes, kind="stable")
+      self.runs.append((hashes[order], days[order]))
+
+  def check(self, ids, dates):
+    """Check a batch of new rows, then remember its ids.
+
+    Returns (is_duplicate, first_seen day) arrays aligned with the batch. An id
+    repeated within the batch counts as a duplicate from its second row on.
+    """
+    keys = np.asarray(ids, dtype=object) if self.seen is not None else hash_ids(ids)
+    days = _days(dates)
+    first = self._lookup(keys)
+    batch = pd.DataFrame({"key": keys, "day": days})
+    repeated = batch.duplicated("key").to_numpy() & (first < 0)
+    if repeated.any(): first = np.where(repeated, batch.groupby("key")["day"].transform("min").to_numpy(), first)
+    is_duplicate = first >= 0
+    new = ~is_duplicate & ~repeated
+    self._insert(keys[new], days[new])
+    return is_duplicate, first
+
+  def save(self, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if self.seen is not None:
+      keys = np.asarray(list(self.seen), dtype=str)
+      days = np.fromiter(self.seen.values(), dtype=np.int64, count=len(self.seen))
+    else:
+      keys = np.concatenate([hashes for hashes, _ in self.runs])
+      days = np.concatenate([days for _, days in self.runs])
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, keys=keys, days=days, watermark=self.watermark, mode=self.mode, exact_limit=self.exact_limit)
+    os.replace(tmp, path)
+
+  @classmethod
+  def load(cls, path):
+    data = np.load(path)
+    state = cls(int(data["exact_limit"]))
+    state.watermark = str(data["watermark"])
+    if str(data["mode"]) == "exact":
+      state.seen = dict(zip(data["keys"].tolist(), data["days"].tolist()))
+    else:
+      state.seen = None
+      order = np.argsort(data["keys"], kind="stable")
+      state.runs = [(data["keys"][order], data["days"][order])]
+    return state
+
+def refresh_uniqueness(conn, table, state, chunk_rows=CHUNK_ROWS):
+  """Check every day after `state.watermark` and advance it.
+
+  Days are assumed complete once checked. Returns one row per day with
+  duplicates: date_added, duplicates, first_seen (the earliest first-seen
+  day among that day's duplicated ids).
+  """
+  SQL = "SELECT _ID, DATE_ADDED FROM {} WHERE DATE_ADDED > ? ORDER BY DATE_ADDED".format(table)
+  found = []
+  for chunk in pd.read_sql_query(SQL, conn, params=(state.watermark,), chunksize=chunk_rows):
+    if chunk.empty: continue
+    chunk = chunk.rename(columns={clmn: clmn.lower() for clmn in chunk.columns})
+    is_duplicate, first = state.check(chunk["_id"].to_numpy(), chunk["date_added"].to_numpy())
+    found.append(pd.DataFrame({"date_added": chunk["date_added"], "first": first})[is_duplicate])
+    state.watermark = max(state.watermark, chunk["date_added"].iloc[-1])
+  found = pd.concat(found) if found else pd.DataFrame(columns=["date_added", "first"])
+  alerts = found.groupby("date_added").agg(duplicates=("first", "size"), first_seen=("first", "min")).reset_index()
+  alerts["first_seen"] = _dates(alerts["first_seen"].astype(np.int64)).to_numpy()
+  return alerts
+
+def uniqueness_monitor(conn, table, root=None, exact_limit=EXACT_LIMIT, persist=True):
+  """`refresh_uniqueness` with the state kept next to the connection's database file.
+
+  With `persist=False` the saved state is only read: new days are checked
+  against it in memory and nothing is written. Without saved state that would
+  mean hashing the whole table on every call, so it raises ValueError instead.
+  """
+  db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+  path = state_path(db_path, table, root)
+  if not persist and not os.path.exists(path):
+    raise ValueError(
+      "no saved uniqueness state for {} at {}; build it with `python data/uniqueness.py {} {}`".format(
+        table, path, db_path, table
+      )
+    )
+  state = UniquenessState.load(path) if os.path.exists(path) else UniquenessState(exact_limit)
+  alerts = refresh_uniqueness(conn, table, state)
+  if persist: state.save(path)
+  return alerts
+
+def main():
+  parser = argparse.ArgumentParser(description="Check new days of a table for duplicated _id values.")
+  parser.add_argument("db")
+  parser.add_argument("table")
+  parser.add_argument("--reset", action="store_true", help="forget saved state and recheck all history")
+  parser.add_argument("--exact-limit", type=int, default=EXACT_LIMIT)
+  args = parser.parse_args()
+  path = state_path(args.db, args.table)
+  if args.reset and os.path.exists(path): os.remove(path)
+  alerts = uniqueness_monitor(sqlite3.connect(args.db), args.table, exact_limit=args.exact_limit)
+  for _, row in alerts.iterrows():
+    print("{} {} duplicated ids (first seen {})".format(row["date_added"], row["duplicates"], row["first_seen"]))
+
+if __name__ == "__main__":
+  main()
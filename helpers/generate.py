@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Vectorized generation engine for the mock EXOPLANETS data.
+
+Incidents (full outages, null spikes, duplications) are drawn once per day into
+a schedule, then rows for whole blocks of days are drawn column-at-a-time as
+NumPy arrays. Generation cost is linear in the number of rows.
+"""
+
+import hashlib
+import numpy as np
+import os
+import pandas as pd
+import sys
+from datetime import timedelta
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.trace import span
+
+SEED = "data downtime"
+
+PROB_FULL_OUTAGE = 0.03
+PROB_NULL_SPIKE = 0.03
+PROB_DUPLICATION = 0.0
+NULL_SPIKE_SEVERITY = 0.95
+DUPLICATE_FRACTION = 0.1
+ROWS_PER_DAY = (80, 120)
+CHUNK_DAYS = 30
+
+ATMOSPHERES = ["O2", "N2", "CO2", "H2SO4"]
+
+# probability that each field is NULL on a normal day
+NULL_PROBS = {
+  "distance": 0.05,
+  "g": 0.15,
+  "orbital_period": 0.25,
+  "avg_temp": 0.4,
+  "eccentricity": 0.25,
+  "atmosphere": 0.6,
+}
+
+EX1_FIELDS = ["distance", "g", "orbital_period", "avg_temp"]
+EX2_FIELDS = EX1_FIELDS + ["eccentricity", "atmosphere"]
+
+def make_rng(seed=SEED, stream=None):
+  """Return a NumPy generator. String seeds are hashed, so the scripts can keep
+  seeding with "data downtime". Passing a `stream` number gives an independent
+  generator per stream (e.g. per table) that only depends on (seed, stream).
+  """
+  if isinstance(seed, str):
+    seed = int.from_bytes(hashlib.sha256(seed.encode("utf-8")).digest()[:8], "little")
+  if stream is not None: seed = [seed, stream]
+  return np.random.default_rng(seed)
+
+def uniform_outage_length(rng):
+  return int(rng.integers(1, 8))
+
+def gauss_outage_length(rng):
+  return abs(int(rng.normal(1, 8)))
+
+def draw_schedule(
+  rng,
+  num_days,
+  start_date,
+  fields=EX1_FIELDS,
+  prob_full_outage=PROB_FULL_OUTAGE,
+  prob_null_spike=PROB_NULL_SPIKE,
+  prob_duplication=PROB_DUPLICATION,
+  outage_length=uniform_outage_length,
+  max_null_fields=None,
+):
+  """Draw the per-day incident plan.
+
+  Returns a list with one dict per calendar day holding its `date`, whether it
+  is part of a full `outage`, the `null_fields` affected by a null spike, and
+  whether rows are `duplicated`. Spike counters only tick on days with data,
+  as in the original scripts.
+  """
+  if max_null_fields is None: max_null_fields = len(fields)
+  schedule = []
+  date = start_date
+  full_outage, null_spike, null_fields = 0, 0, ()
+  for _ in range(num_days):
+    if rng.random() <= prob_full_outage: full_outage = outage_length(rng)
+    if rng.random() <= prob_null_spike:
+      null_spike = int(rng.integers(1, 8))
+      k = int(rng.integers(1, max_null_fields + 1))
+      null_fields = tuple(sorted(set(str(field) for field in rng.choice(fields, size=k))))
+    duplicated = prob_duplication > 0 and rng.random() <= prob_duplication
+
+    if full_outage > 0:
+      schedule.append({"date": date, "outage": True, "null_fields": (), "duplicated": False})
+      full_outage -= 1
+    else:
+      schedule.append({"date": date, "outage": False, "null_fields": null_fields, "duplicated": duplicated})
+      if null_spike > 0:
+        null_spike -= 1
+        if null_spike == 0: null_fields = ()
+    date += timedelta(days=1)
+  return schedule
+
+def schedule_incidents(schedule):
+  """Collapse a schedule into incident intervals.
+
+  Each incident is a dict with `kind` ("full_outage", "null_spike" or
+  "duplication"), the affected `columns`, and inclusive `start`/`end` dates.
+  """
+  incidents = []
+  open_runs = {}
+  for day in schedule + [None]:
+    keys = set()
+    if day is not None:
+      if day["outage"]: keys.add(("full_outage", ()))
+      if day["null_fields"]: keys.add(("null_spike", day["null_fields"]))
+      if day["duplicated"]: keys.add(("duplication", ()))
+    for key in list(open_runs):
+      if key not in keys:
+        start, end = open_runs.pop(key)
+        incidents.append({"kind": key[0], "columns": list(key[1]), "start": start, "end": end})
+    for key in keys:
+      start, _ = open_runs.get(key, (day["date"], None))
+      open_runs[key] = (start, day["date"])
+  incidents.sort(key=lambda incident: (incident["start"], incident["kind"]))
+  return incidents
+
+def uuid4_strings(rng, n):
+  """Draw `n` random version-4 UUIDs as canonical 36-character strings."""
+  raw = np.frombuffer(rng.bytes(16 * n), dtype=np.uint8).reshape(n, 16).copy()
+  raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+  raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+  digits = np.frombuffer(b"0123456789abcdef", dtype="S1")
+  hexed = np.empty((n, 32), dtype="S1")
+  hexed[:, 0::2] = digits[raw >> 4]
+  hexed[:, 1::2] = digits[raw & 0x0F]
+  dash = np.full((n, 1), b"-", dtype="S1")
+  parts = [hexed[:, 0:8], dash, hexed[:, 8:12], dash, hexed[:, 12:16], dash, hexed[:, 16:20], dash, hexed[:, 20:32]]
+  joined = np.ascontiguousarray(np.hstack(parts)).view("S36").ravel()
+  return joined.astype("U36").astype(object)
+
+def _draw_field(rng, field, n):
+  if field == "distance": return np.abs(rng.normal(50, 50, n))
+  if field == "g": return np.abs(rng.normal(1, 5, n))
+  if field == "orbital_period": return np.abs(rng.normal(500, 300, n))
+  if field == "avg_temp": return np.abs(rng.normal(273, 50, n))
+  if field == "eccentricity": return rng.random(n)
+  if field == "atmosphere": return np.array(ATMOSPHERES, dtype=object)[rng.integers(0, len(ATMOSPHERES), n)]
+  raise ValueError("Unknown field: {}".format(field))
+
+def generate_block(
+  rng,
+  days,
+  fields=EX1_FIELDS,
+  null_probs=NULL_PROBS,
+  null_spike_severity=NULL_SPIKE_SEVERITY,
+  duplicate_fraction=DUPLICATE_FRACTION,
+  rows_per_day=ROWS_PER_DAY,
+):
+  """Generate the rows for a list of (non-outage) schedule days in one draw.
+
+  Columns are `_id`, then `fields` in order, then `date_added`.
+  """
+  counts = rng.integers(rows_per_day[0], rows_per_day[1] + 1, size=len(days))
+  day_idx = np.repeat(np.arange(len(days)), counts)
+  n = int(counts.sum())
+
+  block = {"_id": uuid4_strings(rng, n)}
+  for field in fields:
+    values = _draw_field(rng, field, n)
+    null = rng.random(n) < null_probs[field]
+    spiked = np.array([field in day["null_fields"] for day in days], dtype=bool)[day_idx]
+    null |= spiked & (rng.random(n) <= null_spike_severity)
+    values[null] = None if values.dtype == object else np.nan
+    block[field] = values
+  dates = np.array([day["date"].strftime("%Y-%m-%d") for day in days], dtype=object)
+  block["date_added"] = dates[day_idx]
+  df = pd.DataFrame(block, columns=["_id"] + list(fields) + ["date_added"])
+
+  duplicated = np.array([day["duplicated"] for day in days], dtype=bool)[day_idx]
+  if duplicated.any():
+    dupes = np.flatnonzero(duplicated & (rng.random(n) < duplicate_fraction))
+    order = np.argsort(np.concatenate([np.arange(n), dupes]), kind="stable")
+    df = pd.concat([df, df.iloc[dupes]]).iloc[order]
+  return df.reset_index(drop=True)
+
+def generate_days(rng, schedule, chunk_days=CHUNK_DAYS, **kwargs):
+  """Yield DataFrames of generated rows, `chunk_days` days with data at a time."""
+  days = [day for day in schedule if not day["outage"]]
+  for i in range(0, len(days), chunk_days):
+    with span("generate_block", "generate", days=len(days[i:i + chunk_days])) as traced:
+      block = generate_block(rng, days[i:i + chunk_days], **kwargs)
+      traced.set(rows=len(block))
+    yield block
+
+def generate_table(rng, schedule, **kwargs):
+  """Generate every row for a schedule as a single DataFrame."""
+  chunks = list(generate_days(rng, schedule, **kwargs))
+  if not chunks:
+    fields = kwargs.get("fields", EX1_FIELDS)
+    return pd.DataFrame(columns=["_id"] + list(fields) + ["date_added"])
+  return pd.concat(chunks, ignore_index=True)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Create a "fleet" of independent EXOPLANETS-style tables for scale tests.
+
+Table i is generated from its own seed (SEED, i), with its own outage, null
+spike and duplication processes, and lives in shard i % NUM_SHARDS. Each shard
+is one SQLite file written by one worker, so the output only depends on the
+seed and shard count -- never on how many workers ran.
+
+  $ python helpers/make_fleet.py --tables 1000 --shards 16 --workers 8 --out fleet/
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from generate import EX2_FIELDS, SEED, draw_schedule, gauss_outage_length, generate_days, make_rng, schedule_incidents
+from sink import EXOPLANETS_SCHEMA, create_table, write_incidents, write_table
+
+NUM_TABLES = 100
+NUM_SHARDS = 8
+NUM_DAYS = 500
+START_DATE = datetime(2020, 1, 1)
+
+PROB_FULL_OUTAGE = 0.03
+PROB_NULL_SPIKE = 0.03
+PROB_DUPLICATION = 0.05
+NULL_SPIKE_SEVERITY = 0.95
+
+FLEET_SCHEMA = [
+  ("table_name", "VARCHAR(16777216) NOT NULL"),
+  ("table_index", "INTEGER NOT NULL"),
+  ("seed", "VARCHAR(16777216) NOT NULL"),
+  ("num_rows", "INTEGER NOT NULL"),
+]
+
+def table_name(i):
+  return "EXOPLANETS_{:05d}".format(i)
+
+def shard_path(out, shard):
+  return os.path.join(out, "fleet_{:04d}.db".format(shard))
+
+def make_table(conn, i, seed=SEED, num_days=NUM_DAYS, rows_per_day=(80, 120)):
+  rng = make_rng(seed, stream=i)
+  schedule = draw_schedule(
+    rng, num_days, START_DATE,
+    fields=EX2_FIELDS,
+    prob_full_outage=PROB_FULL_OUTAGE,
+    prob_null_spike=PROB_NULL_SPIKE,
+    prob_duplication=PROB_DUPLICATION,
+    outage_length=gauss_outage_length,
+  )
+  chunks = generate_days(
+    rng, schedule,
+    fields=EX2_FIELDS,
+    null_spike_severity=NULL_SPIKE_SEVERITY,
+    rows_per_day=rows_per_day,
+  )
+  stats = write_table(conn, table_name(i), EXOPLANETS_SCHEMA, chunks, verbose=False)
+  write_incidents(conn, table_name(i), schedule_incidents(schedule))
+  return stats
+
+def make_shard(out, shard, num_tables, num_shards, seed=SEED, **kwargs):
+  """Write every table assigned to `shard` into its own database file."""
+  start = time.perf_counter()
+  conn = sqlite3.connect(shard_path(out, shard))
+  create_table(conn, "FLEET_TABLES", FLEET_SCHEMA)
+  rows = 0
+  for i in range(shard, num_tables, num_shards):
+    stats = make_table(conn, i, seed=seed, **kwargs)
+    with conn:
+      conn.execute(
+        "INSERT INTO FLEET_TABLES VALUES (?, ?, ?, ?)",
+        (table_name(i), i, str(seed), stats["rows"])
+      )
+    rows += stats["rows"]
+  conn.close()
+  return {"shard": shard, "rows": rows, "seconds": time.perf_counter() - start}
+
+def make_fleet(out, num_tables=NUM_TABLES, num_shards=NUM_SHARDS, workers=None, seed=SEED, **kwargs):
+  os.makedirs(out, exist_ok=True)
+  start = time.perf_counter()
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    futures = [
+      pool.submit(make_shard, out, shard, num_tables, num_shards, seed=seed, **kwargs)
+      for shard in range(min(num_shards, num_tables))
+    ]
+    results = [future.result() for future in futures]
+  seconds = time.perf_counter() - start
+  rows = sum(result["rows"] for result in results)
+  print("wrote {} tables ({} rows) across {} shards in {:.2f}s ({:,.0f} rows/s)".format(
+    num_tables, rows, len(results), seconds, rows / seconds if seconds else 0.0
+  ))
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(description="Create a fleet of independent EXOPLANETS tables.")
+  parser.add_argument("--tables", type=int, default=NUM_TABLES)
+  parser.add_argument("--shards", type=int, default=NUM_SHARDS)
+  parser.add_argument("--workers", type=int, default=None)
+  parser.add_argument("--days", type=int, default=NUM_DAYS)
+  parser.add_argument("--seed", default=SEED)
+  parser.add_argument("--out", default="fleet")
+  args = parser.parse_args()
+  make_fleet(args.out, args.tables, args.shards, args.workers, seed=args.seed, num_days=args.days)
+
+if __name__ == "__main__":
+  main()
@@ -8,21 +8,34 @@ __email__ = "rkearns@montecarlodata.com"
 """Create snapshots of a dataset for course participants to analyze.
 """
 
+import os
 import pandas as pd
 import random
 import sqlite3
-import uuid
-from datetime import datetime, timedelta
-from tqdm import tqdm
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.schema_history import clear_history, record_schema
+from data.trace import span
 
 random.seed("data downtime")
 
+EX1_SCHEMA = [
+  ("_id", "TEXT"),
+  ("distance", "REAL"),
+  ("g", "REAL"),
+  ("orbital_period", "REAL"),
+  ("avg_temp", "REAL"),
+  ("date_added", "TEXT")
+]
+EX2_SCHEMA = EX1_SCHEMA + [("eccentricity", "REAL"), ("atmosphere", "TEXT")]
+
 def main():
   # load in data from Ex1.db to append
   conn = sqlite3.connect('Ex2.db')
   c = conn.cursor()
   ex1_df = pd.read_sql(
-    "SELECT * FROM EXOPLANETS",
+    "SELECT DISTINCT date_added FROM EXOPLANETS ORDER BY date_added",
     conn
   )
   schema_table = pd.DataFrame()
@@ -59,7 +72,13 @@ def main():
   """)
 
   conn.commit()
-  schema_table.to_sql("EXOPLANETS_SCHEMA", conn, if_exists='replace', index = False)
+  with span("to_sql", "write", conn, table="EXOPLANETS_SCHEMA", rows=len(schema_table)):
+    schema_table.to_sql("EXOPLANETS_SCHEMA", conn, if_exists='replace', index = False)
+
+  # the change-only history only needs the first schema and the 2020-07-19 change
+  clear_history(conn, "EXOPLANETS")
+  record_schema(conn, "EXOPLANETS", schema_table["date"].iloc[0], EX1_SCHEMA)
+  record_schema(conn, "EXOPLANETS", "2020-07-19", EX2_SCHEMA)
 
   c.execute("SELECT * FROM EXOPLANETS_SCHEMA")
   for row in c.fetchall():
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Incremental, resumable build of the Ex1 -> Ex2 -> Ex3 snapshot chain.
+
+Instead of each make_exN script reloading and rewriting the previous snapshot,
+every stage appends only its own date range to one pipeline database. Ex2's new
+columns are added with ALTER TABLE, and HABITABLES is backfilled for the Ex1
+days once. Each chunk of days is written in the same transaction as the
+stage's checkpoint (last date written and the state of the RNG that both the
+generator and the HABITABLES transform draw from), so an interrupted run picks
+up where it stopped and rederives the same rows. Ex1.db/Ex2.db/Ex3.db are
+exported as "as of" cuts of the pipeline tables, again appending only the rows
+past each export's watermark. make_ex1.py, make_ex2.py and make_ex3.py are
+`build` calls for their snapshot, so every path to a snapshot draws the same
+rows for the same seed.
+
+  $ python helpers/pipeline.py --db pipeline.db --export .
+"""
+
+import argparse
+import json
+import os
+import pandas as pd
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from generate import CHUNK_DAYS, EX1_FIELDS, EX2_FIELDS, SEED, draw_schedule, generate_days, make_rng, schedule_incidents
+from sink import (
+  EXOPLANETS_EX1_SCHEMA,
+  EXOPLANETS_SCHEMA,
+  HABITABLES_SCHEMA,
+  INCIDENTS_SCHEMA,
+  append_rows,
+  create_indexes,
+  create_table,
+  read_incidents,
+  write_incidents,
+)
+from transform import HABITABLES, HABITABLES_WITH_DUPLICATES, write_lineage
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.monitors import has_table
+
+PROB_FULL_OUTAGE = 0.03
+PROB_NULL_SPIKE = 0.03
+NULL_SPIKE_SEVERITY = 0.95
+# stage n draws from RNG streams 10n (schedule), 10n + 1 (rows) and 10n + 2
+# (backfill), clear of the streams the other make_ex*.py scripts use
+STAGE_STREAMS = 10
+SCHEDULE_STREAM = 0
+ROWS_STREAM = 1
+BACKFILL_STREAM = 2
+
+STAGES = [
+  {
+    "name": "ex1",
+    "stream": 1,
+    "start": datetime(2020, 1, 1),
+    "days": 200,
+    "fields": EX1_FIELDS,
+    "targets": [("EXOPLANETS", EXOPLANETS_EX1_SCHEMA, None)],
+  },
+  {
+    "name": "ex2",
+    "stream": 2,
+    "start": datetime(2020, 7, 19),
+    "days": 50,
+    "fields": EX2_FIELDS,
+    "targets": [("EXOPLANETS", EXOPLANETS_SCHEMA, None), ("HABITABLES", HABITABLES_SCHEMA, HABITABLES)],
+    # HABITABLES also gets a row for every EXOPLANETS row from before this stage
+    "backfill": ("EXOPLANETS", "HABITABLES", HABITABLES),
+  },
+  {
+    "name": "ex3",
+    "stream": 3,
+    "start": datetime(2020, 9, 7),
+    "days": 100,
+    "fields": EX2_FIELDS,
+    "targets": [("HABITABLES", HABITABLES_SCHEMA, HABITABLES_WITH_DUPLICATES)],
+    "incident": {"table": "HABITABLES", "kind": "duplication", "columns": ["_id"]},
+  },
+]
+
+# which tables (and columns) each exported snapshot holds, and as of which stage
+SNAPSHOTS = {
+  "Ex1.db": [("EXOPLANETS", EXOPLANETS_EX1_SCHEMA, "ex1")],
+  "Ex2.db": [("EXOPLANETS", EXOPLANETS_SCHEMA, "ex2"), ("HABITABLES", HABITABLES_SCHEMA, "ex2")],
+  "Ex3.db": [("EXOPLANETS", EXOPLANETS_SCHEMA, "ex2"), ("HABITABLES", HABITABLES_SCHEMA, "ex3")],
+}
+
+CHECKPOINTS_SCHEMA = [
+  ("STAGE", "VARCHAR(16777216) NOT NULL PRIMARY KEY"),
+  ("LAST_DATE", "TIMESTAMP_NTZ(6) NOT NULL"),
+  ("RNG_STATE", "VARCHAR(16777216)"),
+  ("ROWS", "INTEGER NOT NULL"),
+  ("DONE", "INTEGER NOT NULL"),
+]
+
+def _date(value):
+  return value.strftime("%Y-%m-%d")
+
+def stage_end(name):
+  stage = dict((stage["name"], stage) for stage in STAGES)[name]
+  return _date(stage["start"] + timedelta(days=stage["days"] - 1))
+
+def stage_rng(stage, offset, seed=SEED):
+  return make_rng(seed, stream=STAGE_STREAMS * stage["stream"] + offset)
+
+def ensure_table(conn, table, schema):
+  """Create `table`, or add the columns of `schema` it doesn't have yet."""
+  if not has_table(conn, table):
+    create_table(conn, table, schema, replace=False)
+    create_indexes(conn, table, ["date_added"])
+    return
+  existing = set(row[1].lower() for row in conn.execute("PRAGMA table_info({})".format(table)))
+  for column, dtype in schema:
+    if column.lower() not in existing:
+      conn.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, column, dtype.replace(" NOT NULL", "")))
+  conn.commit()
+
+def get_checkpoint(conn, stage):
+  if not has_table(conn, "PIPELINE_CHECKPOINTS"):
+    create_table(conn, "PIPELINE_CHECKPOINTS", CHECKPOINTS_SCHEMA, replace=False)
+  row = conn.execute(
+    "SELECT LAST_DATE, RNG_STATE, ROWS, DONE FROM PIPELINE_CHECKPOINTS WHERE STAGE = ?", (stage,)
+  ).fetchone()
+  if row is None: return {"last_date": "", "rng_state": None, "rows": 0, "done": False}
+  return {"last_date": row[0], "rng_state": row[1] and json.loads(row[1]), "rows": row[2], "done": bool(row[3])}
+
+def _save_checkpoint(conn, stage, last_date, rng, rows, done=False):
+  conn.execute("INSERT OR REPLACE INTO PIPELINE_CHECKPOINTS VALUES (?, ?, ?, ?, ?)", (
+    stage, last_date, json.dumps(rng.bit_generator.state) if rng is not None else None, rows, int(done)
+  ))
+
+def _record_incidents(conn, stage, schedule):
+  """Replace the stage's share of the INCIDENTS ledger; rerunning a stage is idempotent."""
+  start, end = _date(stage["start"]), stage_end(stage["name"])
+  for table, _, derive in stage["targets"]:
+    if "backfill" in stage and stage["backfill"][1] == table:
+      # backfilled rows inherit their upstream's outages
+      kept = read_incidents(conn, stage["backfill"][0])
+      kept = [incident for incident in kept if incident["end"] < start and incident["kind"] == "full_outage"]
+    else:
+      kept = [incident for incident in read_incidents(conn, table) if incident["end"] < start]
+    new = schedule_incidents(schedule)
+    # derived tables only see the upstream outages
+    if derive is not None: new = [incident for incident in new if incident["kind"] == "full_outage"]
+    if stage.get("incident", {}).get("table") == table:
+      new.append({"kind": stage["incident"]["kind"], "columns": stage["incident"]["columns"], "start": start, "end": end})
+    write_incidents(conn, table, kept + new)
+
+def _backfill(conn, stage, seed=SEED, verbose=True):
+  source, target, derive = stage["backfill"]
+  name = stage["name"] + ":backfill"
+  checkpoint = get_checkpoint(conn, name)
+  if checkpoint["done"]: return
+  columns = [column for column, _ in HABITABLES_SCHEMA]
+  rng = stage_rng(stage, BACKFILL_STREAM, seed)
+  if checkpoint["rng_state"] is not None: rng.bit_generator.state = checkpoint["rng_state"]
+  dates = [row[0] for row in conn.execute(
+    "SELECT DISTINCT DATE_ADDED FROM {} WHERE DATE_ADDED > ? AND DATE_ADDED < ? ORDER BY DATE_ADDED".format(source),
+    (checkpoint["last_date"], _date(stage["start"]))
+  )]
+  rows = checkpoint["rows"]
+  for i in range(0, len(dates), CHUNK_DAYS):
+    block = dates[i:i + CHUNK_DAYS]
+    chunk = _read(conn, source, block[0], block[-1])
+    with conn:
+      rows += append_rows(conn, target, derive.apply(chunk, rng), columns)
+      _save_checkpoint(conn, name, block[-1], rng, rows)
+  with conn:
+    _save_checkpoint(conn, name, dates[-1] if dates else checkpoint["last_date"], rng, rows, done=True)
+  if verbose: print("{}: backfilled {} rows of {}".format(name, rows, target))
+
+def _read(conn, table, start, end):
+  df = pd.read_sql_query(
+    "SELECT * FROM {} WHERE DATE_ADDED >= ? AND DATE_ADDED <= ? ORDER BY DATE_ADDED".format(table),
+    conn, params=(start, end)
+  )
+  return df.rename(columns={clmn: clmn.lower() for clmn in df.columns})
+
+def run_stage(conn, stage, seed=SEED, verbose=True):
+  """Append `stage`'s date range, resuming from its checkpoint. Returns rows written."""
+  checkpoint = get_checkpoint(conn, stage["name"])
+  if checkpoint["done"]:
+    if verbose: print("{}: already done".format(stage["name"]))
+    return 0
+  # the schedule is redrawn identically on every run; only the row generator is checkpointed
+  schedule = draw_schedule(
+    stage_rng(stage, SCHEDULE_STREAM, seed), stage["days"], stage["start"],
+    fields=EX1_FIELDS,
+    prob_full_outage=PROB_FULL_OUTAGE,
+    prob_null_spike=PROB_NULL_SPIKE,
+  )
+  rng = stage_rng(stage, ROWS_STREAM, seed)
+  if checkpoint["rng_state"] is not None: rng.bit_generator.state = checkpoint["rng_state"]
+
+  for table, schema, derive in stage["targets"]:
+    ensure_table(conn, table, schema)
+    if derive is not None: write_lineage(conn, derive, "EXOPLANETS", table)
+  _record_incidents(conn, stage, schedule)
+  if "backfill" in stage: _backfill(conn, stage, seed, verbose)
+
+  remaining = [day for day in schedule if _date(day["date"]) > checkpoint["last_date"]]
+  rows = checkpoint["rows"]
+  for i in range(0, len(remaining), CHUNK_DAYS):
+    block = remaining[i:i + CHUNK_DAYS]
+    chunks = generate_days(
+      rng, block, chunk_days=len(block), fields=stage["fields"], null_spike_severity=NULL_SPIKE_SEVERITY
+    )
+    with conn:
+      for chunk in chunks:
+        for table, schema, derive in stage["targets"]:
+          rows += append_rows(conn, table, chunk if derive is None else derive.apply(chunk, rng), [column for column, _ in schema])
+      _save_checkpoint(conn, stage["name"], _date(block[-1]["date"]), rng, rows)
+  with conn:
+    _save_checkpoint(conn, stage["name"], stage_end(stage["name"]), rng, rows, done=True)
+  if verbose: print("{}: {} rows through {}".format(stage["name"], rows, stage_end(stage["name"])))
+  return rows
+
+def as_of(conn, table, date, columns=None):
+  """`table` as it stood at the end of `date`; cheap because DATE_ADDED is indexed."""
+  df = pd.read_sql_query(
+    "SELECT {} FROM {} WHERE DATE_ADDED <= ?".format(", ".join(columns) if columns else "*", table),
+    conn, params=(date,)
+  )
+  return df.rename(columns={clmn: clmn.lower() for clmn in df.columns})
+
+def create_as_of_view(conn, table, date, columns=None, name=None):
+  """A temporary view of `table` as of `date`, e.g. EXOPLANETS_AS_OF_20200915."""
+  date = _date(datetime.strptime(date, "%Y-%m-%d"))  # views can't bind parameters
+  if name is None: name = "{}_AS_OF_{}".format(table, date.replace("-", ""))
+  conn.execute("DROP VIEW IF EXISTS temp.{}".format(name))
+  conn.execute("CREATE TEMP VIEW {} AS SELECT {} FROM {} WHERE DATE_ADDED <= '{}'".format(
+    name, ", ".join(columns) if columns else "*", table, date
+  ))
+  return name
+
+def export_snapshot(conn, path, tables):
+  """Bring the snapshot database at `path` up to date with the pipeline.
+
+  `tables` is a list of (table, schema, stage); each table is cut as of the end
+  of its stage, and only rows past the snapshot's own watermark are copied.
+  Incidents that run past the cut are clipped to it. A snapshot without
+  watermarks wasn't written by the pipeline, so its tables are rebuilt.
+  """
+  snapshot = sqlite3.connect(path)
+  if not has_table(snapshot, "SNAPSHOT_WATERMARKS"):
+    for table, _, _ in tables: snapshot.execute("DROP TABLE IF EXISTS {}".format(table))
+    snapshot.execute("DROP TABLE IF EXISTS INCIDENTS")
+    snapshot.execute("CREATE TABLE SNAPSHOT_WATERMARKS(TABLE_NAME VARCHAR(16777216) PRIMARY KEY, DATE_ADDED TIMESTAMP_NTZ(6))")
+  for table, schema, _ in tables:
+    ensure_table(snapshot, table, schema)
+  if not has_table(snapshot, "INCIDENTS"): create_table(snapshot, "INCIDENTS", INCIDENTS_SCHEMA, replace=False)
+  snapshot.commit()
+  snapshot.close()
+
+  conn.execute("ATTACH DATABASE ? AS SNAPSHOT", (path,))
+  try:
+    with conn:
+      for table, schema, stage in tables:
+        columns = ", ".join(column for column, _ in schema)
+        row = conn.execute("SELECT DATE_ADDED FROM SNAPSHOT.SNAPSHOT_WATERMARKS WHERE TABLE_NAME = ?", (table,)).fetchone()
+        watermark, end = row[0] if row else "", stage_end(stage)
+        conn.execute(
+          "INSERT INTO SNAPSHOT.{0} ({1}) SELECT {1} FROM main.{0} WHERE DATE_ADDED > ? AND DATE_ADDED <= ?".format(table, columns),
+          (watermark, end)
+        )
+        conn.execute("INSERT OR REPLACE INTO SNAPSHOT.SNAPSHOT_WATERMARKS VALUES (?, ?)", (table, max(watermark, end)))
+        conn.execute("DELETE FROM SNAPSHOT.INCIDENTS WHERE TABLE_NAME = ?", (table,))
+        # incidents still open at the cut end with it
+        conn.execute("""
+          INSERT INTO SNAPSHOT.INCIDENTS
+          SELECT TABLE_NAME, KIND, COLUMNS, START_DATE, MIN(END_DATE, ?)
+          FROM main.INCIDENTS
+          WHERE TABLE_NAME = ? AND START_DATE <= ?
+          """, (end, table, end))
+  finally:
+    conn.execute("DETACH DATABASE SNAPSHOT")
+
+def build(name, db="pipeline.db", directory=".", seed=SEED, verbose=True):
+  """Run the stages snapshot `name` (e.g. "Ex2.db") needs, then export it into `directory`."""
+  tables = SNAPSHOTS[name]
+  needed = set(stage for _, _, stage in tables)
+  last = max(i for i, stage in enumerate(STAGES) if stage["name"] in needed)
+  conn = sqlite3.connect(db)
+  for stage in STAGES[:last + 1]: run_stage(conn, stage, seed, verbose)
+  path = os.path.join(directory, name)
+  export_snapshot(conn, path, tables)
+  conn.close()
+  if verbose: print("exported {}".format(path))
+  return path
+
+def main():
+  parser = argparse.ArgumentParser(description="Build the Ex1 -> Ex2 -> Ex3 snapshots incrementally.")
+  parser.add_argument("--db", default="pipeline.db")
+  parser.add_argument("--stages", nargs="*", default=[stage["name"] for stage in STAGES])
+  parser.add_argument("--export", help="directory to write Ex1.db/Ex2.db/Ex3.db into")
+  parser.add_argument("--seed", default=SEED)
+  args = parser.parse_args()
+  conn = sqlite3.connect(args.db)
+  for stage in STAGES:
+    if stage["name"] in args.stages: run_stage(conn, stage, args.seed)
+  if args.export:
+    done = set(stage["name"] for stage in STAGES if get_checkpoint(conn, stage["name"])["done"])
+    for name, tables in SNAPSHOTS.items():
+      if all(stage in done for _, _, stage in tables):
+        export_snapshot(conn, os.path.join(args.export, name), tables)
+        print("exported {}".format(name))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Streaming, batched SQLite writer for the generated tables.
+
+Chunks of rows (usually a few days at a time from `generate.generate_days`)
+are written with `executemany` in one transaction per chunk, so memory stays
+flat and everything written so far is durable. Indexes are built after the
+load, and tables keep their declared types instead of the ones `to_sql` picks.
+"""
+
+import json
+import os
+import pandas as pd
+import sys
+import time
+from contextlib import contextmanager
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.trace import span
+
+BATCH_SIZE = 10000
+JOURNAL_MODE = "MEMORY"
+SYNCHRONOUS = "OFF"
+
+EXOPLANETS_EX1_SCHEMA = [
+  ("_id", "VARCHAR(16777216) NOT NULL"),
+  ("distance", "FLOAT"),
+  ("g", "FLOAT"),
+  ("orbital_period", "FLOAT"),
+  ("avg_temp", "FLOAT"),
+  ("date_added", "TIMESTAMP_NTZ(6) NOT NULL"),
+]
+
+EXOPLANETS_SCHEMA = EXOPLANETS_EX1_SCHEMA + [
+  ("eccentricity", "FLOAT"),
+  ("atmosphere", "VARCHAR(16777216)"),
+]
+
+# Ex4 was generated fresh, with the Ex2 fields ahead of date_added
+EXOPLANETS_EX4_SCHEMA = EXOPLANETS_EX1_SCHEMA[:-1] + EXOPLANETS_SCHEMA[-2:] + EXOPLANETS_EX1_SCHEMA[-1:]
+
+HABITABLES_SCHEMA = [
+  ("_id", "VARCHAR(16777216) NOT NULL"),
+  ("perihelion", "FLOAT"),
+  ("aphelion", "FLOAT"),
+  ("atmosphere", "VARCHAR(16777216)"),
+  ("habitability", "FLOAT NOT NULL"),
+  ("min_temp", "FLOAT"),
+  ("max_temp", "FLOAT"),
+  ("date_added", "TIMESTAMP_NTZ(6) NOT NULL"),
+]
+
+INCIDENTS_SCHEMA = [
+  ("TABLE_NAME", "VARCHAR(16777216) NOT NULL"),
+  ("KIND", "VARCHAR(16777216) NOT NULL"),
+  ("COLUMNS", "VARCHAR(16777216) NOT NULL"),
+  ("START_DATE", "TIMESTAMP_NTZ(6) NOT NULL"),
+  ("END_DATE", "TIMESTAMP_NTZ(6) NOT NULL"),
+]
+
+@contextmanager
+def bulk_load(conn, journal_mode=JOURNAL_MODE, synchronous=SYNCHRONOUS):
+  """Relax durability pragmas for the duration of a bulk load, then restore them."""
+  old_journal = conn.execute("PRAGMA journal_mode").fetchone()[0]
+  old_synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+  conn.execute("PRAGMA journal_mode = {}".format(journal_mode))
+  conn.execute("PRAGMA synchronous = {}".format(synchronous))
+  try:
+    yield conn
+  finally:
+    conn.execute("PRAGMA journal_mode = {}".format(old_journal))
+    conn.execute("PRAGMA synchronous = {}".format(old_synchronous))
+
+def create_table(conn, table, schema, replace=True):
+  """Create `table` with the declared `schema`, a list of (column, type) pairs."""
+  if replace: conn.execute("DROP TABLE IF EXISTS {}".format(table))
+  conn.execute("CREATE TABLE {}(\n  {}\n)".format(
+    table,
+    ",\n  ".join("{} {}".format(column, dtype) for column, dtype in schema)
+  ))
+  conn.commit()
+
+def create_indexes(conn, table, columns):
+  """Build one index per column. Run after loading, not before."""
+  for column in columns:
+    sql = "CREATE INDEX IF NOT EXISTS IDX_{0}_{1} ON {0}({1})".format(table, column)
+    with span("create_index", "write", conn, table=table, column=column):
+      conn.execute(sql)
+  conn.commit()
+
+def _rows(df, columns, batch_size):
+  values = df[columns].astype(object)
+  values = values.where(values.notna(), None)
+  for i in range(0, len(values), batch_size):
+    yield list(values.iloc[i:i + batch_size].itertuples(index=False, name=None))
+
+def _insert_sql(table, columns):
+  return "INSERT INTO {} ({}) VALUES ({})".format(
+    table, ", ".join(columns), ", ".join("?" for _ in columns)
+  )
+
+def _report(table, rows, start, verbose=True):
+  seconds = time.perf_counter() - start
+  stats = {"table": table, "rows": rows, "seconds": seconds, "rows_per_s": rows / seconds if seconds else 0.0}
+  if verbose: print("wrote {rows} rows to {table} in {seconds:.2f}s ({rows_per_s:,.0f} rows/s)".format(**stats))
+  return stats
+
+def append_rows(conn, table, df, columns, batch_size=BATCH_SIZE):
+  """Insert `df[columns]` into an existing table inside the caller's transaction."""
+  sql, rows = _insert_sql(table, columns), 0
+  for batch in _rows(df, columns, batch_size):
+    conn.executemany(sql, batch)
+    rows += len(batch)
+  return rows
+
+def write_chunks(conn, table, chunks, columns, batch_size=BATCH_SIZE, indexes=(), verbose=True):
+  """Append each DataFrame in `chunks` to `table`, one transaction per chunk.
+
+  Returns a dict with the number of `rows` written, the elapsed `seconds`, and
+  the throughput in `rows_per_s`.
+  """
+  sql = _insert_sql(table, columns)
+  rows, start = 0, time.perf_counter()
+  for chunk in chunks:
+    with span("write_chunk", "write", conn, table=table, rows=len(chunk)), conn:
+      for batch in _rows(chunk, columns, batch_size):
+        conn.executemany(sql, batch)
+        rows += len(batch)
+  create_indexes(conn, table, indexes)
+  return _report(table, rows, start, verbose)
+
+def write_tables(conn, targets, chunks, batch_size=BATCH_SIZE, indexes=("date_added",), verbose=True):
+  """Recreate several tables and fill them from one stream of chunks.
+
+  `targets` is a list of (table, schema, derive) triples, where `derive` maps a
+  chunk to that table's rows (None writes the chunk as is). Every table gets
+  its rows for a chunk in the same transaction. Returns a list of stats dicts.
+  """
+  statements = []
+  with bulk_load(conn):
+    for table, schema, derive in targets:
+      create_table(conn, table, schema)
+      columns = [column for column, _ in schema]
+      statements.append((table, columns, derive, _insert_sql(table, columns)))
+
+    rows, start = dict((table, 0) for table, _, _ in targets), time.perf_counter()
+    for chunk in chunks:
+      with conn:
+        for table, columns, derive, sql in statements:
+          with span("write_chunk", "write", conn, table=table) as traced:
+            written = 0
+            for batch in _rows(chunk if derive is None else derive(chunk), columns, batch_size):
+              conn.executemany(sql, batch)
+              written += len(batch)
+            traced.set(rows=written)
+          rows[table] += written
+    for table, _, _ in targets: create_indexes(conn, table, indexes)
+  return [_report(table, rows[table], start, verbose) for table, _, _ in targets]
+
+def write_table(conn, table, schema, chunks, **kwargs):
+  """Recreate `table` with its declared schema and stream `chunks` into it."""
+  return write_tables(conn, [(table, schema, None)], chunks, **kwargs)[0]
+
+def _date(value):
+  return value if isinstance(value, str) else value.strftime("%Y-%m-%d")
+
+def write_incidents(conn, table, incidents):
+  """Replace `table`'s rows in the INCIDENTS ledger with `incidents`, as returned
+  by `generate.schedule_incidents` (dates inclusive, columns as a JSON list).
+  """
+  if not conn.execute("SELECT 1 FROM SQLITE_MASTER WHERE TYPE = 'table' AND NAME = 'INCIDENTS'").fetchone():
+    create_table(conn, "INCIDENTS", INCIDENTS_SCHEMA, replace=False)
+  with conn:
+    conn.execute("DELETE FROM INCIDENTS WHERE TABLE_NAME = ?", (table,))
+    conn.executemany("INSERT INTO INCIDENTS VALUES (?, ?, ?, ?, ?)", [
+      (table, incident["kind"], json.dumps(incident["columns"]), _date(incident["start"]), _date(incident["end"]))
+      for incident in incidents
+    ])
+
+def read_incidents(conn, table):
+  """`table`'s incidents from the INCIDENTS ledger, in the `write_incidents` format."""
+  if not conn.execute("SELECT 1 FROM SQLITE_MASTER WHERE TYPE = 'table' AND NAME = 'INCIDENTS'").fetchone():
+    return []
+  return [
+    {"kind": kind, "columns": json.loads(columns), "start": start, "end": end}
+    for kind, columns, start, end in conn.execute(
+      "SELECT KIND, COLUMNS, START_DATE, END_DATE FROM INCIDENTS WHERE TABLE_NAME = ? ORDER BY START_DATE, KIND",
+      (table,)
+    )
+  ]
+
+def read_chunks(conn, sql, chunksize=BATCH_SIZE):
+  """Stream the result of `sql` back as DataFrames of at most `chunksize` rows."""
+  return pd.read_sql(sql, conn, chunksize=chunksize)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""Column-at-a-time transforms for deriving downstream tables.
+
+A `Transform` is a list of `Column`s, each computing one output array from
+named inputs (upstream columns, or outputs of earlier columns) for a whole
+chunk at once, plus optional row rules (like duplicate injection) applied to
+the finished chunk. Because every column declares its inputs, the transform
+also knows its upstream -> downstream column lineage, which `write_lineage`
+stores in a COLUMN_LINEAGE table next to the data.
+
+`HABITABLES` is the derivation the exercises use: perihelion/aphelion from
+eccentricity x orbital_period, min_temp/max_temp with the 0 / 999999 sentinels,
+and habitability zeroed wherever a sentinel fired. `HABITABLES_WITH_DUPLICATES`
+adds Ex3's second row for every zero-habitability planet.
+"""
+
+import numpy as np
+import pandas as pd
+
+SENTINEL_PROB = 0.85
+MIN_TEMP_SENTINEL = 0
+MAX_TEMP_SENTINEL = 999999
+ORBIT_SCALE = 0.2
+
+LINEAGE_SCHEMA = [
+  ("TRANSFORM", "VARCHAR(16777216) NOT NULL"),
+  ("UPSTREAM_TABLE", "VARCHAR(16777216) NOT NULL"),
+  ("UPSTREAM_COLUMN", "VARCHAR(16777216) NOT NULL"),
+  ("DOWNSTREAM_TABLE", "VARCHAR(16777216) NOT NULL"),
+  ("DOWNSTREAM_COLUMN", "VARCHAR(16777216) NOT NULL"),
+]
+
+class Column:
+  """Output `name` computed by `fn(values, rng, n)` from the `inputs` it reads."""
+
+  def __init__(self, name, inputs, fn):
+    self.name = name
+    self.inputs = list(inputs)
+    self.fn = fn
+
+class Transform:
+  def __init__(self, name, columns, output=None, row_rules=()):
+    self.name = name
+    self.columns = list(columns)
+    self.output = list(output) if output else [column.name for column in self.columns]
+    self.row_rules = list(row_rules)
+
+  def lineage(self):
+    """{output column: sorted upstream columns it depends on}."""
+    resolved = {}
+    for column in self.columns:
+      sources = set()
+      for name in column.inputs:
+        sources |= resolved.get(name, {name}) if name != column.name else {name}
+      resolved[column.name] = sources
+    return dict((name, sorted(resolved[name])) for name in self.output)
+
+  def apply(self, chunk, rng):
+    """Derive the downstream rows for one upstream chunk."""
+    n = len(chunk)
+    values = dict((column, chunk[column].to_numpy()) for column in chunk.columns)
+    for column in self.columns:
+      values[column.name] = column.fn(values, rng, n)
+    df = pd.DataFrame(dict((name, values[name]) for name in self.output))
+    for rule in self.row_rules:
+      df = rule(df, values, rng)
+    return df
+
+  def stream(self, chunks, rng):
+    for chunk in chunks:
+      yield self.apply(chunk, rng)
+
+def write_lineage(conn, transform, upstream, downstream):
+  """Replace `transform`'s rows in COLUMN_LINEAGE for `downstream`."""
+  conn.execute("CREATE TABLE IF NOT EXISTS COLUMN_LINEAGE(\n  {}\n)".format(
+    ",\n  ".join("{} {}".format(column, dtype) for column, dtype in LINEAGE_SCHEMA)
+  ))
+  with conn:
+    conn.execute(
+      "DELETE FROM COLUMN_LINEAGE WHERE TRANSFORM = ? AND DOWNSTREAM_TABLE = ?", (transform.name, downstream)
+    )
+    conn.executemany("INSERT INTO COLUMN_LINEAGE VALUES (?, ?, ?, ?, ?)", [
+      (transform.name, upstream, source, downstream, column)
+      for column, sources in transform.lineage().items()
+      for source in sources
+    ])
+
+def _floats(values, name):
+  return pd.to_numeric(pd.Series(values[name]), errors="coerce").to_numpy(dtype=float)
+
+def passthrough(name):
+  return lambda values, rng, n: values[name]
+
+def _perihelion(values, rng, n):
+  return _floats(values, "eccentricity") * _floats(values, "orbital_period") * ORBIT_SCALE
+
+def _aphelion(values, rng, n):
+  return (2 - _floats(values, "eccentricity")) * _floats(values, "orbital_period") * ORBIT_SCALE
+
+def _temp(low, high, sentinel):
+  def fn(values, rng, n):
+    avg_temp, eccentricity = _floats(values, "avg_temp"), _floats(values, "eccentricity")
+    temp = (low + (high - low) * rng.random(n)) * avg_temp
+    temp[~np.isnan(avg_temp) & ~np.isnan(eccentricity) & (rng.random(n) <= SENTINEL_PROB)] = sentinel
+    return temp
+  return fn
+
+def _habitability(values, rng, n):
+  h = rng.random(n)
+  h[(values["min_temp"] == MIN_TEMP_SENTINEL) | (values["max_temp"] == MAX_TEMP_SENTINEL)] = 0
+  return h
+
+def duplicate_zero_habitability(df, values, rng):
+  """Follow every zero-habitability row with a second row with the same _id."""
+  n = len(df)
+  dupes = np.flatnonzero(df["habitability"].to_numpy() == 0)
+  avg_temp = _floats(values, "avg_temp")[dupes]
+  dupe_df = df.iloc[dupes].copy()
+  dupe_df["habitability"] = rng.random(len(dupes))
+  dupe_df["min_temp"] = rng.random(len(dupes)) * avg_temp
+  dupe_df["max_temp"] = (1 + rng.random(len(dupes))) * avg_temp
+  order = np.argsort(np.concatenate([np.arange(n), dupes]), kind="stable")
+  return pd.concat([df, dupe_df]).iloc[order].reset_index(drop=True)
+
+HABITABLES_COLUMNS = [
+  Column("_id", ["_id"], passthrough("_id")),
+  Column("perihelion", ["eccentricity", "orbital_period"], _perihelion),
+  Column("aphelion", ["eccentricity", "orbital_period"], _aphelion),
+  Column("atmosphere", ["atmosphere"], passthrough("atmosphere")),
+  Column("min_temp", ["avg_temp", "eccentricity"], _temp(0, 1, MIN_TEMP_SENTINEL)),
+  Column("max_temp", ["avg_temp", "eccentricity"], _temp(1, 2, MAX_TEMP_SENTINEL)),
+  Column("habitability", ["min_temp", "max_temp"], _habitability),
+  Column("date_added", ["date_added"], passthrough("date_added")),
+]
+HABITABLES_OUTPUT = ["_id", "perihelion", "aphelion", "atmosphere", "habitability", "min_temp", "max_temp", "date_added"]
+
+HABITABLES = Transform("habitables", HABITABLES_COLUMNS, HABITABLES_OUTPUT)
+HABITABLES_WITH_DUPLICATES = Transform(
+  "habitables_with_duplicates", HABITABLES_COLUMNS, HABITABLES_OUTPUT, [duplicate_zero_habitability]
+)
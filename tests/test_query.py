@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""The memoized query layer under thread contention.
+
+Many threads, each with its own connections to several databases (more
+connections than the cache registry holds), hammer `read_sql` and
+`fetch_all` at once, as the runner's workers do. Statement timeouts must
+interrupt long statements and leave nothing behind once cleared.
+
+  $ python -m unittest tests.test_query
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data import query, trace
+
+LONG_SQL = "WITH RECURSIVE R(X) AS (SELECT 1 UNION ALL SELECT X + 1 FROM R WHERE X < 3000000) SELECT COUNT(*) FROM R"
+THREADS = 16
+DATABASES = 4
+ROUNDS = 300
+
+class ThreadedReadSqlTest(unittest.TestCase):
+  def setUp(self):
+    self.workdir = tempfile.mkdtemp()
+    self.paths = []
+    for i in range(DATABASES):
+      path = os.path.join(self.workdir, "{}.db".format(i))
+      conn = sqlite3.connect(path)
+      conn.execute("CREATE TABLE T(DATE_ADDED TEXT, VALUE INTEGER)")
+      conn.executemany("INSERT INTO T VALUES (?, ?)", [("2020-01-{:02d}".format(day), i) for day in range(1, 29)])
+      conn.commit()
+      conn.close()
+      self.paths.append(path)
+
+  def tearDown(self):
+    query.set_max_connections(query.MAX_CONNECTIONS)
+    query.clear_cache()
+    shutil.rmtree(self.workdir)
+
+  def hammer(self, errors):
+    def work(seed):
+      try:
+        connections = [query.connect(path, check_same_thread=False) for path in self.paths]
+        for n in range(ROUNDS):
+          i = (seed + n) % DATABASES
+          day = "2020-01-{:02d}".format(n % 28 + 1)
+          df = query.read_sql(connections[i], "SELECT VALUE FROM T WHERE DATE_ADDED = ?", (day,))
+          rows = query.fetch_all(connections[i], "SELECT COUNT(*) FROM T WHERE VALUE = ?", (i,))
+          if df["VALUE"].tolist() != [i] or rows != [(28,)]:
+            errors.append("thread {} got {} and {}".format(seed, df["VALUE"].tolist(), rows))
+        for conn in connections: conn.close()
+      except Exception as e:
+        errors.append("{}: {}".format(type(e).__name__, e))
+
+    # switch threads as often as possible to widen any race window
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+      threads = [threading.Thread(target=work, args=(seed,)) for seed in range(THREADS)]
+      for thread in threads: thread.start()
+      for thread in threads: thread.join()
+    finally:
+      sys.setswitchinterval(interval)
+
+  def test_registry_smaller_than_pool(self):
+    errors = []
+    query.set_max_connections(THREADS)
+    self.hammer(errors)
+    self.assertEqual(errors, [])
+
+  def test_registry_sized_for_pool(self):
+    errors = []
+    query.set_max_connections(THREADS * DATABASES)
+    self.hammer(errors)
+    self.assertEqual(errors, [])
+    hits = sum(cache.hits for _, cache in list(query._caches.values()))
+    self.assertGreater(hits, 0)
+
+class StatementTimeoutTest(unittest.TestCase):
+  def test_interrupts_long_statement(self):
+    conn = query.connect(":memory:")
+    query.set_statement_timeout(conn, 0.01, 100)
+    with self.assertRaises(sqlite3.OperationalError):
+      query.fetch_all(conn, LONG_SQL)
+    query.set_statement_timeout(conn, None)
+    self.assertEqual(query.fetch_all(conn, LONG_SQL), [(3000000,)])
+    conn.close()
+
+  def test_cleared_timeout_leaves_no_state(self):
+    for _ in range(100):
+      conn = query.connect(":memory:")
+      query.set_statement_timeout(conn, 0.01, 100)
+      query.set_statement_timeout(conn, None)
+      conn.close()
+    self.assertEqual(trace._handlers, {})
+    # a fresh connection (possibly at a reused address) has no deadline
+    conn = query.connect(":memory:")
+    query.restart_timeout(conn)
+    self.assertEqual(conn.execute(LONG_SQL).fetchall(), [(3000000,)])
+    conn.close()
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Ryan Othniel Kearns"
+__maintainer__ = "Ryan Othniel Kearns"
+__email__ = "rkearns@montecarlodata.com"
+
+"""The online detector on streams generated by `helpers/make_data.py`.
+
+Each stream is 400 hourly row counts ~ N(50000, 10000) with three halved
+points (107-109), a near-zero point (110) and five zeros (111-115). A halved
+point is only ~2.5 standard deviations low, so no point-wise detector catches
+all of them without flooding the rest of the stream with alerts; the bounds
+below are what the defaults achieve on these seeds.
+
+  $ python -m unittest tests.test_stream
+"""
+
+import numpy as np
+import os
+import runpy
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+from data.stream import StreamDetector, read_points
+
+SEEDS = range(20)
+START = datetime(2020, 11, 1)
+HALVED = {107, 108, 109}
+OUTAGE = set(range(110, 116))
+
+def generate_stream(seed):
+  """Run make_data.py with numpy's global RNG seeded, returning its points."""
+  np.random.seed(seed)
+  cwd = os.getcwd()
+  with tempfile.TemporaryDirectory() as workdir:
+    os.mkdir(os.path.join(workdir, "data"))
+    os.chdir(workdir)
+    try:
+      runpy.run_path(os.path.join(ROOT, "helpers", "make_data.py"))
+      return list(read_points(os.path.join("data", "ex_1.csv")))
+    finally:
+      os.chdir(cwd)
+
+def alerted_hours(points):
+  return set(
+    (datetime.fromisoformat(alert["timestamp"]) - START) // timedelta(hours=1)
+    for alert in StreamDetector().process(points)
+  )
+
+class GeneratedStreamTest(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.alerts = [alerted_hours(generate_stream(seed)) for seed in SEEDS]
+
+  def test_outage_always_detected(self):
+    for seed, hours in zip(SEEDS, self.alerts):
+      self.assertTrue(OUTAGE <= hours, "seed {}: missed {}".format(seed, sorted(OUTAGE - hours)))
+
+  def test_halving_detected(self):
+    caught = [len(hours & HALVED) for hours in self.alerts]
+    self.assertGreaterEqual(np.mean([n > 0 for n in caught]), 0.9)
+    self.assertGreaterEqual(sum(caught) / (len(HALVED) * len(caught)), 0.6)
+
+  def test_false_positives_bounded(self):
+    false_positives = [len(hours - HALVED - OUTAGE) for hours in self.alerts]
+    self.assertLessEqual(np.mean(false_positives), 4)
+    self.assertLessEqual(max(false_positives), 8)
+
+if __name__ == "__main__":
+  unittest.main()